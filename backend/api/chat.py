@@ -1,24 +1,56 @@
-import traceback
-from fastapi import APIRouter, Request, HTTPException
-from core.schemas.interaction import InteractionPayload
+import logging
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator
+from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi.responses import StreamingResponse
+from core.schemas.interaction import InteractionPayload, InteractionBatchPayload
 from core.schemas.dashboard import DashboardSchema
 from core.services.session_service import session_service
+from api.responses import ORJSONResponse, dumps_json
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-@router.post("/interact", response_model=DashboardSchema)
-async def handle_interaction(request: Request, payload: InteractionPayload):
-    """
-    接收多模态输入（NLP/UI/Backtrack），执行 Workflow，返回看板 JSON。
-    """
-    workflow = request.app.state.workflow
-    session_id = payload.session_id
 
-    # 1. 基础检查
+@contextmanager
+def _bind(session_id: str) -> Iterator[Dict[str, Any]]:
     state = session_service.get_session(session_id)
     if not state:
         raise HTTPException(status_code=404, detail="Session 不存在，请重新上传数据")
 
+    token = session_service.bind_session(state)
+    try:
+        yield state
+    finally:
+        session_service.unbind_session(token)
+
+
+async def bound_session(payload: InteractionPayload) -> AsyncIterator[Dict[str, Any]]:
+    """
+    [优化] 请求入口只解析一次会话并绑定到 ContextVar，
+    Workflow 及 session_service 内部的后续查询直接复用，无需重复查表。
+    """
+    with _bind(payload.session_id) as state:
+        yield state
+
+
+async def bound_batch_session(batch: InteractionBatchPayload) -> AsyncIterator[Dict[str, Any]]:
+    with _bind(batch.session_id) as state:
+        yield state
+
+
+@router.post("/interact", response_model=DashboardSchema, response_class=ORJSONResponse)
+async def handle_interaction(
+        request: Request,
+        payload: InteractionPayload,
+        state: Dict[str, Any] = Depends(bound_session)
+):
+    """
+    接收多模态输入（NLP/UI/Backtrack），执行 Workflow，返回看板 JSON。
+    """
+    workflow = request.app.state.workflow
+
     try:
         # 2. 调用新版 Workflow
         # 全量数据的加载时机现已移动至 workflow 内部，以优化语义分析阶段的响应速度
@@ -29,8 +61,68 @@ async def handle_interaction(request: Request, payload: InteractionPayload):
             session_service=session_service  # 传入实例用于存取快照及按需触发全量加载
         )
 
-        return dashboard_json
+        # 直接返回 orjson 编码结果，跳过 response_model 的二次校验与序列化
+        return ORJSONResponse(dashboard_json)
 
     except Exception as e:
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"分析失败: {str(e)}")
\ No newline at end of file
+        logger.exception("interact failed", extra={"session_id": payload.session_id})
+        raise HTTPException(status_code=500, detail=f"分析失败: {str(e)}")
+
+
+@router.post("/interact_batch", response_model=DashboardSchema, response_class=ORJSONResponse)
+async def handle_interaction_batch(
+        request: Request,
+        batch: InteractionBatchPayload,
+        state: Dict[str, Any] = Depends(bound_batch_session)
+):
+    """
+    [新增] 批量交互：前端合并连续点击后一次提交，按顺序执行并返回最终看板。
+    """
+    workflow = request.app.state.workflow
+    if any(event.session_id != batch.session_id for event in batch.events):
+        raise HTTPException(status_code=400, detail="批量交互中的事件必须属于同一会话")
+
+    try:
+        dashboard_json = await workflow.execute_batch(batch.events, session_service=session_service)
+        return ORJSONResponse(dashboard_json)
+
+    except Exception as e:
+        logger.exception("interact batch failed", extra={"session_id": batch.session_id})
+        raise HTTPException(status_code=500, detail=f"分析失败: {str(e)}")
+
+
+def _sse_event(event: str, data: Any) -> bytes:
+    """按 Server-Sent Events 格式编码单个事件"""
+    return b"event: " + event.encode() + b"\ndata: " + dumps_json(data) + b"\n\n"
+
+
+@router.post("/interact/stream")
+async def handle_interaction_stream(
+        request: Request,
+        payload: InteractionPayload,
+        state: Dict[str, Any] = Depends(bound_session)
+):
+    """
+    [新增] /interact 的 SSE 版本：工作流每完成一个阶段推送一个事件
+    (plan_ready / code_generated / executed / dashboard)，失败时推送 error 事件。
+    """
+    workflow = request.app.state.workflow
+
+    async def event_stream() -> AsyncIterator[bytes]:
+        try:
+            async for event in workflow.execute_step_stream(
+                    payload=payload,
+                    data_summaries=state["summaries"],
+                    data_context=state["data_context"],
+                    session_service=session_service
+            ):
+                yield _sse_event(event.type, event.payload)
+        except Exception as e:
+            logger.exception("interact stream failed", extra={"session_id": payload.session_id})
+            yield _sse_event("error", {"detail": f"分析失败: {str(e)}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,11 +1,40 @@
 import os
-import shutil
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import APIRouter, UploadFile, File, Request, HTTPException
-from typing import List
+from typing import List, Optional, Tuple
 from core.services.session_service import session_service
 
 router = APIRouter()
 
+# [优化] 上传落盘使用独立线程池，并限制同时处理的上传请求数（背压），
+# 避免突发的大文件上传占满 anyio 默认线程池、拖慢其他接口
+MAX_CONCURRENT_UPLOADS = 4
+_upload_sem = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+_io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="upload-io")
+
+# 允许上传的扩展名 / 可作为主数据加载的扩展名（frozenset：O(1) 查找）
+ALLOWED_EXTENSIONS = frozenset({'.csv', '.parquet', '.json', '.geojson', '.gpkg', '.fgb', '.shp', '.shx', '.dbf', '.prj'})
+LOADABLE_EXTENSIONS = frozenset({'.csv', '.parquet', '.shp', '.geojson', '.json', '.gpkg', '.fgb'})
+
+# [优化] 拷贝缓冲区 4MB（默认 16KB），大文件落盘的系统调用次数减少约 250 倍
+_COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def _save_upload_file(src, file_path: str) -> str:
+    """
+    同步落盘：在线程池中执行，避免大文件写入阻塞事件循环。
+    写入的同时计算内容 SHA-256（单次遍历，无需回读），供语义分析缓存去重使用。
+    """
+    src.seek(0)
+    h = hashlib.sha256()
+    with open(file_path, "wb") as buffer:
+        while chunk := src.read(_COPY_BUFFER_SIZE):
+            buffer.write(chunk)
+            h.update(chunk)
+    return h.hexdigest()
+
 
 @router.post("/upload")
 async def upload_data(
@@ -23,36 +52,37 @@ async def upload_data(
     session_sandbox = os.path.join(sandbox_root, session_id)
     os.makedirs(session_sandbox, exist_ok=True)
 
-    ALLOWED_EXTENSIONS = ('.csv', '.parquet', '.json', '.geojson', '.shp', '.shx', '.dbf', '.prj')
-    LOADABLE_EXTENSIONS = ('.csv', '.parquet', '.shp', '.geojson', '.json')
-
-    saved_paths = []
-    load_targets = []
+    async def _save_one(file: UploadFile) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        """保存单个文件，返回 (保存路径, 可加载的主文件路径, 内容哈希)"""
+        # [关键修复] 清洗文件名：转小写、替换中划线和空格为下划线
+        # 确保文件名转变量名后（如 df_taxi_data）符合 Python 语法
+        clean_filename = file.filename.lower().replace("-", "_").replace(" ", "_")
+        ext = os.path.splitext(clean_filename)[1]
 
-    try:
-        for file in files:
-            # [关键修复] 清洗文件名：转小写、替换中划线和空格为下划线
-            # 确保文件名转变量名后（如 df_taxi_data）符合 Python 语法
-            clean_filename = file.filename.lower().replace("-", "_").replace(" ", "_")
+        if ext not in ALLOWED_EXTENSIONS:
+            return None, None, None
 
-            if not clean_filename.endswith(ALLOWED_EXTENSIONS): continue
+        file_path = os.path.join(session_sandbox, clean_filename)
+        loop = asyncio.get_running_loop()
+        content_hash = await loop.run_in_executor(_io_pool, _save_upload_file, file.file, file_path)
 
-            file_path = os.path.join(session_sandbox, clean_filename)
-            with open(file_path, "wb") as buffer:
-                await file.seek(0)
-                shutil.copyfileobj(file.file, buffer)
+        # 筛选主文件用于加载
+        load_target = file_path if ext in LOADABLE_EXTENSIONS else None
+        return file_path, load_target, content_hash
 
-            saved_paths.append(file_path)
-
-            # 筛选主文件用于加载
-            if clean_filename.endswith(LOADABLE_EXTENSIONS):
-                load_targets.append(file_path)
+    try:
+        # [优化] 多个文件（如 Shapefile 的 .shp/.shx/.dbf/.prj）并发落盘，总耗时取决于最大的文件
+        async with _upload_sem:
+            results = await asyncio.gather(*(_save_one(f) for f in files))
+        saved_paths = [path for path, _, _ in results if path]
+        load_targets = [target for _, target, _ in results if target]
+        file_hashes = {target: content_hash for _, target, content_hash in results if target}
 
         if not load_targets:
             raise HTTPException(status_code=400, detail="未找到有效的主数据文件")
 
         # 初始化 Session (此时会生成包含时间维度的基础画像)
-        session_state = session_service.create_session(session_id, load_targets)
+        session_state = session_service.create_session(session_id, load_targets, file_hashes=file_hashes)
 
         return {
             "status": "success",
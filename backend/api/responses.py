@@ -0,0 +1,47 @@
+import numpy as np
+import orjson
+import pandas as pd
+import pydantic_core
+from typing import Any
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+def _orjson_default(obj: Any) -> Any:
+    """orjson 无法原生处理的类型兜底：Pydantic 模型、Pandas 时间戳等"""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, pd.Timestamp):
+        return obj.isoformat()
+    if hasattr(obj, "to_plotly_json"):
+        return obj.to_plotly_json()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps_json(content: Any) -> bytes:
+    """统一的 orjson 编码入口（HTTP 响应与 SSE 事件共用）"""
+    if isinstance(content, BaseModel):
+        # [优化] Pydantic 模型直接由 pydantic-core (Rust) 编码为 bytes，
+        # 省去 model_dump() 生成中间 dict 再交给 orjson 的第二次遍历
+        return pydantic_core.to_json(content, fallback=_orjson_default)
+    return orjson.dumps(
+        content,
+        default=_orjson_default,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+    )
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    基于 orjson 的 JSON 响应：
+    1. 在 C 层完成编码，大体积看板 (Plotly data_payload) 的序列化耗时约为标准库的 1/3。
+    2. 原生支持 numpy 数组/标量与 datetime；NaN/Inf 输出为 null，保证前端可解析。
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
@@ -1,32 +1,103 @@
-from fastapi import APIRouter, HTTPException
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from fastapi import APIRouter, HTTPException, Request, Response
 from core.services.session_service import session_service
+from core.execution.executor import ARROW_MEDIA_TYPE
 
 router = APIRouter()
 
+# [优化] 轮询接口的短时响应缓存: {(namespace, session_id): (过期时间, 版本, 响应)}
+# 前端每次 rerun 都会轮询 status，短 TTL 即可吸收绝大部分重复请求
+_CACHE_TTL_SECONDS = 3
+_CACHE_MAXSIZE = 256
+_response_cache: Dict[Tuple[str, str], Tuple[float, Optional[str], Dict[str, Any]]] = {}
+
+
+def _cached_response(
+        namespace: str,
+        session_id: str,
+        builder: Callable[[], Dict[str, Any]],
+        version: Optional[str] = None
+) -> Dict[str, Any]:
+    """version 不一致时视为未命中，保证带 ETag 的响应体与 ETag 同步"""
+    key = (namespace, session_id)
+    now = time.monotonic()
+    hit = _response_cache.get(key)
+    if hit and hit[0] > now and hit[1] == version:
+        return hit[2]
+
+    value = builder()
+    if len(_response_cache) >= _CACHE_MAXSIZE:
+        # 容量上限：先清理过期项，仍然满则整体清空
+        for k in [k for k, (expire_at, _, _) in _response_cache.items() if expire_at <= now]:
+            del _response_cache[k]
+        if len(_response_cache) >= _CACHE_MAXSIZE:
+            _response_cache.clear()
+    _response_cache[key] = (now + _CACHE_TTL_SECONDS, version, value)
+    return value
+
+
+def _invalidate_cache(session_id: str):
+    for key in [k for k in _response_cache if k[1] == session_id]:
+        del _response_cache[key]
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """判断客户端 If-None-Match 是否命中当前 ETag（支持逗号分隔的多个值与 *）"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in candidates
+
 
 @router.get("/{session_id}/status")
-async def get_session_status(session_id: str):
+async def get_session_status(session_id: str, request: Request, response: Response):
     """获取会话实时状态"""
     state = session_service.get_session(session_id)
     if not state:
         return {"active": False}
 
+    # [优化] 状态只在 /interact 完成或切换全量数据时变化：ETag 命中直接返回 304，不组装 JSON
     store = state.get("state_store")
-    return {
-        "active": True,
-        "session_id": session_id,
-        "is_full_data": state.get("is_full_data", False),
-        "snapshot_count": len(store.snapshots) if store else 0,
-        "current_snapshot_id": store.current_snapshot_id if store else None
-    }
+    etag = (
+        f'W/"{store.current_snapshot_id if store else None}-'
+        f'{len(store.history) if store else 0}-{int(state.get("is_full_data", False))}"'
+    )
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    def build():
+        return {
+            "active": True,
+            "session_id": session_id,
+            "is_full_data": state.get("is_full_data", False),
+            "snapshot_count": len(store.history) if store else 0,
+            "current_snapshot_id": store.current_snapshot_id if store else None
+        }
+
+    return _cached_response("session-status", session_id, build, version=etag)
 
 
 @router.get("/{session_id}/history")
-async def get_session_history(session_id: str):
+async def get_session_history(session_id: str, request: Request, response: Response):
     """
     获取历史快照列表
     用于驱动原型图左侧的“历史对话区域”
     """
+    state = session_service.get_session(session_id)
+    if state:
+        # 历史序列只追加不修改：首尾 ID + 数量即可唯一标识历史列表
+        history = state["state_store"].history
+        etag = (
+            f'W/"h-{history[0]["snapshot_id"] if history else None}-'
+            f'{history[-1]["snapshot_id"] if history else None}-{len(history)}"'
+        )
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+
     history = session_service.get_history_list(session_id)
     if not history and not session_service.get_session(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
@@ -47,32 +118,24 @@ async def get_session_metadata(session_id: str):
     if not state:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    metadata = {
-        "session_id": session_id,
-        "temporal": [],  # 存储识别到的时间特征
-        "variables": []
-    }
-
-    for summary in state.get("summaries", []):
-        var_name = summary.get("variable_name")
-        metadata["variables"].append(var_name)
+    # 投影在建会话/同步元数据时已预先计算，这里只做 O(1) 拼装
+    return {"session_id": session_id, **state["_metadata_projection"]}
 
-        # 提取时间上下文
-        sem = summary.get("semantic_analysis", {})
-        temp_ctx = sem.get("temporal_context", {})
 
-        if temp_ctx and temp_ctx.get("primary_time_col"):
-            metadata["temporal"].append({
-                "variable": var_name,
-                "column": temp_ctx.get("primary_time_col"),
-                "span": temp_ctx.get("time_span"),
-                "suggested_resampling": temp_ctx.get("suggested_resampling")
-            })
-
-    return metadata
+@router.get("/{session_id}/artifacts/{artifact_id}")
+async def get_session_artifact(session_id: str, artifact_id: str):
+    """
+    [新增] 下载大表格结果的 Arrow IPC 字节流，前端用 pyarrow.ipc.open_stream 直接还原为 DataFrame。
+    """
+    data = session_service.get_artifact(session_id, artifact_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    # 内容按 ID 不可变，允许客户端长期缓存
+    return Response(content=data, media_type=ARROW_MEDIA_TYPE, headers={"Cache-Control": "private, max-age=3600"})
 
 
 @router.delete("/{session_id}")
 async def clear_session(session_id: str):
     session_service.delete_session(session_id)
+    _invalidate_cache(session_id)
     return {"status": "cleared", "session_id": session_id}
\ No newline at end of file
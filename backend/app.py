@@ -1,13 +1,38 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import uuid
+import orjson
+import pyarrow as pa
 import plotly.graph_objects as go
 from datetime import datetime
 
 # --- 配置 ---
 st.set_page_config(layout="wide", page_title="NL-STV Pro - 高交互时空分析平台")
 API_BASE_URL = "http://localhost:8000/api/v1"
+# (连接超时, 读取超时)：分析接口包含 LLM 调用与全量计算，读取超时需放宽
+TIMEOUT_SHORT = (2, 30)
+TIMEOUT_ANALYSIS = (2, 300)
+PLOTLY_CONFIG = {"staticPlot": False, "responsive": True}
+WEBGL_POINT_THRESHOLD = 5000
+
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """
+    [优化] 复用到后端的 HTTP 连接 (keep-alive)：
+    Streamlit 每次交互都会重跑整个脚本，cache_resource 保证连接池只创建一次。
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=2, backoff_factor=0.1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+http = get_http_session()
 
 # --- Session 状态初始化 ---
 if "session_id" not in st.session_state:
@@ -15,32 +40,163 @@ if "session_id" not in st.session_state:
     st.session_state.current_dashboard = None  # 当前显示的看板快照
     st.session_state.history = []  # 左侧历史快照列表
     st.session_state.uploaded = False
+    st.session_state.history_version = 0  # 产生新快照后递增，用于失效历史列表缓存
+    st.session_state.pending_events = []  # 待提交的 UI 交互 (脚本末尾合并为一次批量请求)
 
 
 # --- 工具函数：调用后端接口 ---
+# SSE 阶段事件 -> 进度提示
+STAGE_LABELS = {
+    "plan_ready": "🧭 看板布局已规划，正在生成代码...",
+    "code_generated": "🧩 代码已生成，正在执行数据计算...",
+    "executed": "📊 数据计算完成，正在生成洞察...",
+}
+
+
+def _iter_sse(resp):
+    """解析 text/event-stream 响应，逐个产出 (event, data)"""
+    event, data_lines = "message", []
+    for line in resp.iter_lines(decode_unicode=True):
+        if not line:
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
+
 def call_interact(payload):
     try:
-        resp = requests.post(f"{API_BASE_URL}/chat/interact", json=payload)
-        if resp.status_code == 200:
-            st.session_state.current_dashboard = resp.json()
-            # 每次交互完，刷新历史列表
+        # [优化] 通过 SSE 接收分阶段进度，首个事件到达即可反馈，而非空等完整结果
+        with http.post(f"{API_BASE_URL}/chat/interact/stream", json=payload, stream=True,
+                       timeout=TIMEOUT_ANALYSIS) as resp:
+            if resp.status_code != 200:
+                st.error(f"分析失败: {resp.text}")
+                return
+
+            dashboard = None
+            with st.status("🚀 正在分析...", expanded=False) as status:
+                for event, data in _iter_sse(resp):
+                    if event in STAGE_LABELS:
+                        status.update(label=STAGE_LABELS[event])
+                    elif event == "dashboard":
+                        dashboard = data
+                        status.update(label="✅ 分析完成", state="complete")
+                    elif event == "error":
+                        status.update(label="❌ 分析失败", state="error")
+                        st.error(data.get("detail", "未知错误"))
+
+        if dashboard is not None:
+            st.session_state.current_dashboard = dashboard
+            # 每次交互完都会生成新快照：递增版本号并刷新历史列表
+            st.session_state.history_version += 1
             update_history_list()
             st.rerun()
-        else:
-            st.error(f"分析失败: {resp.text}")
     except Exception as e:
         st.error(f"连接失败: {e}")
 
 
+def enqueue_interaction(payload):
+    """
+    [优化] UI 交互先入队，在脚本末尾统一提交：请求进行中用户继续点击时，
+    Streamlit 会中断本次运行并重跑，未提交成功的事件保留在队列中，与新事件合并为一次请求。
+    """
+    st.session_state.pending_events.append(payload)
+
+
+def flush_pending_events():
+    events = st.session_state.pending_events
+    if not events:
+        return
+    try:
+        with st.spinner(f"🚀 正在分析 {len(events)} 个交互..."):
+            resp = http.post(f"{API_BASE_URL}/chat/interact_batch",
+                             json={"session_id": st.session_state.session_id, "events": events},
+                             timeout=TIMEOUT_ANALYSIS)
+        st.session_state.pending_events = []
+        if resp.status_code != 200:
+            st.error(f"分析失败: {resp.text}")
+            return
+        st.session_state.current_dashboard = orjson.loads(resp.content)
+        st.session_state.history_version += 1
+        update_history_list()
+        st.rerun()
+    except requests.RequestException as e:
+        st.session_state.pending_events = []
+        st.error(f"连接失败: {e}")
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_history(session_id: str, version: int):
+    """[优化] 历史列表缓存：只有 version 变化 (产生了新快照) 时才重新请求后端"""
+    resp = http.get(f"{API_BASE_URL}/session/{session_id}/history", timeout=TIMEOUT_SHORT)
+    resp.raise_for_status()
+    return resp.json().get("history", [])
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _fetch_snapshot(session_id: str, snapshot_id: str):
+    """[优化] 快照一经生成便不可变：同一快照重复回溯时直接复用缓存，不再请求后端"""
+    payload = {
+        "session_id": session_id,
+        "trigger_type": "backtrack",
+        "target_snapshot_id": snapshot_id
+    }
+    resp = http.post(f"{API_BASE_URL}/chat/interact", json=payload, timeout=TIMEOUT_SHORT)
+    resp.raise_for_status()
+    return resp.json()
+
+
 def update_history_list():
     try:
-        resp = requests.get(f"{API_BASE_URL}/session/{st.session_state.session_id}/history")
-        if resp.status_code == 200:
-            st.session_state.history = resp.json().get("history", [])
+        st.session_state.history = _fetch_history(st.session_state.session_id, st.session_state.history_version)
     except:
         pass
 
 
+def open_snapshot(snapshot_id: str):
+    try:
+        st.session_state.current_dashboard = _fetch_snapshot(st.session_state.session_id, snapshot_id)
+    except Exception as e:
+        st.error(f"快照回溯失败: {e}")
+        return
+    st.rerun()
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _fetch_artifact(session_id: str, artifact_id: str):
+    """[新增] Arrow IPC 表格结果：列式二进制传输，无需逐行解析 JSON；artifact 内容不可变，可长期缓存"""
+    resp = http.get(f"{API_BASE_URL}/session/{session_id}/artifacts/{artifact_id}", timeout=TIMEOUT_SHORT)
+    if resp.status_code != 200:
+        return None
+    return pa.ipc.open_stream(resp.content).read_all().to_pandas()
+
+
+@st.cache_resource(show_spinner=False, max_entries=128)
+def _build_fig(payload_json: str, height: int) -> go.Figure:
+    """
+    [优化] 缓存 Plotly Figure 构建：以序列化后的 payload 字符串与高度为键，
+    历史组件在每次 rerun 时无需重复解析与校验。
+    使用 cache_resource 直接返回同一对象 (cache_data 会 pickle 返回值，命中时经构造函数重建 Figure，
+    等于每次都重新校验)；返回的 Figure 被多次 rerun 共享，调用方只读不改，高度等差异一律放进缓存键。
+    """
+    payload = json.loads(payload_json)
+    # 大散点改用 WebGL (后端已对新结果处理，这里兼容旧快照)
+    for trace in payload.get("data") or []:
+        if isinstance(trace, dict) and trace.get("type") == "scatter" and len(trace.get("x") or []) > WEBGL_POINT_THRESHOLD:
+            trace["type"] = "scattergl"
+
+    # 移除图表对象内部可能存在的标题，实现彻底去冗余
+    if "layout" in payload and "title" in payload["layout"]:
+        payload["layout"]["title"] = None
+
+    fig = go.Figure(payload)
+    fig.update_layout(height=height, margin=dict(l=10, r=10, t=10, b=10))
+    return fig
+
+
 def render_visual_component(comp, height=400):
     """
     通用组件渲染器：具备高度容错性
@@ -54,19 +210,24 @@ def render_visual_component(comp, height=400):
     try:
         # 1. 尝试作为 Plotly 图表渲染 (处理 Dict 类型的 payload)
         if isinstance(payload, dict) and ("data" in payload or "layout" in payload):
-            # 移除图表对象内部可能存在的标题，实现彻底去冗余
-            if "layout" in payload and "title" in payload["layout"]:
-                payload["layout"]["title"] = None
+            fig = _build_fig(orjson.dumps(payload).decode(), height)
+            # theme=None：跳过 Streamlit 主题对 Figure 的二次改写；稳定的 key 让前端复用同一图表节点做增量更新
+            st.plotly_chart(fig, use_container_width=True, key=f"viz_{comp['id']}", theme=None,
+                            config=PLOTLY_CONFIG)
 
-            fig = go.Figure(payload)
-            fig.update_layout(height=height, margin=dict(l=10, r=10, t=10, b=10))
-            st.plotly_chart(fig, use_container_width=True, key=f"viz_{comp['id']}")
+        # 2. 大表格：按 artifact_id 拉取 Arrow 字节流还原为 DataFrame
+        elif isinstance(payload, dict) and payload.get("format") == "arrow" and payload.get("artifact_id"):
+            df = _fetch_artifact(st.session_state.session_id, payload["artifact_id"])
+            if df is None:
+                st.warning(f"表格数据已过期 ({payload.get('rows', '?')} 行)，请重新分析")
+            else:
+                st.dataframe(df, use_container_width=True, height=height)
 
-        # 2. 尝试作为数据表格渲染 (处理 List 类型的 payload，即 DataFrame records)
+        # 3. 尝试作为数据表格渲染 (处理 List 类型的 payload，即 DataFrame records)
         elif isinstance(payload, list):
             st.dataframe(payload, use_container_width=True, height=height)
 
-        # 3. 兜底：如果是字符串或未知字典
+        # 4. 兜底：如果是字符串或未知字典
         else:
             st.write(payload)
 
@@ -91,10 +252,11 @@ with st.sidebar:
         uploaded_files = st.file_uploader("上传 CSV / Parquet / Shapefile", accept_multiple_files=True)
         if uploaded_files and st.button("初始化环境"):
             files_list = [('files', (f.name, f, f.type)) for f in uploaded_files]
-            resp = requests.post(f"{API_BASE_URL}/data/upload", params={"session_id": st.session_state.session_id},
-                                 files=files_list)
+            resp = http.post(f"{API_BASE_URL}/data/upload", params={"session_id": st.session_state.session_id},
+                             files=files_list, timeout=TIMEOUT_ANALYSIS)
             if resp.status_code == 200:
                 st.session_state.uploaded = True
+                st.session_state.history_version += 1
                 st.success("数据已就绪")
                 update_history_list()
 
@@ -109,15 +271,74 @@ with st.sidebar:
             # 点击历史条目进行“回溯”
             btn_label = f"🕒 {item['time']}\n{item['summary']}"
             if st.button(btn_label, key=item['snapshot_id'], use_container_width=True):
-                payload = {
-                    "session_id": st.session_state.session_id,
-                    "trigger_type": "backtrack",
-                    "target_snapshot_id": item['snapshot_id']
-                }
-                call_interact(payload)
+                open_snapshot(item['snapshot_id'])
 
 # --- 主界面布局 (左中右+下结构) ---
 
+# [优化] 每个组件渲染为独立的 fragment：组件内控件触发的重跑只执行该 fragment，
+# 只有真正产生了新交互事件时才整页重跑 (提交批量请求并刷新看板)
+def _submit_interaction(payload):
+    enqueue_interaction(payload)
+    st.rerun(scope="app")
+
+
+@st.fragment
+def render_center_component(comp):
+    st.subheader(f"📍 {comp['title']}")
+    render_visual_component(comp, height=600)
+
+    # 模拟地图框选交互 (联动触发源)
+    c1, c2 = st.columns(2)
+    if c1.button("🔍 模拟框选该区域 (纽约 BBox)", key=f"bbox_{comp['id']}"):
+        _submit_interaction({
+            "session_id": st.session_state.session_id,
+            "trigger_type": "ui",
+            "active_component_id": comp['id'],
+            # 纽约坐标范围
+            "bbox": [-74.02, 40.69, -73.85, 40.82],
+        })
+
+    # [新增] 模拟时间维度交互
+    if c2.button("🕒 模拟选择高峰时段 (Time Range)", key=f"time_{comp['id']}"):
+        _submit_interaction({
+            "session_id": st.session_state.session_id,
+            "trigger_type": "ui",
+            "active_component_id": comp['id'],
+            # 模拟 2025年1月1日 早高峰范围
+            "time_range": ["2025-01-01 07:00:00", "2025-01-01 10:00:00"],
+        })
+
+
+@st.fragment
+def render_sidebar_component(comp):
+    with st.container(border=True):
+        st.write(f"**{comp['title']}**")
+        render_visual_component(comp, height=350)
+
+        # 联动模拟：点选特定 ID
+        if st.button(f"🔗 选中实体下钻", key=f"link_{comp['id']}"):
+            _submit_interaction({
+                "session_id": st.session_state.session_id,
+                "trigger_type": "ui",
+                "active_component_id": comp['id'],
+                "selected_ids": ["sample_id_001"]  # 模拟点击选中
+            })
+
+
+@st.fragment
+def render_insight_component(comp):
+    st.markdown(f"### 💡 {comp['title']}")
+    config = comp.get("insight_config", {})
+    if config:
+        st.info(config.get("summary", "无摘要结论"))
+        st.markdown(config.get("detail", "暂无深度分析内容"))
+        tags = config.get("tags", [])
+        if tags:
+            st.markdown(" ".join([f"[:blue[{t}]]" for t in tags]))
+    else:
+        render_visual_component(comp, height=200)
+
+
 if st.session_state.current_dashboard:
     db = st.session_state.current_dashboard
 
@@ -138,63 +359,18 @@ if st.session_state.current_dashboard:
     # 1. 中间主区域：通常是大地图
     with col_main:
         for comp in center_maps:
-            st.subheader(f"📍 {comp['title']}")
-            render_visual_component(comp, height=600)
-
-            # 模拟地图框选交互 (联动触发源)
-            c1, c2 = st.columns(2)
-            if c1.button("🔍 模拟框选该区域 (纽约 BBox)", key=f"bbox_{comp['id']}"):
-                payload = {
-                    "session_id": st.session_state.session_id,
-                    "trigger_type": "ui",
-                    "active_component_id": comp['id'],
-                    # 纽约坐标范围
-                    "bbox": [-74.02, 40.69, -73.85, 40.82],
-                }
-                call_interact(payload)
-
-            # [新增] 模拟时间维度交互
-            if c2.button("🕒 模拟选择高峰时段 (Time Range)", key=f"time_{comp['id']}"):
-                payload = {
-                    "session_id": st.session_state.session_id,
-                    "trigger_type": "ui",
-                    "active_component_id": comp['id'],
-                    # 模拟 2025年1月1日 早高峰范围
-                    "time_range": ["2025-01-01 07:00:00", "2025-01-01 10:00:00"],
-                }
-                call_interact(payload)
+            render_center_component(comp)
 
     # 2. 右侧边栏：统计图表或明细表
     with col_right:
         st.markdown("### 📊 维度统计")
         for comp in right_sidebar_items:
-            with st.container(border=True):
-                st.write(f"**{comp['title']}**")
-                render_visual_component(comp, height=350)
-
-                # 联动模拟：点选特定 ID
-                if st.button(f"🔗 选中实体下钻", key=f"link_{comp['id']}"):
-                    payload = {
-                        "session_id": st.session_state.session_id,
-                        "trigger_type": "ui",
-                        "active_component_id": comp['id'],
-                        "selected_ids": ["sample_id_001"]  # 模拟点击选中
-                    }
-                    call_interact(payload)
+            render_sidebar_component(comp)
 
     # 3. 下方全宽区域：AI 智能洞察结果
     st.markdown("---")
     for comp in bottom_insights:
-        st.markdown(f"### 💡 {comp['title']}")
-        config = comp.get("insight_config", {})
-        if config:
-            st.info(config.get("summary", "无摘要结论"))
-            st.markdown(config.get("detail", "暂无深度分析内容"))
-            tags = config.get("tags", [])
-            if tags:
-                st.markdown(" ".join([f"[:blue[{t}]]" for t in tags]))
-        else:
-            render_visual_component(comp, height=200)
+        render_insight_component(comp)
 
 else:
     # 初始状态提示
@@ -212,4 +388,7 @@ if prompt := st.chat_input("输入分析指令 (例如: 分析曼哈顿地区的
             "query": prompt,
             "force_new": False
         }
-        call_interact(payload)
\ No newline at end of file
+        call_interact(payload)
+
+# 提交本轮运行中累积的 UI 交互
+flush_pending_events()
@@ -5,18 +5,266 @@ import plotly.graph_objects as go
 import numpy as np
 import random
 import json
+import base64
+import orjson
+import pyarrow as pa
 from shapely.geometry import Point, Polygon, LineString
 import traceback
-import sys
 import io
 import textwrap
-from typing import Dict, Any, List, Optional
+import builtins
+import hashlib
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from types import CodeType, MappingProxyType
+from typing import Dict, Any, Hashable, List, Optional
 import logging
 from pydantic import BaseModel
 
+from core.execution.spatial import bbox_filter
+
 logger = logging.getLogger(__name__)
 
 
+# [优化] 看板代码专用执行线程池：pandas/numpy 的大部分计算会释放 GIL，
+# 放到独立线程池中执行既不阻塞事件循环，也不占用 Starlette 的通用线程池
+EXECUTION_WORKERS = 4
+EXECUTION_POOL = ThreadPoolExecutor(max_workers=EXECUTION_WORKERS, thread_name_prefix="sandbox-exec")
+
+# 沙箱内置函数：显式提供 __builtins__，exec 不再向 globals 隐式注入完整的 builtins 模块；
+# 移除动态执行、文件读写与交互类函数。保留 __import__：生成代码按约定需要显式 import 常用库
+_BLOCKED_BUILTINS = frozenset({
+    "eval", "exec", "compile", "open", "input", "breakpoint", "exit", "quit", "help"
+})
+_SANDBOX_BUILTINS = {
+    name: value for name, value in vars(builtins).items() if name not in _BLOCKED_BUILTINS
+}
+
+# 编译缓存：{源码 blake2b 摘要: 字节码}，键只保存 16 字节摘要而非整段源码
+_COMPILE_CACHE_SIZE = 256
+_compile_cache: "OrderedDict[bytes, CodeType]" = OrderedDict()
+_compile_lock = threading.Lock()
+
+
+def _code_digest(code: str) -> bytes:
+    return hashlib.blake2b(code.encode("utf-8"), digest_size=16).digest()
+
+
+def _compile_sandbox(code: str) -> CodeType:
+    """
+    [优化] 缓存生成代码的编译结果：联动钻取、重试、回放经常执行完全相同的代码，
+    命中缓存时跳过词法/语法分析与字节码生成。
+    """
+    key = _code_digest(code)
+    with _compile_lock:
+        code_obj = _compile_cache.get(key)
+        if code_obj is not None:
+            _compile_cache.move_to_end(key)
+            return code_obj
+
+    # 不使用 optimize=2：生成代码常用 assert 做数据校验，剥离后错误无法回传给 LLM 修复
+    code_obj = compile(code, "<sandbox>", "exec")
+    with _compile_lock:
+        _compile_cache[key] = code_obj
+        if len(_compile_cache) > _COMPILE_CACHE_SIZE:
+            _compile_cache.popitem(last=False)
+    return code_obj
+
+
+# [新增] 执行结果缓存：{(调用方缓存键, 代码摘要, 组件列表): (结果 JSON, Arrow 产物)}
+# 以序列化后的 bytes 保存，每次命中都还原出独立的对象，下游原地修改载荷不会污染缓存
+RESULT_CACHE_SIZE = 32
+
+
+# [优化] 大规模散点：超过阈值改用 WebGL 渲染，超过下采样阈值时按步长抽稀
+WEBGL_POINT_THRESHOLD = 5000
+DOWNSAMPLE_THRESHOLD = 20000
+DOWNSAMPLE_TARGET = 5000
+
+
+# [优化] 行数达到阈值的表格结果改用 Arrow IPC 传输，不再展开为逐行 JSON
+ARROW_MIN_ROWS = 1000
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def _to_arrow_ipc(df: pd.DataFrame) -> Optional[bytes]:
+    """DataFrame -> Arrow IPC 流；含几何列或混合类型列等无法转换时返回 None (回退为 JSON)"""
+    if isinstance(df, gpd.GeoDataFrame):
+        return None
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return None
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+# 洞察摘要中记录长度的 trace 属性
+_PREVIEW_KEYS = ('x', 'y', 'lat', 'lon', 'values')
+
+
+def _point_array(value: Any) -> Optional[np.ndarray]:
+    """
+    逐点属性转为数组 (第 0 维为点)：支持普通列表与 Plotly 6 的 typed array ({"dtype", "bdata"[, "shape"]})。
+    无法解码时返回 None。
+    """
+    if isinstance(value, list):
+        # 逐元素填入一维对象数组：二维 customdata 等嵌套列表按行保留，不做形状推断
+        return np.fromiter(value, dtype=object, count=len(value))
+    if isinstance(value, dict) and "bdata" in value:
+        try:
+            arr = np.frombuffer(base64.b64decode(value["bdata"]), dtype=value["dtype"])
+            if "shape" in value:
+                arr = arr.reshape([int(d) for d in str(value["shape"]).split(",")])
+        except (KeyError, TypeError, ValueError):
+            return None
+        return arr
+    return None
+
+
+def _take_points(value: Any, idx: np.ndarray) -> Any:
+    """按索引沿第 0 维抽取逐点属性，并保持原有编码格式"""
+    if isinstance(value, list):
+        return [value[i] for i in idx.tolist()]
+    arr = _point_array(value)[idx]
+    taken = {"dtype": value["dtype"], "bdata": base64.b64encode(arr.tobytes()).decode("ascii")}
+    if "shape" in value:
+        taken["shape"] = ", ".join(str(d) for d in arr.shape)
+    return taken
+
+
+def _point_slots(container: dict, n: int, slots: list) -> bool:
+    """
+    递归收集长度为 n 的逐点属性 (x/y、customdata、marker.*、error_y.array 等) 到 slots。
+    遇到无法解码的 typed array 时返回 False：此时无法保证抽稀后各属性仍逐点对齐。
+    """
+    for key, value in container.items():
+        if key == "selectedpoints":
+            continue
+        if isinstance(value, dict) and "bdata" in value:
+            arr = _point_array(value)
+            if arr is None:
+                return False
+            if arr.ndim and len(arr) == n:
+                slots.append((container, key))
+        elif isinstance(value, dict):
+            if not _point_slots(value, n, slots):
+                return False
+        elif isinstance(value, list) and len(value) == n:
+            slots.append((container, key))
+    return True
+
+
+def optimize_plotly_payload(payload: Any) -> Any:
+    """
+    对 Plotly JSON 中的大散点 trace 做渲染优化 (原地修改并返回)：
+    1. 点数 > WEBGL_POINT_THRESHOLD：scatter -> scattergl，浏览器端由 SVG 改为单次 WebGL 绘制。
+    2. 点数 > DOWNSAMPLE_THRESHOLD：均匀步长抽稀至 DOWNSAMPLE_TARGET，同步裁剪所有逐点属性
+       (含二维 customdata、误差棒) 并重映射 selectedpoints；任一逐点属性无法裁剪时只切换 WebGL，不抽稀。
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get("data"), list):
+        return payload
+
+    for trace in payload["data"]:
+        if not isinstance(trace, dict) or trace.get("type", "scatter") not in ("scatter", "scattergl"):
+            continue
+        x = _point_array(trace.get("x"))
+        n = len(x) if x is not None and x.ndim else 0
+        if n <= WEBGL_POINT_THRESHOLD:
+            continue
+
+        trace["type"] = "scattergl"
+        if n <= DOWNSAMPLE_THRESHOLD:
+            continue
+        slots: list = []
+        if not _point_slots(trace, n, slots):
+            continue
+        selected = trace.get("selectedpoints")
+        if selected is not None:
+            selected = _point_array(selected) if isinstance(selected, (list, dict)) else None
+            if selected is None or selected.ndim != 1:
+                continue
+
+        idx = np.unique(np.linspace(0, n - 1, DOWNSAMPLE_TARGET).round().astype(np.int64))
+        for container, key in slots:
+            container[key] = _take_points(container[key], idx)
+        if selected is not None:
+            # 选中点索引映射到抽稀后的位置 (未被保留的选中点随之丢弃)
+            trace["selectedpoints"] = np.flatnonzero(np.isin(idx, selected.astype(np.int64))).tolist()
+
+    return payload
+
+
+def _orjson_fallback(obj: Any) -> Any:
+    """orjson 无法原生编码的类型：按前端需要的结构展开"""
+    # [优化] Plotly Figure 最常见，优先匹配：由 Plotly 一次性导出 (数值数组编码为 typed array)
+    if isinstance(obj, go.Figure):
+        return obj.to_plotly_json()
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, pd.DataFrame):
+        return obj.to_dict(orient="records")
+    if isinstance(obj, pd.Series):
+        return obj.to_dict()
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, pd.Timestamp):
+        return obj.isoformat()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if hasattr(obj, "to_plotly_json"):
+        return obj.to_plotly_json()
+    if hasattr(obj, "__geo_interface__"):
+        return obj.__geo_interface__
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return str(obj)
+
+
+def _stringify_keys(obj: Any) -> Any:
+    """递归展开容器，将非基础类型的字典键转为字符串"""
+    if isinstance(obj, go.Figure):
+        return obj.to_plotly_json()  # 键均为字符串，无需展开
+    if isinstance(obj, BaseModel):
+        obj = obj.model_dump()
+    elif isinstance(obj, (pd.Series, pd.DataFrame)):
+        obj = _orjson_fallback(obj)
+    if isinstance(obj, dict):
+        return {
+            (k if isinstance(k, (str, int, float, bool)) or k is None
+             else k.isoformat() if isinstance(k, pd.Timestamp) else str(k)): _stringify_keys(v)
+            for k, v in obj.items()
+        }
+    if isinstance(obj, (list, tuple)):
+        return [_stringify_keys(v) for v in obj]
+    return obj
+
+
+def _format_sandbox_error(exc: BaseException, code: str) -> str:
+    """
+    [优化] 返回给 LLM 修复的错误信息只保留生成代码 (<sandbox>) 内的栈帧：
+    pandas/plotly 内部的几十层栈帧不再逐帧格式化，同时补全沙箱栈帧对应的源码行。
+    """
+    lines = code.splitlines()
+    parts = ["Traceback (most recent call last):\n"]
+    tb = exc.__traceback__
+    while tb is not None:
+        frame_code = tb.tb_frame.f_code
+        if frame_code.co_filename == "<sandbox>":
+            parts.append(f'  File "<sandbox>", line {tb.tb_lineno}, in {frame_code.co_name}\n')
+            if 0 < tb.tb_lineno <= len(lines):
+                parts.append(f"    {lines[tb.tb_lineno - 1].strip()}\n")
+        tb = tb.tb_next
+    parts.extend(traceback.format_exception_only(type(exc), exc))
+    return "".join(parts)
+
+
 class ComponentResult(BaseModel):
     """单个组件的执行结果"""
     component_id: str
@@ -31,12 +279,16 @@ class DashboardExecutionResult(BaseModel):
     global_insight_data: Dict[str, Any] = {}
     error: Optional[str] = None
     code: str = ""
+    # [新增] 大表格结果的 Arrow IPC 字节流 {component_id: bytes}，对应组件的 data 为占位信息
+    artifacts: Dict[str, bytes] = {}
 
 
 class CodeExecutor:
     def __init__(self):
         # 预加载常用库，防止 LLM 忘记 import 导致报错
-        self.global_context = {
+        # 只读模板：每次执行复制一份作为 globals，上一次执行写入的全局变量不会泄漏到下一次
+        self.global_context = MappingProxyType({
+            "__builtins__": _SANDBOX_BUILTINS,
             "pd": pd,
             "gpd": gpd,
             "px": px,
@@ -47,8 +299,11 @@ class CodeExecutor:
             "Point": Point,
             "Polygon": Polygon,
             "LineString": LineString,
+            "bbox_filter": bbox_filter,
             "print": print
-        }
+        })
+        self._result_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._result_lock = threading.Lock()
 
     def _dedent_code(self, code: str) -> str:
         """精准去除多余缩进"""
@@ -56,49 +311,160 @@ class CodeExecutor:
 
     def _make_serializable(self, obj: Any) -> Any:
         """
-        [增强] 递归将 Numpy/Pandas 类型转换为 Python 原生类型，防止序列化报错
+        [优化] 通过 orjson 一次往返把 Numpy/Pandas/Plotly 对象转换为 Python 原生类型：
+        数组与标量在 C 层编码，替代逐元素的递归 isinstance 判断；NaN/Inf 统一转为 None。
         """
-        # 1. 处理 Numpy 基础类型
-        if isinstance(obj, (np.integer, np.int64, np.int32, np.int16, np.int8)):
-            return int(obj)
-        elif isinstance(obj, (np.floating, np.float64, np.float32, np.float16)):
-            if np.isnan(obj) or np.isinf(obj): return None
-            return float(obj)
-        elif isinstance(obj, (np.bool_, bool)):
-            return bool(obj)
-        # 2. [新增] 处理 Pandas 时间戳
-        elif isinstance(obj, pd.Timestamp):
-            return obj.isoformat()
-        # 3. 处理集合/数组
-        elif isinstance(obj, np.ndarray):
-            return self._make_serializable(obj.tolist())
-        elif isinstance(obj, dict):
-            return {k: self._make_serializable(v) for k, v in obj.items()}
-        elif isinstance(obj, (list, tuple)):
-            return [self._make_serializable(v) for v in obj]
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        try:
+            return orjson.loads(orjson.dumps(obj, default=_orjson_fallback, option=option))
+        except TypeError:
+            # 时间索引 (pd.Timestamp)、MultiIndex 元组等键 orjson 无法处理：展开后统一转为字符串键再编码
+            try:
+                return orjson.loads(orjson.dumps(_stringify_keys(obj), default=_orjson_fallback, option=option))
+            except TypeError as e:
+                logger.warning(f"Result serialization fallback: {e}")
+                return obj
+
+    def _summarize_numeric(self, df: pd.DataFrame) -> Dict[str, Any]:
+        """[优化] 仅对数值列做 describe，避免 include='all' 对每个文本列执行 value_counts"""
+        num_df = df.select_dtypes(include=[np.number])
+        if num_df.columns.empty:
+            return {}
+        return num_df.describe(percentiles=[0.5]).to_dict()
+
+    def _summarize_object(self, df: pd.DataFrame) -> Dict[str, Any]:
+        """文本/类别列只保留基数与众数"""
+        obj_df = df.select_dtypes(include=["object", "category", "string"])
+        if obj_df.columns.empty:
+            return {}
+        nunique = obj_df.nunique()
+        modes = obj_df.mode()
+        top = modes.iloc[0] if not modes.empty else pd.Series(dtype=object)
+        return {
+            col: {"unique": int(nunique[col]), "top": top.get(col)}
+            for col in obj_df.columns
+        }
+
+    def _summarize_temporal(self, df: pd.DataFrame) -> Optional[Dict[str, Any]]:
+        """时间序列特征：首个数值列的峰谷与整体增长"""
+        is_time_index = pd.api.types.is_datetime64_any_dtype(df.index)
+
+        # [优化] 单次扫描 df.dtypes 同时判定时间列与首个数值列；宽表的列类型高度重复，按 dtype 记忆判定结果
+        has_time_col = False
+        num_col = None
+        kinds: Dict[Any, str] = {}
+        for col, dtype in df.dtypes.items():
+            kind = kinds.get(dtype)
+            if kind is None:
+                if pd.api.types.is_datetime64_any_dtype(dtype):
+                    kind = "time"
+                elif pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+                    kind = "number"
+                else:
+                    kind = "other"
+                kinds[dtype] = kind
+            if kind == "time":
+                has_time_col = True
+            elif kind == "number" and num_col is None:
+                num_col = col
+            if num_col is not None and (has_time_col or is_time_index):
+                break
+
+        if not (is_time_index or has_time_col) or num_col is None:
+            return None
+
+        series = df[num_col]
+        stats = series.agg(["max", "min", "idxmax", "idxmin"])
+        first, last = series.iat[0], series.iat[-1]
+        return {
+            "max_value": stats["max"],
+            "peak_time": str(stats["idxmax"]) if is_time_index else None,
+            "min_value": stats["min"],
+            "valley_time": str(stats["idxmin"]) if is_time_index else None,
+            "overall_growth": float((last - first) / first) if len(series) > 1 and first != 0 else 0
+        }
+
+    def _summarize_frame(self, res_obj: Any) -> Dict[str, Any]:
+        """DataFrame/Series 特征提取：小表直接给原始数据，大表给有界的统计摘要"""
+        summary = {}
+        df = res_obj.to_frame() if isinstance(res_obj, pd.Series) else res_obj
+
+        if len(res_obj) < 100:
+            summary["data_raw"] = res_obj.to_dict()
         else:
-            return obj
+            basic_stats = {**self._summarize_numeric(df), **self._summarize_object(df)}
+            if basic_stats:
+                summary["basic_stats"] = basic_stats
+
+        # --- [核心新增] 时间序列特征捕捉 ---
+        if isinstance(res_obj, pd.DataFrame):
+            temporal = self._summarize_temporal(res_obj)
+            if temporal:
+                summary["temporal_insights"] = temporal
+        return summary
+
+    def _cached_result(self, key: tuple, code: str) -> Optional[DashboardExecutionResult]:
+        with self._result_lock:
+            hit = self._result_cache.get(key)
+            if hit is None:
+                return None
+            self._result_cache.move_to_end(key)
+        payload_json, artifacts = hit
+        payload = orjson.loads(payload_json)
+        return DashboardExecutionResult(
+            success=True,
+            results=payload["results"],
+            global_insight_data=payload["global_insight_data"],
+            code=code,
+            artifacts=artifacts
+        )
+
+    def _store_result(self, key: tuple, result: DashboardExecutionResult):
+        try:
+            payload_json = orjson.dumps(
+                {"results": result.results, "global_insight_data": result.global_insight_data},
+                default=_orjson_fallback,
+                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+            )
+        except TypeError:
+            return  # 含无法编码的对象时不缓存
+        with self._result_lock:
+            self._result_cache[key] = (payload_json, dict(result.artifacts))
+            if len(self._result_cache) > RESULT_CACHE_SIZE:
+                self._result_cache.popitem(last=False)
 
     def execute_dashboard_logic(
             self,
             code_str: str,
             data_context: Dict[str, Any],
-            component_ids: List[str]
+            component_ids: List[str],
+            cache_key: Optional[Hashable] = None
     ) -> DashboardExecutionResult:
         """
-        执行看板逻辑并捕获多个组件结果，增加时间特征自动捕捉逻辑
+        执行看板逻辑并捕获多个组件结果，增加时间特征自动捕捉逻辑。
+        cache_key 由调用方提供 (如 会话ID + 数据版本)：同一数据上重复执行相同代码时直接复用上次的成功结果。
         """
         clean_code = self._dedent_code(code_str)
+        result_key = None
+        if cache_key is not None:
+            result_key = (cache_key, _code_digest(clean_code), tuple(component_ids))
+            cached = self._cached_result(result_key, clean_code)
+            if cached is not None:
+                logger.info("Dashboard logic served from result cache")
+                return cached
+
         local_scope = {}
 
-        old_stdout = sys.stdout
-        redirected_output = io.StringIO()
-        sys.stdout = redirected_output
+        # 沙箱内的 print 写入本次调用的缓冲区：多个执行线程并发时不能替换进程级的 sys.stdout。
+        # [优化] 代码中没有 print 调用时直接复用模板，不创建缓冲区
+        sandbox_globals = dict(self.global_context)
+        if "print(" in clean_code:
+            sandbox_globals["print"] = functools.partial(print, file=io.StringIO())
 
         try:
             logger.info("Executing dashboard logic...")
 
-            exec(clean_code, self.global_context, local_scope)
+            exec(_compile_sandbox(clean_code), sandbox_globals, local_scope)
 
             if "get_dashboard_data" not in local_scope:
                 raise ValueError("Generated code must contain 'get_dashboard_data(data_context)' function.")
@@ -107,6 +473,8 @@ class CodeExecutor:
 
             final_results = {}
             insight_payload = {}
+            frame_summaries: Dict[tuple, Dict[str, Any]] = {}
+            artifacts: Dict[str, bytes] = {}
 
             for cid in component_ids:
                 if cid in all_results:
@@ -116,48 +484,26 @@ class CodeExecutor:
                     try:
                         # 3.1 DataFrame 特征提取 (增强时间分析)
                         if isinstance(res_obj, (pd.DataFrame, pd.Series)):
-                            # 基础描述统计
-                            if len(res_obj) < 100:
-                                if hasattr(res_obj, 'to_dict'):
-                                    summary["data_raw"] = res_obj.to_dict()
-                            else:
-                                if hasattr(res_obj, 'describe'):
-                                    desc = res_obj.describe(include='all').to_dict()
-                                    summary["basic_stats"] = {k: v for k, v in desc.items() if isinstance(v, dict)}
-
-                            # --- [核心新增] 时间序列特征捕捉 ---
-                            target_df = res_obj if isinstance(res_obj, pd.DataFrame) else None
-                            if target_df is not None:
-                                time_cols = [c for c in target_df.columns if
-                                             pd.api.types.is_datetime64_any_dtype(target_df[c])]
-                                # 若索引是时间类型（resample 后的常态）
-                                is_time_index = pd.api.types.is_datetime64_any_dtype(target_df.index)
-
-                                if is_time_index or time_cols:
-                                    # 寻找数值列进行趋势分析
-                                    num_cols = target_df.select_dtypes(include=[np.number]).columns
-                                    if not num_cols.empty:
-                                        col = num_cols[0]
-                                        summary["temporal_insights"] = {
-                                            "max_value": target_df[col].max(),
-                                            "peak_time": str(target_df[col].idxmax()) if is_time_index else None,
-                                            "min_value": target_df[col].min(),
-                                            "valley_time": str(target_df[col].idxmin()) if is_time_index else None,
-                                            "overall_growth": float((target_df[col].iloc[-1] - target_df[col].iloc[0]) /
-                                                                    target_df[col].iloc[0]) if len(target_df) > 1 and
-                                                                                               target_df[col].iloc[
-                                                                                                   0] != 0 else 0
-                                        }
+                            # 同一对象被多个组件引用时只提取一次
+                            frame_key = (id(res_obj), res_obj.shape)
+                            if frame_key not in frame_summaries:
+                                frame_summaries[frame_key] = self._summarize_frame(res_obj)
+                            summary = dict(frame_summaries[frame_key])
 
                         # 3.2 Plotly Figure 特征提取
                         elif hasattr(res_obj, 'data') and len(res_obj.data) > 0:
                             trace = res_obj.data[0]
+                            # [优化] 直接读取 trace 内部的原始属性字典，跳过 Plotly 属性校验器的 __getattr__ 链
+                            props = getattr(trace, '_props', None) or {}
                             trace_stats = {}
-                            for key in ['x', 'y', 'lat', 'lon', 'values']:
-                                if hasattr(trace, key) and getattr(trace, key) is not None:
-                                    arr = getattr(trace, key)
-                                    if hasattr(arr, '__len__'):
-                                        trace_stats[key] = {"count": len(arr)}
+                            for key in _PREVIEW_KEYS:
+                                arr = props.get(key)
+                                if arr is None:
+                                    continue
+                                if hasattr(arr, 'shape'):
+                                    trace_stats[key] = {"count": int(arr.shape[0]) if arr.ndim else 1}
+                                elif hasattr(arr, '__len__'):
+                                    trace_stats[key] = {"count": len(arr)}
                             if trace_stats: summary["figure_preview"] = trace_stats
 
                         # 3.3 文本
@@ -170,27 +516,38 @@ class CodeExecutor:
                     if summary:
                         insight_payload[cid] = summary
 
+                    arrow_bytes = None
+                    if isinstance(res_obj, pd.DataFrame) and len(res_obj) >= ARROW_MIN_ROWS:
+                        arrow_bytes = _to_arrow_ipc(res_obj)
+                    if arrow_bytes is not None:
+                        artifacts[cid] = arrow_bytes
+
                     final_results[cid] = ComponentResult(
                         component_id=cid,
-                        data=res_obj,
+                        data=res_obj if arrow_bytes is None else {
+                            "format": "arrow", "rows": len(res_obj), "columns": [str(c) for c in res_obj.columns]
+                        },
                         summary_stats=summary
                     )
 
-            sys.stdout = old_stdout
             clean_results = self._make_serializable(final_results)
             clean_insight = self._make_serializable(insight_payload)
 
-            return DashboardExecutionResult(
+            result = DashboardExecutionResult(
                 success=True,
                 results=clean_results,
                 global_insight_data=clean_insight,
-                code=clean_code
+                code=clean_code,
+                artifacts=artifacts
             )
+            if result_key is not None:
+                self._store_result(result_key, result)
+            return result
 
-        except Exception:
-            sys.stdout = old_stdout
-            error_trace = traceback.format_exc()
-            logger.error(f"Execution Failed:\n{error_trace}")
+        except Exception as e:
+            error_trace = _format_sandbox_error(e, clean_code)
+            # 完整堆栈交给日志处理器按需格式化
+            logger.error("Execution Failed:\n%s", error_trace, exc_info=True)
             return DashboardExecutionResult(
                 success=False,
                 error=error_trace,
@@ -1,10 +1,33 @@
 import logging
+import orjson
 from typing import Dict, Any, List
 from core.llm.AI_client import AIClient
 from core.schemas.dashboard import InsightCard
 
 logger = logging.getLogger(__name__)
 
+# 写入 Prompt 的统计摘要最大字符数
+MAX_STATS_CHARS = 8000
+
+_SYSTEM_ROLE = (
+    "你是一位资深的商业数据分析专家。\n"
+    "你的任务是根据提供的【数据统计摘要】和【语义上下文】，针对用户的【分析需求】生成深刻的业务洞察。\n"
+)
+
+_SYSTEM_RULES = """=== 写作准则 ===
+1. 事实驱动：只评论统计数据中存在的特征（均值、最大值、分布等）。
+2. 业务导向：不要只说“均值是10”，要说“该区域的平均通行成本较高，约为10元”或“该时段的业务量处于全天峰值”。
+3. 发现异常：特别关注统计数据中的极值、异常点或明显的突变。
+4. 时空深度结合：不仅描述“哪里多”，还要描述“什么时候多”。分析时间趋势（增长/下降）、周期性（早晚高峰）和空间聚集的重合情况。
+5. 简明扼要：结论要直接，帮助用户快速理解可视化结果背后的业务问题。"""
+
+_USER_INSTRUCTIONS = """请根据以上信息，生成一份 InsightCard 格式的分析报告：
+1. summary: 一句话核心结论。
+2. detail: 包含 2-3 个核心特征点的深度解释（结合时空分布与趋势变化）。
+3. tags: 提取 3 个关键词标签（如: '高峰拥堵', '显著增长', '空间聚集', '早晚高峰', '周期性波动'）。
+
+请直接输出 JSON 结果。"""
+
 
 class InsightExtractor:
     """
@@ -16,6 +39,21 @@ class InsightExtractor:
     def __init__(self, llm_client: AIClient):
         self.llm = llm_client
 
+    @staticmethod
+    def _stats_json(execution_stats: Dict[str, Any]) -> str:
+        """
+        [优化] 统计摘要一次性编码为紧凑 JSON 并截断：
+        避免 str(dict) 逐个 repr NumPy 标量，也避免超大摘要把 Prompt 撑到 MB 级。
+        """
+        stats_json = orjson.dumps(
+            execution_stats,
+            default=str,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        ).decode("utf-8")
+        if len(stats_json) > MAX_STATS_CHARS:
+            stats_json = stats_json[:MAX_STATS_CHARS] + "...[truncated]"
+        return stats_json
+
     def generate_insights(
             self,
             query: str,
@@ -33,41 +71,21 @@ class InsightExtractor:
 
         # 1. 准备数据背景上下文
         # 提取语义标签，让 AI 知道数字代表的是“价格”、“经纬度”还是“时间轴”
-        semantic_context = ""
-        for s in summaries:
-            var_name = s.get('variable_name')
-            tags = s.get('semantic_analysis', {}).get('semantic_tags', {})
-            semantic_context += f"变量 `{var_name}` 的字段含义: {tags}\n"
-
-        # 2. 构建 Prompt
-        system_prompt = f"""
-        你是一位资深的商业数据分析专家。
-        你的任务是根据提供的【数据统计摘要】和【语义上下文】，针对用户的【分析需求】生成深刻的业务洞察。
-
-        === 数据语义背景 ===
-        {semantic_context}
-
-        === 写作准则 ===
-        1. 事实驱动：只评论统计数据中存在的特征（均值、最大值、分布等）。
-        2. 业务导向：不要只说“均值是10”，要说“该区域的平均通行成本较高，约为10元”或“该时段的业务量处于全天峰值”。
-        3. 发现异常：特别关注统计数据中的极值、异常点或明显的突变。
-        4. 时空深度结合：不仅描述“哪里多”，还要描述“什么时候多”。分析时间趋势（增长/下降）、周期性（早晚高峰）和空间聚集的重合情况。
-        5. 简明扼要：结论要直接，帮助用户快速理解可视化结果背后的业务问题。
-        """
-
-        user_prompt = f"""
-        用户的原始分析需求: "{query}"
-
-        执行后的数据统计摘要 (JSON 格式):
-        {execution_stats}
-
-        请根据以上信息，生成一份 InsightCard 格式的分析报告：
-        1. summary: 一句话核心结论。
-        2. detail: 包含 2-3 个核心特征点的深度解释（结合时空分布与趋势变化）。
-        3. tags: 提取 3 个关键词标签（如: '高峰拥堵', '显著增长', '空间聚集', '早晚高峰', '周期性波动'）。
-
-        请直接输出 JSON 结果。
-        """
+        semantic_context = "\n".join(
+            f"变量 `{s.get('variable_name')}` 的字段含义: {s.get('semantic_analysis', {}).get('semantic_tags', {})}"
+            for s in summaries
+        )
+
+        # 2. 构建 Prompt (固定部分为模块级常量，不携带源码缩进；语义背景置后以共享前缀缓存)
+        system_prompt = "\n".join([_SYSTEM_ROLE, _SYSTEM_RULES, "", "=== 数据语义背景 ===", semantic_context])
+        user_prompt = "\n".join([
+            f'用户的原始分析需求: "{query}"',
+            "",
+            "执行后的数据统计摘要 (JSON 格式):",
+            self._stats_json(execution_stats),
+            "",
+            _USER_INSTRUCTIONS
+        ])
 
         logger.info("Generating business insights from execution stats...")
 
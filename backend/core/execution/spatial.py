@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+from typing import List, Optional
+
+# bbox_filter 自动识别的经纬度列名 (小写)
+_LON_COLUMNS = ("lon", "lng", "longitude", "pickup_longitude", "x")
+_LAT_COLUMNS = ("lat", "latitude", "pickup_latitude", "y")
+
+# 选择率 (框选面积 / 数据范围面积) 低于该值且要素数超过下限时，才值得为查询构建 R-tree 索引
+SINDEX_MAX_SELECTIVITY = 0.05
+SINDEX_MIN_ROWS = 50_000
+
+
+def _geo_bbox_filter(
+        gdf: gpd.GeoDataFrame, min_lon: float, min_lat: float, max_lon: float, max_lat: float
+) -> gpd.GeoDataFrame:
+    """
+    [优化] 按选择率自适应选择过滤路径 (三条路径的结果一致，均为精确的 intersects 语义)：
+    1. 框选范围覆盖全部数据：直接返回全部非空几何，不做任何几何计算；
+    2. 小范围框选大数据集，或空间索引已构建：sindex 查询只触及候选要素；
+    3. 其余情况：一次向量化 intersects 扫描，省去为单次查询构建 R-tree 的开销。
+    """
+    t_minx, t_miny, t_maxx, t_maxy = gdf.total_bounds
+    if min_lon <= t_minx and min_lat <= t_miny and max_lon >= t_maxx and max_lat >= t_maxy:
+        geoms = gdf.geometry
+        return gdf[geoms.notna() & ~geoms.is_empty]
+
+    area = (t_maxx - t_minx) * (t_maxy - t_miny)
+    overlap = max(min(max_lon, t_maxx) - max(min_lon, t_minx), 0) * max(min(max_lat, t_maxy) - max(min_lat, t_miny), 0)
+    selectivity = overlap / area if area > 0 else 1.0
+
+    query_box = box(min_lon, min_lat, max_lon, max_lat)
+    if gdf.has_sindex or (selectivity < SINDEX_MAX_SELECTIVITY and len(gdf) > SINDEX_MIN_ROWS):
+        idx = gdf.sindex.query(query_box, predicate="intersects")
+        return gdf.iloc[np.sort(idx)]
+    return gdf[gdf.intersects(query_box)]
+
+
+def bbox_filter(
+        df: pd.DataFrame,
+        bbox: List[float],
+        lon_col: Optional[str] = None,
+        lat_col: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    [新增] 沙箱内置的框选过滤 bbox = [min_lon, min_lat, max_lon, max_lat]：
+    - GeoDataFrame：按框选选择率在 R-tree 空间索引 (sindex) 与向量化 intersects 扫描之间自适应选择；
+    - 普通 DataFrame：对经纬度列做向量化区间比较 (未指定列名时按常见列名自动识别)。
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if isinstance(df, gpd.GeoDataFrame):
+        return _geo_bbox_filter(df, min_lon, min_lat, max_lon, max_lat)
+
+    lower = {str(c).lower(): c for c in df.columns}
+    lon_col = lon_col or next((lower[c] for c in _LON_COLUMNS if c in lower), None)
+    lat_col = lat_col or next((lower[c] for c in _LAT_COLUMNS if c in lower), None)
+    if lon_col is None or lat_col is None:
+        raise KeyError(f"bbox_filter: cannot find longitude/latitude columns in {list(df.columns)}")
+
+    lon = df[lon_col].to_numpy()
+    lat = df[lat_col].to_numpy()
+    mask = (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+    return df[mask]
@@ -1,6 +1,12 @@
+import functools
 import logging
+import re
 import json
-from typing import Dict, Any, List, Optional
+import threading
+from concurrent.futures import Future
+import numpy as np
+from typing import Dict, Any, List, Optional, Tuple
+from pydantic import ValidationError
 
 from core.llm.AI_client import AIClient
 from core.schemas.dashboard import (
@@ -8,63 +14,122 @@ from core.schemas.dashboard import (
     LayoutZone, LayoutConfig, ComponentLink, InteractionType, ChartType, InsightCard
 )
 from core.generation.templates import LayoutTemplates
+from core.llm.batching import LLM_MAX_CONCURRENCY, gather_bounded
+from core.llm.token_budget import within_budget
+from core.llm.llm_cache import (
+    LLM_CACHE_DB_PATH, LLM_CACHE_WARM_SIZE, LLMResponseCache, PROMPT_CACHE_SIZE,
+    normalize_query, schema_fingerprint, shared_disk_tier, summaries_digest
+)
 
 logger = logging.getLogger(__name__)
 
+# LLM 返回的标准看板 JSON 必备的根字段，以及常见的包裹层键名
+_REQUIRED_KEYS = frozenset({"dashboard_id", "title", "components"})
+_WRAPPERS = ("dashboard", "plan", "result", "output")
 
-class DashboardPlanner:
+# 组件类型 -> 默认布局区域 (LLM 漏写或写错 zone 时据此补全)，未列出的类型归入右侧栏
+_DEFAULT_ZONES = {
+    ComponentType.MAP.value: LayoutZone.CENTER_MAIN.value,
+    ComponentType.INSIGHT.value: LayoutZone.BOTTOM_INSIGHT.value,
+}
+_VALID_ZONES = frozenset(z.value for z in LayoutZone)
+
+# 系统提示词中每个数据集最多列出的字段数 (宽表只保留信息量最高的列)
+MAX_PROMPT_COLUMNS = 40
+# 超出 token 预算时压缩字段数的下限
+MIN_PROMPT_COLUMNS = 5
+# 语义标签优先级：时空字段 > 指标 > 分类 > 其他
+_TAG_PRIORITY = {
+    "ST_TIME": 0, "ST_LAT": 0, "ST_LON": 0, "ST_GEO": 0,
+    "BIZ_METRIC": 1,
+    "BIZ_CAT": 2,
+}
+_UNRANKED = 3
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+# 宽表中与查询相关、但未进入系统提示词的字段，最多补充到用户提示词中的数量
+MAX_QUERY_COLUMNS = 10
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+# [新增] 规则规划：只有“纯模板”式的简单提问 (去掉客套/动词后只剩意图关键词) 才走规则，
+# 一旦提到具体指标、条件等实体就交给 LLM，避免误判
+_FILLER = r"(?:请|帮我|给我)?\s*(?:展示|显示|查看|看看|分析|看一下|分析一下|show|view)?\s*(?:一下)?\s*(?:数据|整体|全局|the|data)?\s*(?:的)?\s*"
+_RULE_INTENTS = {
+    "trend": re.compile(_FILLER + r"(?:时间|变化)?(?:趋势|走势|trends?)", re.IGNORECASE),
+    "distribution": re.compile(_FILLER + r"(?:空间|地理)?(?:分布|distribution)", re.IGNORECASE),
+    "overview": re.compile(_FILLER + r"(?:概览|总览|概况|overview)", re.IGNORECASE),
+    "topn": re.compile(_FILLER + r"(?:top\s*(?P<n1>\d+)|前\s*(?P<n2>\d+)\s*名?)\s*(?:排名)?", re.IGNORECASE),
+}
+_RULE_TITLES = {"trend": "时间趋势", "distribution": "空间分布", "overview": "数据概览", "topn": "排名"}
+_DEFAULT_INSIGHT = {"summary": "正在生成结论...", "detail": "请稍候。", "tags": []}
+
+
+def _cardinality(meta: Dict[str, Any]) -> float:
+    """LLM 给出的基数可能是数字或字符串 (如 '约 120')，无法解析时视为未知"""
+    value = meta.get("cardinality")
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER_RE.search(str(value or "").replace(",", ""))
+    return float(match.group()) if match else float("nan")
+
+
+def _select_salient_columns(col_meta: Dict[str, Dict[str, Any]], k: int = MAX_PROMPT_COLUMNS) -> List[str]:
     """
-    看板编排器 (V4.0 时空增强版)：
-    1. 动态感知数据基数与【时间跨度/粒度】，自动匹配最优图表选型（折线图、趋势图）。
-    2. 强制规划全局时间轴与组件重采样粒度 (time_bucket)。
-    3. 保持 V3.1 的鲁棒补全方案。
+    为 Prompt 挑选最有信息量的 k 个字段：
+    1. 按语义标签优先级排序 (ST_* > BIZ_METRIC > BIZ_CAT > 其他)；
+    2. 同级内指标优先高基数、分类优先低基数 (更适合做图表维度)，基数未知的排在后面；
+    3. 最后按列名保证顺序稳定。
     """
+    if len(col_meta) <= k:
+        return list(col_meta)
 
-    def __init__(self, llm_client: AIClient):
-        self.llm = llm_client
+    # [优化] 逐列只做标签/基数提取，排序交给 NumPy 的 lexsort (C 层多键排序)，不再为每列构造 Python 排序元组
+    names = list(col_meta)
+    metas = [m if isinstance(m, dict) else {} for m in col_meta.values()]
+    priority = np.fromiter(
+        (_TAG_PRIORITY.get(str(m.get("semantic_tag", "")).upper(), _UNRANKED) for m in metas),
+        dtype=np.int8, count=len(metas)
+    )
+    card = np.fromiter((_cardinality(m) for m in metas), dtype=np.float64, count=len(metas))
+    # 指标/时空字段优先高基数 (取负)，分类及其他优先低基数；基数未知 (NaN) 排在同级末尾
+    card_key = np.where(priority <= 1, -card, card)
+    card_key[np.isnan(card_key)] = np.inf
 
-    def _unwrap_llm_json(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        """从 LLM 返回的各类包裹层中提取标准的 Dashboard JSON"""
-        required_keys = {"dashboard_id", "title", "components"}
-        if not required_keys.issubset(set(data.keys())):
-            for wrapper in ['dashboard', 'plan', 'result', 'output']:
-                if wrapper in data and isinstance(data[wrapper], dict):
-                    return data[wrapper]
-        return data
+    order = np.lexsort((np.array(names, dtype=str), card_key, priority))[:k]
+    return [names[i] for i in order]
 
-    def _build_system_prompt(self, summaries: List[Dict[str, Any]]) -> str:
-        # 提取动态元数据上下文 (包含时间维度)
-        context_str = ""
-        for s in summaries:
-            var_name = s.get('variable_name')
-            sem_analysis = s.get('semantic_analysis', {})
-            col_meta = sem_analysis.get('column_metadata', {})
-            temp_context = sem_analysis.get('temporal_context', {})
-
-            context_str += f"\n### 数据集变量: {var_name}\n"
-            # 注入时间上下文
-            if temp_context:
-                context_str += (
-                    f"- 时间维度: 主轴 `{temp_context.get('primary_time_col')}` | "
-                    f"跨度: {temp_context.get('time_span')} | "
-                    f"建议聚合频率: `{temp_context.get('suggested_resampling')}`\n"
-                )
 
-            for col_raw, meta in col_meta.items():
-                context_str += (
-                    f"- 原始列名: `{col_raw}` | 中文概念: '{meta.get('concept_name')}' | "
-                    f"基数: {meta.get('cardinality')} | 标签: {meta.get('semantic_tag')}\n"
-                )
+def _select_query_columns(query: str, col_meta: Dict[str, Dict[str, Any]], exclude: set,
+                          k: int = MAX_QUERY_COLUMNS) -> List[str]:
+    """
+    挑出查询中提到、但未被 exclude (系统提示词已列出的字段) 覆盖的列：
+    列名 / 中文概念直接出现在查询中，或列名拆词后与查询中的英文词重合。
+    """
+    q = query.lower()
+    words = set(_WORD_RE.findall(q))
+    hits = []
+    for name, meta in col_meta.items():
+        if name in exclude:
+            continue
+        lowered = str(name).lower()
+        concept = str((meta or {}).get("concept_name") or "")
+        if (
+                lowered in q
+                or (len(concept) >= 2 and concept in query)
+                or any(len(w) >= 3 and w in words for w in _WORD_RE.findall(lowered))
+        ):
+            hits.append(name)
+            if len(hits) >= k:
+                break
+    return hits
 
-        layout_rules = LayoutTemplates.get_template_prompt()
 
-        prompt = f"""
+# [优化] 规划提示词的不变部分 (角色、布局规则、约束、JSON 模板) 在导入时一次性拼好，
+# 放在最前以便命中服务端前缀缓存；每次调用只追加数据上下文
+_PLANNER_PROMPT_PREFIX = f"""
         你是一位顶尖的智能数据分析师和时空可视化专家。请规划一个专业的分析看板。
 
-        === 数据元数据 (Metadata Context) ===
-        {context_str}
-
-        {layout_rules}
+        {LayoutTemplates.get_template_prompt()}
 
         === 🚨 严格布局约束 (CRITICAL) 🚨 ===
         1. 严禁使用 'left_sidebar' 或 'header'！只允许以下 Zone:
@@ -120,11 +185,336 @@ class DashboardPlanner:
                 }}
             ]
         }}
+
+        === 数据元数据 (Metadata Context) ===
+"""
+
+
+# 规划 JSON 中固定不变的开头，作为回复前缀预填给 LLM：省去这部分解码，也避免模型另套包裹层
+_PLAN_PREFILL = '{\n    "dashboard_id": "'
+
+
+# [优化] 兜底方案在导入时构建并完成布局对齐一次；失败路径 (如重试风暴) 只做一次深拷贝，
+# 不再重复 Pydantic 校验
+def _build_fallback_plan() -> DashboardSchema:
+    """兜底方案：提供结构完整的基础布局"""
+    fallback = DashboardSchema(
+        dashboard_id="fallback",
+        title="基础看板 (自动适配视图)",
+        components=[
+            DashboardComponent(
+                id="map_default", title="基础地理分布", type=ComponentType.MAP,
+                layout=LayoutConfig(zone=LayoutZone.CENTER_MAIN),
+                # [修复] 必须添加 map_config，否则前端 Deck.gl 不会渲染
+                map_config=[
+                    {
+                        "layer_id": "scatter_layer_fallback",
+                        "layer_type": "ScatterplotLayer",
+                        "data_api": "N/A",
+                        "opacity": 0.8
+                    }
+                ]
+            ),
+            DashboardComponent(
+                id="chart_default", title="核心维度统计", type=ComponentType.CHART,
+                layout=LayoutConfig(zone=LayoutZone.RIGHT_SIDEBAR),
+                chart_config={"chart_type": ChartType.BAR, "series_name": "记录数", "x_axis": "auto"}
+            ),
+            DashboardComponent(
+                id="insight_default", title="智能洞察结果", type=ComponentType.INSIGHT,
+                layout=LayoutConfig(zone=LayoutZone.BOTTOM_INSIGHT),
+                insight_config={
+                    "summary": "分析引擎已生成基础结论",
+                    "detail": "已提取出关键的数据分布特征供您参考。",
+                    "tags": ["Fallback", "Ready"]
+                }
+            )
+        ]
+    )
+    LayoutTemplates.apply_layout(fallback.components)
+    return fallback
+
+
+_FALLBACK_PLAN = _build_fallback_plan()
+
+
+# 规划缓存值的格式版本 (参与缓存键)：值的结构变化时递增，旧格式的持久化条目自然不再命中
+_PLAN_CACHE_FORMAT = 2
+
+
+class DashboardPlanner:
+    """
+    看板编排器 (V4.0 时空增强版)：
+    1. 动态感知数据基数与【时间跨度/粒度】，自动匹配最优图表选型（折线图、趋势图）。
+    2. 强制规划全局时间轴与组件重采样粒度 (time_bucket)。
+    3. 保持 V3.1 的鲁棒补全方案。
+    """
+
+    def __init__(self, llm_client: AIClient, cache_db: Optional[str] = LLM_CACHE_DB_PATH):
+        self.llm = llm_client
+        # [新增] 规划结果缓存：值为通过校验并完成布局对齐的最终规划 JSON (bytes)，命中时解析出新对象
+        # cache_db 为 None 时只使用内存缓存
+        # 重启后首次查询时预热最常用的规划 (如定时刷新的看板)，之后直接从内存命中
+        self.cache = LLMResponseCache(
+            "DashboardPlanner", disk=shared_disk_tier(cache_db) if cache_db else None,
+            warm_size=LLM_CACHE_WARM_SIZE
+        )
+        # [优化] 系统提示词缓存：同一数据集上的多轮提问复用已渲染的 Prompt
+        self._prompt_cache = LLMResponseCache("PlannerPrompt", maxsize=PROMPT_CACHE_SIZE, log_hits=False)
+        # 正在向 LLM 请求中的规划 (缓存键 -> Future)，用于合并并发的重复请求
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+
+    def _unwrap_llm_json(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """从 LLM 返回的各类包裹层中提取标准的 Dashboard JSON"""
+        # dict_keys 直接支持集合比较：逐个检查必备键，不像 issubset(dict) 那样先把全部键复制成新集合
+        if data.keys() >= _REQUIRED_KEYS:
+            return data
+        return next((data[w] for w in _WRAPPERS if isinstance(data.get(w), dict)), data)
+
+    @staticmethod
+    def _repair_plan(plan: Dict[str, Any]) -> bool:
+        """
+        [Option C] 鲁棒性后处理 (字典级，原地修改)：自动补全缺失字段。
+        返回是否做过任何修改。
+        """
+        repaired = False
+        if not plan.get("dashboard_id"):
+            plan["dashboard_id"], repaired = "dash_auto", True
+        if not plan.get("title"):
+            plan["title"], repaired = "智能分析看板", True
+        components = plan.get("components")
+        if not isinstance(components, list):
+            plan["components"], repaired = [], True
+            return repaired
+
+        for i, comp in enumerate(components):
+            if isinstance(comp, dict):
+                repaired = DashboardPlanner._repair_component(comp, i) or repaired
+        return repaired
+
+    @staticmethod
+    def _repair_component(comp: Dict[str, Any], i: int) -> bool:
+        """单个组件的补全：每个字段只读取一次并绑定为局部变量，缺失时直接写回"""
+        repaired = False
+        if not comp.get("title"):
+            comp["title"], repaired = f"分析详情 {i + 1}", True
+        if not comp.get("id"):
+            comp["id"], repaired = f"comp_{i}", True
+
+        c_type = comp.get("type")
+        if isinstance(c_type, str) and c_type != c_type.lower():
+            comp["type"] = c_type = c_type.lower()
+            repaired = True
+
+        layout = comp.get("layout")
+        if not isinstance(layout, dict):
+            comp["layout"] = layout = {}
+        if layout.get("zone") not in _VALID_ZONES:
+            layout["zone"], repaired = _DEFAULT_ZONES.get(c_type, LayoutZone.RIGHT_SIDEBAR.value), True
+
+        if c_type == "insight":
+            cfg = comp.get("insight_config")
+            if not isinstance(cfg, dict):
+                comp["insight_config"], repaired = {**_DEFAULT_INSIGHT, "tags": []}, True
+            elif "summary" not in cfg or "detail" not in cfg:
+                # 只缺部分字段时补齐，保留 LLM 已给出的内容
+                cfg.setdefault("summary", _DEFAULT_INSIGHT["summary"])
+                cfg.setdefault("detail", _DEFAULT_INSIGHT["detail"])
+                repaired = True
+        return repaired
+
+    def _validate_and_repair(self, plan: Dict[str, Any]) -> Tuple[DashboardSchema, bool]:
+        """
+        补全后校验一次。若只有个别组件非法，剔除这些组件后重新校验，
+        保留其余可用的规划，而不是整体退回兜底方案。
+        """
+        repaired = self._repair_plan(plan)
+        try:
+            return DashboardSchema.model_validate(plan), repaired
+        except ValidationError as e:
+            bad = set()
+            for err in e.errors():
+                loc = err["loc"]
+                if len(loc) < 2 or loc[0] != "components" or not isinstance(loc[1], int):
+                    raise
+                bad.add(loc[1])
+            if len(bad) >= len(plan["components"]):
+                raise
+            logger.warning(f"剔除 {len(bad)} 个不合法的组件: {sorted(bad)}")
+            plan["components"] = [c for i, c in enumerate(plan["components"]) if i not in bad]
+            return DashboardSchema.model_validate(plan), True
+
+    @staticmethod
+    def _match_rule_intent(query: str) -> Optional[Tuple[str, Optional[re.Match]]]:
+        """只看用户原始提问 (workflow 会在其后追加交互提示)，恰好命中一个模板才返回"""
+        text = (query or "").split("\n", 1)[0].strip().rstrip("。.!！?？")
+        hits = [(name, m) for name, pattern in _RULE_INTENTS.items() if (m := pattern.fullmatch(text))]
+        return hits[0] if len(hits) == 1 else None
+
+    def _try_rule_based_plan(self, query: str, summaries: List[Dict[str, Any]]) -> Optional[DashboardSchema]:
         """
+        [新增] 规则规划 (跳过 LLM)：
+        简单模板提问 (分布 / 趋势 / 概览 / Top N) 且单一数据集的语义标签无歧义时，直接按模板拼出看板；
+        任何不确定的情况返回 None，交给 LLM 规划。
+        """
+        matched = self._match_rule_intent(query)
+        if matched is None or len(summaries) != 1:
+            return None
+        intent, match = matched
+
+        sem = summaries[0].get("semantic_analysis", {}) or {}
+        by_tag: Dict[str, List[str]] = {}
+        for col in _select_salient_columns(sem.get("column_metadata", {}) or {}):
+            meta = sem["column_metadata"][col]
+            tag = str(meta.get("semantic_tag", "")).upper() if isinstance(meta, dict) else ""
+            by_tag.setdefault(tag, []).append(col)
+
+        times, metrics, cats = by_tag.get("ST_TIME", []), by_tag.get("BIZ_METRIC", []), by_tag.get("BIZ_CAT", [])
+        has_geo = bool(by_tag.get("ST_GEO")) or bool(by_tag.get("ST_LAT") and by_tag.get("ST_LON"))
+        temporal = sem.get("temporal_context", {}) or {}
+        time_col = temporal.get("primary_time_col") or (times[0] if len(times) == 1 else None)
+        metric = metrics[:1] or None
+
+        def trend_chart() -> Dict[str, Any]:
+            return {
+                "id": "trend_chart", "type": "chart", "title": "时间趋势分析",
+                "layout": {"zone": LayoutZone.RIGHT_SIDEBAR.value},
+                "chart_config": {
+                    "chart_type": ChartType.LINE.value, "x_axis": time_col, "y_axis": metric,
+                    "series_name": metric[0] if metric else "数量",
+                    "time_bucket": temporal.get("suggested_resampling") or "1H"
+                }
+            }
+
+        def rank_chart(n: int = 10) -> Dict[str, Any]:
+            return {
+                "id": "rank_chart", "type": "chart", "title": f"{cats[0]} Top {n}",
+                "layout": {"zone": LayoutZone.RIGHT_SIDEBAR.value},
+                "chart_config": {
+                    "chart_type": ChartType.BAR.value, "x_axis": cats[0], "y_axis": metric,
+                    "series_name": metric[0] if metric else "数量"
+                }
+            }
+
+        charts: List[Dict[str, Any]] = []
+        if intent == "trend":
+            if not time_col:
+                return None
+            charts.append(trend_chart())
+        elif intent == "distribution":
+            if not has_geo:
+                return None
+            if cats:
+                charts.append(rank_chart())
+        elif intent == "topn":
+            if not cats:
+                return None
+            charts.append(rank_chart(int(match.group("n1") or match.group("n2"))))
+        elif intent == "overview":
+            if not (has_geo and time_col and cats):
+                return None
+            charts.extend([trend_chart(), rank_chart()])
+
+        components: List[Dict[str, Any]] = []
+        if has_geo:
+            components.append({
+                "id": "main_map", "type": "map", "title": "空间分布",
+                "layout": {"zone": LayoutZone.CENTER_MAIN.value},
+                "map_config": [{"layer_id": "L1", "layer_type": "ScatterplotLayer", "data_api": "N/A"}]
+            })
+        components.extend(charts)
+        components.append({
+            "id": "global_insight", "type": "insight", "title": "数据洞察",
+            "layout": {"zone": LayoutZone.BOTTOM_INSIGHT.value},
+            "insight_config": {**_DEFAULT_INSIGHT, "tags": []}
+        })
+
+        plan = DashboardSchema(
+            dashboard_id=f"rule_{intent}",
+            title=f"{summaries[0].get('variable_name') or '数据'} · {_RULE_TITLES[intent]}",
+            components=components
+        )
+        LayoutTemplates.apply_layout(plan.components)
+        logger.info(f">>> [Planner] 命中规则模板 '{intent}'，跳过 LLM 规划")
+        return plan
+
+    def _build_system_prompt(self, summaries: List[Dict[str, Any]]) -> str:
+        key = summaries_digest(summaries)
+        prompt = self._prompt_cache.get(key)
+        if prompt is None:
+            prompt = self._render_system_prompt(summaries)
+            # [新增] 超出输入预算时逐步减少每个数据集列出的字段数，而不是把必然失败的请求发给 LLM
+            k = MAX_PROMPT_COLUMNS
+            while not within_budget(prompt) and k > MIN_PROMPT_COLUMNS:
+                k = max(MIN_PROMPT_COLUMNS, k // 2)
+                logger.warning(f">>> [Planner] 系统提示词超出 token 预算，字段数压缩至每个数据集 {k} 列")
+                prompt = self._render_system_prompt(summaries, max_columns=k)
+            self._prompt_cache.set(key, prompt)
         return prompt
 
+    @staticmethod
+    def _query_column_hint(query: str, summaries: List[Dict[str, Any]]) -> str:
+        """
+        [新增] 系统提示词只列出宽表中最有信息量的字段 (与查询无关，保证前缀缓存命中)；
+        查询明确提到的其余字段补充在用户提示词中，避免 LLM 看不到用户关心的列
+        """
+        lines: List[str] = []
+        for s in summaries:
+            col_meta = s.get('semantic_analysis', {}).get('column_metadata', {})
+            if len(col_meta) <= MAX_PROMPT_COLUMNS:
+                continue
+            listed = set(_select_salient_columns(col_meta, MAX_PROMPT_COLUMNS))
+            for col in _select_query_columns(query, col_meta, listed):
+                meta = col_meta[col] or {}
+                lines.append(
+                    f"- 数据集 `{s.get('variable_name')}` 原始列名: `{col}` | "
+                    f"中文概念: '{meta.get('concept_name')}' | 标签: {meta.get('semantic_tag')}"
+                )
+        if not lines:
+            return ""
+        logger.debug(f">>> [Planner] 为查询补充 {len(lines)} 个未列入系统提示词的相关字段")
+        return "\n        与查询相关的补充字段：\n        " + "\n        ".join(lines) + "\n        "
+
+    def _render_system_prompt(self, summaries: List[Dict[str, Any]], max_columns: int = MAX_PROMPT_COLUMNS) -> str:
+        # 提取动态元数据上下文 (包含时间维度)
+        lines: List[str] = []
+        for s in summaries:
+            var_name = s.get('variable_name')
+            sem_analysis = s.get('semantic_analysis', {})
+            col_meta = sem_analysis.get('column_metadata', {})
+            temp_context = sem_analysis.get('temporal_context', {})
+
+            lines.append(f"\n### 数据集变量: {var_name}")
+            # 注入时间上下文
+            if temp_context:
+                lines.append(
+                    f"- 时间维度: 主轴 `{temp_context.get('primary_time_col')}` | "
+                    f"跨度: {temp_context.get('time_span')} | "
+                    f"建议聚合频率: `{temp_context.get('suggested_resampling')}`"
+                )
+
+            # [优化] 宽表只列出最有信息量的字段，Prompt 长度不随列数增长
+            selected = _select_salient_columns(col_meta, max_columns)
+            for col_raw in selected:
+                meta = col_meta[col_raw]
+                lines.append(
+                    f"- 原始列名: `{col_raw}` | 中文概念: '{meta.get('concept_name')}' | "
+                    f"基数: {meta.get('cardinality')} | 标签: {meta.get('semantic_tag')}"
+                )
+            if len(selected) < len(col_meta):
+                lines.append(f"- (另有 {len(col_meta) - len(selected)} 个次要字段未列出)")
+        context_str = "\n".join(lines) + "\n" if lines else ""
+
+        # 只拼接可变的元数据段；不变前缀保持逐字节一致，保证服务端前缀缓存命中
+        return _PLANNER_PROMPT_PREFIX + "        " + context_str + "\n        "
+
     def plan_dashboard(self, query: str, summaries: List[Dict[str, Any]]) -> DashboardSchema:
         """核心方法：生成最优规划并应用后处理补全"""
+        rule_plan = self._try_rule_based_plan(query, summaries)
+        if rule_plan is not None:
+            return rule_plan
+
         system_prompt = self._build_system_prompt(summaries)
 
         user_prompt = f"""
@@ -134,71 +524,105 @@ class DashboardPlanner:
         1. 识别时间意图：如果涉及趋势变化，必须在右侧 RIGHT_SIDEBAR 规划一个折线图。
         2. 指定全局时间：根据元数据中的 time_span，在根级别设定合理的 global_time_range。
         3. 必须在所有组件中提供完整的 "title" 字段。
-        """
+        {self._query_column_hint(query, summaries)}"""
+
+        if not within_budget(system_prompt, user_prompt):
+            logger.error(">>> [Planner] Prompt 压缩后仍超出 token 预算，直接使用兜底方案")
+            return self._generate_fallback_plan(query)
 
         logger.info(f">>> [Planner] 正在规划时空看板...")
 
         try:
-            raw_plan = self.llm.query_json(prompt=user_prompt, system_prompt=system_prompt)
-            clean_plan = self._unwrap_llm_json(raw_plan)
-
-            # --- [Option C] 鲁棒性后处理：自动补全缺失字段 ---
-            if "components" in clean_plan:
-                for i, comp in enumerate(clean_plan["components"]):
-                    if not comp.get("title"):
-                        comp["title"] = f"分析详情 {i + 1}"
-                    if not comp.get("id"):
-                        comp["id"] = f"comp_{i}"
-                    if comp.get("type") == "insight":
-                        if "insight_config" not in comp or not isinstance(comp["insight_config"], dict):
-                            comp["insight_config"] = {"summary": "正在生成结论...", "detail": "请稍候。", "tags": []}
-
-            # 实例化校验
-            dashboard_plan = DashboardSchema(**clean_plan)
-
-            # 强制布局对齐
-            LayoutTemplates.apply_layout(dashboard_plan.components)
+            cache_key = self.cache.make_key(
+                query=normalize_query(query),
+                schema=schema_fingerprint(summaries),
+                system_prompt=system_prompt,
+                format=_PLAN_CACHE_FORMAT
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                # [优化] 缓存的是已补全、已对齐布局的最终规划 JSON：由 pydantic-core 直接从字节解析 + 校验，
+                # 跳过中间 dict、解包、补全与布局对齐
+                return DashboardSchema.model_validate_json(cached)
 
-            return dashboard_plan
+            return self._plan_single_flight(cache_key, user_prompt, system_prompt, summaries)
 
-        except Exception as e:
+        # [优化] 只有已知的 LLM 输出格式问题/网络故障才走兜底；其余异常属于代码缺陷，记录堆栈后直接抛出
+        except (ValidationError, KeyError, TypeError, json.JSONDecodeError, ValueError,
+                TimeoutError, ConnectionError) as e:
             logger.error(f"Dashboard planning failed, reverting to fallback. Error: {e}")
             return self._generate_fallback_plan(query)
+        except Exception:
+            logger.exception(">>> [Planner] 规划过程出现未预期异常")
+            raise
 
-    def _generate_fallback_plan(self, query: str) -> DashboardSchema:
-        """兜底方案：提供结构完整的基础布局"""
-        fallback = DashboardSchema(
-            dashboard_id="fallback",
-            title="基础看板 (自动适配视图)",
-            components=[
-                DashboardComponent(
-                    id="map_default", title="基础地理分布", type=ComponentType.MAP,
-                    layout=LayoutConfig(zone=LayoutZone.CENTER_MAIN),
-                    # [修复] 必须添加 map_config，否则前端 Deck.gl 不会渲染
-                    map_config=[
-                        {
-                            "layer_id": "scatter_layer_fallback",
-                            "layer_type": "ScatterplotLayer",
-                            "data_api": "N/A",
-                            "opacity": 0.8
-                        }
-                    ]
-                ),
-                DashboardComponent(
-                    id="chart_default", title="核心维度统计", type=ComponentType.CHART,
-                    layout=LayoutConfig(zone=LayoutZone.RIGHT_SIDEBAR),
-                    chart_config={"chart_type": ChartType.BAR, "series_name": "记录数", "x_axis": "auto"}
-                ),
-                DashboardComponent(
-                    id="insight_default", title="智能洞察结果", type=ComponentType.INSIGHT,
-                    layout=LayoutConfig(zone=LayoutZone.BOTTOM_INSIGHT),
-                    insight_config={
-                        "summary": "分析引擎已生成基础结论",
-                        "detail": "已提取出关键的数据分布特征供您参考。",
-                        "tags": ["Fallback", "Ready"]
-                    }
-                )
-            ]
+    def _plan_single_flight(
+            self, cache_key: str, user_prompt: str, system_prompt: str, summaries: List[Dict[str, Any]]
+    ) -> DashboardSchema:
+        """
+        [新增] 请求合并：相同缓存键的规划同一时刻只向 LLM 发出一次，
+        并发到达的重复请求等待首个请求的结果 (成功则各自解析出独立对象，失败则抛出同一异常)。
+        """
+        with self._inflight_lock:
+            pending = self._inflight.get(cache_key)
+            leader = pending is None
+            if leader:
+                pending = self._inflight[cache_key] = Future()
+        if not leader:
+            logger.info(">>> [Planner] 相同规划请求正在进行，等待其结果")
+            return DashboardSchema.model_validate_json(pending.result())
+
+        try:
+            dashboard_plan = self._plan_with_llm(user_prompt, system_prompt, summaries)
+            payload = dashboard_plan.model_dump_json().encode()
+            # 仅缓存通过校验的规划，避免一次格式错误的响应长期锁死兜底方案
+            self.cache.set(cache_key, payload)
+            pending.set_result(payload)
+            return dashboard_plan
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(cache_key, None)
+
+    def _plan_with_llm(self, user_prompt: str, system_prompt: str, summaries: List[Dict[str, Any]]) -> DashboardSchema:
+        raw_plan = self._query_plan(user_prompt, system_prompt, summaries)
+        clean_plan = self._unwrap_llm_json(raw_plan)
+
+        # 字典级补全 + 一次校验；个别组件不合法时仅剔除该组件
+        dashboard_plan, repaired = self._validate_and_repair(clean_plan)
+        if repaired:
+            logger.info(">>> [Planner] LLM 规划存在缺陷，已自动补全/剔除问题字段")
+
+        # 强制布局对齐
+        LayoutTemplates.apply_layout(dashboard_plan.components)
+        return dashboard_plan
+
+    def _query_plan(self, user_prompt: str, system_prompt: str, summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """调用 LLM 规划；遇到超时/连接类瞬时故障时，用精简的系统提示词 (最少字段) 重试一次"""
+        try:
+            return self.llm.query_json(prompt=user_prompt, system_prompt=system_prompt, prefill=_PLAN_PREFILL, stream=True)
+        except (TimeoutError, ConnectionError) as e:
+            logger.warning(f">>> [Planner] LLM 调用失败 ({e})，精简上下文后重试一次")
+            slim_prompt = self._render_system_prompt(summaries, max_columns=MIN_PROMPT_COLUMNS)
+            return self.llm.query_json(prompt=user_prompt, system_prompt=slim_prompt, prefill=_PLAN_PREFILL, stream=True)
+
+    async def plan_dashboards_batch(
+            self,
+            requests: List[Tuple[str, List[Dict[str, Any]]]],
+            max_concurrency: int = LLM_MAX_CONCURRENCY
+    ) -> List[DashboardSchema]:
+        """
+        [新增] 批量规划多个相互独立的看板 (如 what-if 变体、对比面板)：
+        各 (query, summaries) 请求并发发往 LLM，总耗时约为最慢的一次而非逐个累加。
+        单个请求失败时照常回退到兜底方案，不影响其他请求。
+        """
+        return await gather_bounded(
+            [functools.partial(self.plan_dashboard, query, summaries) for query, summaries in requests],
+            limit=max_concurrency
         )
-        LayoutTemplates.apply_layout(fallback.components)
-        return fallback
\ No newline at end of file
+
+    def _generate_fallback_plan(self, query: str) -> DashboardSchema:
+        """兜底方案：提供结构完整的基础布局 (返回预构建模板的深拷贝，调用方可随意修改)"""
+        return _FALLBACK_PLAN.model_copy(deep=True)
@@ -1,22 +1,7 @@
-from typing import List, Dict, Any
-import json
+from typing import Final
 
-
-class STChartScaffold:
-    """
-    Spatio-Temporal Chart Scaffold (V4.1 - Spatio-Temporal & Theme Integration)
-
-    整合特性：
-    1. 基础 GIS/绘图防崩溃规则。
-    2. 对数色阶处理 (Log Scale) 优化长尾数据可视化。
-    3. 强制去标题 (No Internal Titles)，实现 UI 统一渲染。
-    4. 时间序列专家准则：支持自动重采样、时段分析与趋势绘图。
-    5. [新增] 全局视觉主题：统一 Plotly 配色方案与模版样式。
-    """
-
-    def __init__(self):
-        # 通用指令集 (使用普通字符串)
-        self.common_gis_instructions = """
+# 通用指令集 (GIS/绘图防崩溃规则、时间序列与主题准则)
+_COMMON_GIS_INSTRUCTIONS: Final[str] = """
         [CRITICAL RULES - READ CAREFULLY]
         1. **NO DISK I/O**: `data_context` ALREADY contains loaded objects. 
            - ✅ `df = data_context['df_variable_name']`
@@ -64,20 +49,14 @@ class STChartScaffold:
             - **Discrete Sequence**: For categorical charts (Pie/Bar), use `color_discrete_sequence=px.colors.qualitative.Prism`.
         """
 
-    def get_system_prompt(self, context_str: str) -> str:
-        """
-        构建系统提示词。
-        """
-
-        prompt = f"""
+# [优化] 系统提示词中与数据无关的部分 (角色、规则、Recipes) 在导入时拼好一次；
+# 数据上下文只追加在末尾，不变前缀逐字节一致，便于命中 LLM 服务端的前缀缓存
+_PROMPT_PREFIX: Final[str] = f"""
         You are an Expert Python Spatio-Temporal Data Scientist.
         Your task is to complete the `get_dashboard_data(data_context)` function using `plotly.express`.
 
-        === DATA METADATA (Context) ===
-        {context_str}
-
         === EXPERT INSTRUCTIONS ===
-        {self.common_gis_instructions}
+        {_COMMON_GIS_INSTRUCTIONS}
 
         === RECIPES (The "Best Practice" Patterns) ===
 
@@ -169,5 +148,27 @@ class STChartScaffold:
         3. STRICTLY NO internal `title=...`.
         4. Apply the defined Theme (`plotly_white`) and Color Scales to all charts.
         5. Return `{{ 'comp_id': fig/df, ... }}`.
+
+        === DATA METADATA (Context) ===
+"""
+_PROMPT_SUFFIX: Final[str] = "\n        "
+
+
+class STChartScaffold:
+    """
+    Spatio-Temporal Chart Scaffold (V4.1 - Spatio-Temporal & Theme Integration)
+
+    整合特性：
+    1. 基础 GIS/绘图防崩溃规则。
+    2. 对数色阶处理 (Log Scale) 优化长尾数据可视化。
+    3. 强制去标题 (No Internal Titles)，实现 UI 统一渲染。
+    4. 时间序列专家准则：支持自动重采样、时段分析与趋势绘图。
+    5. [新增] 全局视觉主题：统一 Plotly 配色方案与模版样式。
+    """
+
+    def get_system_prompt(self, context_str: str) -> str:
+        """
+        构建系统提示词：不变前缀 + 数据上下文。
+        数据上下文放在末尾，使规则与 Recipes 构成跨请求不变的前缀，便于命中 LLM 服务端的前缀缓存。
         """
-        return prompt
\ No newline at end of file
+        return _PROMPT_PREFIX + "        " + context_str + _PROMPT_SUFFIX
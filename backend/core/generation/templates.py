@@ -1,7 +1,18 @@
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Final, Tuple
 from core.schemas.dashboard import LayoutZone, LayoutConfig
 
 
+SlotCoords = Tuple[float, float, float, float]
+
+
+def _slot_coords(template: Dict[str, Any]) -> Dict[LayoutZone, Tuple[SlotCoords, ...]]:
+    """模板槽位 -> 各区域的 (x, y, w, h) 元组序列"""
+    return {
+        zone: tuple((c.x, c.y, c.w, c.h) for c in configs)
+        for zone, configs in template["slots"].items()
+    }
+
+
 class LayoutTemplates:
     """
     布局模板库：
@@ -47,12 +58,14 @@ class LayoutTemplates:
         }
     }
 
-    @classmethod
-    def get_template_prompt(cls) -> str:
-        """
-        生成给 LLM 看的布局说明，作为 Prompt 的一部分。
-        """
-        return """
+    # [优化] 槽位坐标表在类定义时物化为纯元组，apply_layout 不再逐个读取 LayoutConfig 属性
+    _SLOT_COORDS: Final[Dict[str, Dict[LayoutZone, Tuple[SlotCoords, ...]]]] = {
+        GOLDEN_SPATIO_TEMPORAL["template_id"]: _slot_coords(GOLDEN_SPATIO_TEMPORAL),
+        CHART_ONLY_GRID["template_id"]: _slot_coords(CHART_ONLY_GRID),
+    }
+
+    # 给 LLM 看的布局说明 (静态文本，作为规划 Prompt 不变前缀的一部分)
+    _TEMPLATE_PROMPT: Final[str] = """
         === 布局区域守则 (Layout Rules) ===
         1. CENTER_MAIN: 只能放置 1 个 'map' 类型组件。
         2. RIGHT_SIDEBAR: 最多放置 2 个 'chart' 类型组件。
@@ -61,25 +74,34 @@ class LayoutTemplates:
         请为每个组件分配对应的 'zone' 属性，系统会自动将其对齐到 UI 预设位置。
         """
 
+    @classmethod
+    def get_template_prompt(cls) -> str:
+        """
+        生成给 LLM 看的布局说明，作为 Prompt 的一部分。
+        [优化] 直接返回类级常量，调用方拿到的始终是同一个字符串对象。
+        """
+        return cls._TEMPLATE_PROMPT
+
     @classmethod
     def apply_layout(cls, components: List[Any], template_id: str = "st_standard_v1") -> None:
         """
         [工具方法] 后端逻辑层调用：
         根据 LLM 指定的 zone，将组件强制对齐到物理坐标。
         """
-        template = cls.GOLDEN_SPATIO_TEMPORAL if template_id == "st_standard_v1" else cls.CHART_ONLY_GRID
-        slots = template["slots"]
+        slots = cls._SLOT_COORDS.get(template_id) or cls._SLOT_COORDS[cls.CHART_ONLY_GRID["template_id"]]
 
         # 记录每个区域已经使用了多少个槽位
-        counters = {zone: 0 for zone in LayoutZone}
+        counters: Dict[LayoutZone, int] = {}
 
         for comp in components:
-            zone = comp.layout.zone
-            if zone in slots and counters[zone] < len(slots[zone]):
-                # 赋予物理坐标
-                target_config = slots[zone][counters[zone]]
-                comp.layout.x = target_config.x
-                comp.layout.y = target_config.y
-                comp.layout.w = target_config.w
-                comp.layout.h = target_config.h
-                counters[zone] += 1
\ No newline at end of file
+            layout = comp.layout
+            zone_slots = slots.get(layout.zone)
+            if not zone_slots:
+                continue
+            used = counters.get(layout.zone, 0)
+            if used < len(zone_slots):
+                # 赋予物理坐标；坐标已与槽位一致 (LLM 已给出或重复对齐) 时跳过赋值
+                coords = zone_slots[used]
+                if (layout.x, layout.y, layout.w, layout.h) != coords:
+                    layout.x, layout.y, layout.w, layout.h = coords
+                counters[layout.zone] = used + 1
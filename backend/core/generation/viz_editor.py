@@ -1,47 +1,46 @@
 import logging
 import re
 import json
-from typing import Dict, Any, List, Optional
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Final, List, Optional, Tuple
 from core.llm.AI_client import AIClient
+from core.llm.llm_cache import LLM_CACHE_DB_PATH, PROMPT_CACHE_SIZE, LLMResponseCache, shared_disk_tier
 from core.schemas.interaction import InteractionTriggerType
 
 logger = logging.getLogger(__name__)
 
+_LEAD_FENCE_RE = re.compile(r"^```(python)?\s*", re.IGNORECASE)
 
-class VizEditor:
-    """
-    可视化编辑器 (V2 联动增强版)：
-    负责根据用户的交互动作（点选、框选、指令）增量修改 Python 代码。
-    支持“联动响应”逻辑：即一个组件的动作如何影响其他组件的数据。
-    """
+# 编辑的采样温度：结果按提示词缓存并持久化，固定为 0 才能保证缓存复用的是确定的编辑而不是一次随机采样
+EDIT_TEMPERATURE = 0.0
 
-    def __init__(self, llm_client: AIClient):
-        self.llm = llm_client
+# [优化] 语义标签的 JSON 文本缓存：会话内的 summaries 在多次编辑间复用同一个 tags 字典，
+# 以 id 为键并保留对原字典的引用 (命中时校验是同一对象)，避免每次编辑都重新序列化
+_TAGS_JSON_CACHE: "OrderedDict[int, Tuple[Dict[str, Any], str]]" = OrderedDict()
+_TAGS_JSON_LOCK = threading.Lock()
 
-    def _clean_markdown(self, text: str) -> str:
-        """去除 Markdown 格式，提取纯 Python 代码"""
-        if not text: return ""
-        text = text.strip()
-        text = re.sub(r"^```(python)?\s*", "", text, flags=re.IGNORECASE)
-        text = re.sub(r"\s*```$", "", text)
-        return text.strip()
 
-    def _get_editor_prompt(self, original_code: str, summaries: List[Dict[str, Any]]) -> str:
-        # 提取语义背景，方便 AI 知道哪个字段对应经纬度或 ID
-        context_str = ""
-        for s in summaries:
-            var_name = s.get('variable_name')
-            tags = s.get('semantic_analysis', {}).get('semantic_tags', {})
-            context_str += f"- 变量 `{var_name}` 语义标签: {json.dumps(tags, ensure_ascii=False)}\n"
-
-        return f"""
-你是一位资深时空数据工程师。你的任务是根据用户的交互动作（Interaction），对现有的分析代码进行【手术级】的增量修改。
+def _tags_json(tags: Dict[str, Any]) -> str:
+    if not tags:
+        return "{}"
+    key = id(tags)
+    with _TAGS_JSON_LOCK:
+        hit = _TAGS_JSON_CACHE.get(key)
+        if hit is not None and hit[0] is tags:
+            _TAGS_JSON_CACHE.move_to_end(key)
+            return hit[1]
+    text = json.dumps(tags, sort_keys=True, ensure_ascii=False)
+    with _TAGS_JSON_LOCK:
+        _TAGS_JSON_CACHE[key] = (tags, text)
+        while len(_TAGS_JSON_CACHE) > PROMPT_CACHE_SIZE:
+            _TAGS_JSON_CACHE.popitem(last=False)
+    return text
 
-=== 现有代码 ===
-{original_code}
 
-=== 数据语义背景 ===
-{context_str}
+# 编辑器系统提示词中与会话无关的部分 (角色与强制约束)
+_EDITOR_RULES: Final[str] = """
+你是一位资深时空数据工程师。你的任务是根据用户的交互动作（Interaction），对现有的分析代码进行【手术级】的增量修改。
 
 === 强制约束 ===
 1. 保持函数签名不变：`def get_dashboard_data(data_context):`。
@@ -49,7 +48,7 @@ class VizEditor:
    - 尽可能保留原有的变量定义和数据加载逻辑。
    - 【核心】在聚合计算（groupby, count 等）之前，插入过滤代码。
 3. 空间过滤规则：
-   - 如果用户提供 BBox，优先使用 GeoPandas 的 `.cx[lon_min:lon_max, lat_min:lat_max]`。
+   - 如果用户提供 BBox，必须调用内置函数 `bbox_filter(df, bbox)` 过滤 (无需 import)，不要使用 `.cx[...]` 或手写坐标比较。
    - 确保坐标系一致，必要时调用 `df = df.to_crs(epsg=4326)`。
 4. 时间过滤规则：
    - 如果用户提供 time_range，确保先使用 `pd.to_datetime()` 转换时间列。
@@ -59,6 +58,50 @@ class VizEditor:
    - 只针对受影响的数据流进行修改，不要破坏其他无关组件。
 """
 
+
+class VizEditor:
+    """
+    可视化编辑器 (V2 联动增强版)：
+    负责根据用户的交互动作（点选、框选、指令）增量修改 Python 代码。
+    支持“联动响应”逻辑：即一个组件的动作如何影响其他组件的数据。
+    """
+
+    def __init__(self, llm_client: AIClient, cache_db: Optional[str] = LLM_CACHE_DB_PATH):
+        self.llm = llm_client
+        # [新增] 编辑结果缓存：同一份代码 + 同一语义背景 + 同一交互 (含联动规则) 直接复用上次的修改结果，
+        # 覆盖回溯后重放、重复框选等场景 (cache_db 为 None 时仅内存)
+        self.cache = LLMResponseCache(
+            "VizEditor", disk=shared_disk_tier(cache_db) if cache_db else None
+        )
+
+    def _clean_markdown(self, text: str) -> str:
+        """去除 Markdown 格式，提取纯 Python 代码"""
+        if not text: return ""
+        text = text.strip()
+        if "```" not in text:
+            return text
+        # [优化] 最常见的 ```python / ``` 开头直接切片，只有 ```Python 等变体才走正则
+        if text.startswith("```python"):
+            text = text[9:]
+        elif text.startswith("```") and not text[3:4].isalpha():
+            text = text[3:]
+        else:
+            text = _LEAD_FENCE_RE.sub("", text)
+        return text.removesuffix("```").strip()
+
+    def _get_editor_prompt(self, original_code: str, summaries: List[Dict[str, Any]]) -> str:
+        # 提取语义背景，方便 AI 知道哪个字段对应经纬度或 ID
+        # [优化] 列表收集后一次 join，拼接耗时随数据集数量线性增长；按变量名排序，同一批数据的背景逐字节一致
+        context_str = "".join(
+            f"- 变量 `{s.get('variable_name')}` 语义标签: "
+            f"{_tags_json(s.get('semantic_analysis', {}).get('semantic_tags', {}))}\n"
+            for s in sorted(summaries, key=lambda s: str(s.get('variable_name')))
+        )
+
+        # [优化] 不变的规则在前、会话内基本不变的语义背景居中、每轮都会变化的现有代码放在末尾，
+        # 连续编辑时前缀可命中 LLM 服务端的前缀缓存
+        return f"{_EDITOR_RULES}\n=== 数据语义背景 ===\n{context_str}\n=== 现有代码 ===\n{original_code}\n"
+
     def edit_dashboard_code(
             self,
             original_code: str,
@@ -87,10 +130,10 @@ class VizEditor:
 
         # 2. 注入联动上下文（告诉 AI 谁应该跟着变）
         if links:
-            link_hints = "\n=== 联动规则提示 ===\n"
-            for link in links:
-                link_hints += f"- 当 `{payload.active_component_id}` 动作时，应过滤 `{link.target_id}` 的数据，关联键为 `{link.link_key}`。\n"
-            interaction_desc += link_hints
+            interaction_desc += "\n=== 联动规则提示 ===\n" + "".join(
+                f"- 当 `{payload.active_component_id}` 动作时，应过滤 `{link.target_id}` 的数据，关联键为 `{link.link_key}`。\n"
+                for link in links
+            )
 
         user_prompt = f"""
 === 交互描述 ===
@@ -98,22 +141,36 @@ class VizEditor:
 
 === 任务目标 ===
 请修改原有代码，使看板响应上述交互。
-如果涉及空间过滤，请务必在代码最开始的部分对相关的 GeoDataFrame 应用 `.cx` 过滤。
+如果涉及空间过滤，请务必在代码最开始的部分调用内置函数 `bbox_filter(df, bbox)` 过滤相关数据（无需 import；GeoDataFrame 走空间索引，普通 DataFrame 自动识别经纬度列，也可传入 lon_col/lat_col）。
 如果涉及属性过滤，请使用 `df[df[key].isin(ids)]` 逻辑。
 如果涉及时间过滤，请确保将时间列转换为 datetime 格式后应用范围过滤。
 
 请只输出修改后的完整 Python 代码块。
 """
 
+        # 两段提示词完整决定了编辑结果 (现有代码、语义背景、交互与联动规则均在其中)
+        cache_key = self.cache.make_key(system=system_prompt, user=user_prompt)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         logger.info(f">>> Editing code for interaction on: {payload.active_component_id or 'Chat'}")
 
         try:
             raw_response = self.llm.chat([
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
-            ], json_mode=False)
+            ], json_mode=False, temperature=EDIT_TEMPERATURE)
 
-            return self._clean_markdown(raw_response)
+            code = self._clean_markdown(raw_response)
+            if code:
+                self.cache.set(cache_key, code)
+            return code
         except Exception as e:
             logger.error(f"Code editing failed: {e}")
-            return original_code  # 失败则返回原代码，保证系统不崩溃
\ No newline at end of file
+            return original_code  # 失败则返回原代码，保证系统不崩溃
+
+    def remember_fix(self, original_code: str, fixed_code: str):
+        """自愈修复成功后，用修复后的代码覆盖缓存中执行失败的编辑结果"""
+        if fixed_code and fixed_code != original_code:
+            self.cache.replace_value(original_code, fixed_code)
@@ -1,12 +1,147 @@
+import ast
+import functools
 import logging
 import re
-from typing import Dict, Any, List
+import textwrap
+from typing import Dict, Any, List, Optional
 from core.llm.AI_client import AIClient
 # [新增] 引入 Scaffold
 from core.generation.scaffold import STChartScaffold
+from core.llm.batching import LLM_MAX_CONCURRENCY, gather_bounded
+from core.llm.token_budget import within_budget
+from core.llm.llm_cache import (
+    LLM_CACHE_DB_PATH, LLMResponseCache, NearDuplicateCache, normalize_query, schema_fingerprint, shared_disk_tier
+)
 
 logger = logging.getLogger(__name__)
 
+# [优化] 预编译 Markdown 代码块相关正则，避免每次清洗 (含自愈重试) 都走 re 模块的模式缓存查找
+_CODE_BLOCK_RE = re.compile(r"```(?:python)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_LEAD_FENCE_RE = re.compile(r"^```(python)?\s*", re.IGNORECASE)
+_TRAIL_FENCE_RE = re.compile(r"\s*```$")
+
+
+# 数据背景中每个变量列出的列数上限；超出 token 预算时压缩到下限
+MAX_CONTEXT_COLUMNS = 50
+MIN_CONTEXT_COLUMNS = 10
+
+# 代码生成的采样温度：固定为 0 使相同 Prompt 得到相同代码，缓存复用 (含近似查询复用) 才有意义
+GENERATION_TEMPERATURE = 0.0
+
+_DICT_ATTRS = frozenset(dir(dict))
+
+
+def lint_dashboard_code(code: str) -> Optional[str]:
+    """
+    生成代码的轻量静态检查 (不执行)：
+    语法错误、缺少 get_dashboard_data 入口、以属性方式访问 data_context。
+    通过返回 None，否则返回可直接交给 fix_code 的错误描述。
+    """
+    if not code:
+        return "Empty response: no code was generated."
+    try:
+        tree = ast.parse(textwrap.dedent(code))
+    except SyntaxError as e:
+        return f"SyntaxError: {e.msg} (line {e.lineno})"
+    if not any(isinstance(n, ast.FunctionDef) and n.name == "get_dashboard_data" for n in tree.body):
+        return "Generated code must contain a top-level 'def get_dashboard_data(data_context):'."
+    for node in ast.walk(tree):
+        if (
+                isinstance(node, ast.Attribute)
+                and isinstance(node.value, ast.Name)
+                and node.value.id == "data_context"
+                and node.attr not in _DICT_ATTRS
+        ):
+            return (
+                f"AttributeError: 'dict' object has no attribute '{node.attr}' (line {node.lineno}). "
+                f"Use data_context['{node.attr}'] instead."
+            )
+    return None
+
+
+# NameError 中可由补 import 直接修复的名称
+_KNOWN_IMPORTS = {
+    "pd": "import pandas as pd",
+    "gpd": "import geopandas as gpd",
+    "px": "import plotly.express as px",
+    "go": "import plotly.graph_objects as go",
+    "np": "import numpy as np",
+    "Point": "from shapely.geometry import Point",
+    "Polygon": "from shapely.geometry import Polygon",
+    "LineString": "from shapely.geometry import LineString",
+}
+_NAME_ERROR_RE = re.compile(r"NameError: name '(\w+)' is not defined")
+_CODE_START_RE = re.compile(r"^\s*(?:import |from \S+ import |def |@)", re.MULTILINE)
+
+
+class _DataContextSubscript(ast.NodeTransformer):
+    """data_context.xxx -> data_context['xxx'] (dict 自带方法如 .get/.items 保持不变)"""
+
+    def visit_Attribute(self, node: ast.Attribute) -> ast.AST:
+        self.generic_visit(node)
+        if isinstance(node.value, ast.Name) and node.value.id == "data_context" and node.attr not in _DICT_ATTRS:
+            return ast.copy_location(
+                ast.Subscript(value=node.value, slice=ast.Constant(node.attr), ctx=node.ctx), node
+            )
+        return node
+
+
+def _deterministic_fix(code: str, error_trace: str) -> Optional[str]:
+    """
+    [新增] 常见错误的进程内修复，命中时省去一次 LLM 往返：
+    1. 以属性方式访问 data_context -> 改为下标访问 (AST 改写)。
+    2. NameError 且名称为常用库别名 -> 在开头补 import。
+    3. 代码前混入说明文字导致的 SyntaxError -> 丢弃第一行代码之前的内容。
+    修复结果须通过 lint_dashboard_code 才返回，否则返回 None 交给 LLM 修复。
+    """
+    fixed = textwrap.dedent(code or "").strip()
+    if "SyntaxError" in error_trace:
+        start = _CODE_START_RE.search(fixed)
+        if start:
+            fixed = fixed[start.start():]
+    if "has no attribute" in error_trace:
+        try:
+            tree = _DataContextSubscript().visit(ast.parse(fixed))
+            fixed = ast.unparse(ast.fix_missing_locations(tree))
+        except SyntaxError:
+            return None
+    missing = [_KNOWN_IMPORTS[n] for n in dict.fromkeys(_NAME_ERROR_RE.findall(error_trace)) if n in _KNOWN_IMPORTS]
+    if missing:
+        fixed = "\n".join(missing) + "\n" + fixed
+
+    if fixed == textwrap.dedent(code or "").strip() or lint_dashboard_code(fixed) is not None:
+        return None
+    return fixed
+
+
+def _has_closed_code_block(text: str) -> bool:
+    """流式输出中已出现完整的 ``` 代码块 (开、闭围栏各一)，之后的内容只会是解释文字"""
+    return text.count("```") >= 2
+
+
+def _describe_component(c_id: Any, c_type: Any, c_title: Any, c_conf: Any) -> str:
+    # 如果是 Chart 类型，把 chart_type 也传进去 (方便识别是用 Bar 还是 Pie)
+    chart_type_hint = ""
+    if c_type == 'chart' and c_conf:
+        # chart_config 可能是 dict 或 object
+        ctype = c_conf.get('chart_type') if isinstance(c_conf, dict) else getattr(c_conf, 'chart_type', '')
+        chart_type_hint = f" (Preferred Chart Type: {ctype})"
+    return f"- 组件ID: `{c_id}` ({c_type}){chart_type_hint}, 标题: {c_title}\n"
+
+
+@functools.singledispatch
+def _format_component(comp: Any) -> str:
+    """组件规划 (Pydantic 对象) -> Prompt 中的单行描述"""
+    return _describe_component(
+        getattr(comp, 'id', 'unknown'), getattr(comp, 'type', 'unknown'),
+        getattr(comp, 'title', 'unknown'), getattr(comp, 'chart_config', {})
+    )
+
+
+@_format_component.register
+def _(comp: dict) -> str:
+    return _describe_component(comp.get('id'), comp.get('type'), comp.get('title'), comp.get('chart_config', {}))
+
 
 class CodeGenerator:
     """
@@ -14,24 +149,40 @@ class CodeGenerator:
     利用 STChartScaffold 的食谱生成高质量绘图代码。
     """
 
-    def __init__(self, llm_client: AIClient):
+    def __init__(self, llm_client: AIClient, cache_db: Optional[str] = LLM_CACHE_DB_PATH):
         self.llm = llm_client
         # [新增] 实例化脚手架
         self.scaffold = STChartScaffold()
+        # [新增] 相同查询 + 相同数据结构 + 相同组件规划的代码生成结果缓存 (cache_db 为 None 时仅内存)
+        self.cache = LLMResponseCache(
+            "CodeGenerator", disk=shared_disk_tier(cache_db) if cache_db else None
+        )
+        # [新增] 同一数据结构 + 同一组件规划下，措辞不同但意图相同的查询复用已生成的代码；
+        # 仅在确定性生成 (温度为 0) 时启用，否则复用的只是一次随机采样
+        self.similar_cache = NearDuplicateCache("CodeGenerator") if GENERATION_TEMPERATURE == 0 else None
 
     def _clean_markdown(self, text: str) -> str:
         """正则提取代码块"""
         if not text:
             return ""
-        pattern = r"```(?:python)?\s*(.*?)```"
-        match = re.search(pattern, text, re.DOTALL | re.IGNORECASE)
+        # 不含代码围栏时无需任何正则处理
+        if "```" not in text:
+            return text.strip()
+        match = _CODE_BLOCK_RE.search(text)
         if match:
             return match.group(1).strip()
-        text = text.strip()
-        text = re.sub(r"^```(python)?\s*", "", text, flags=re.IGNORECASE)
-        text = re.sub(r"\s*```$", "", text)
+        text = _LEAD_FENCE_RE.sub("", text.strip())
+        text = _TRAIL_FENCE_RE.sub("", text)
         return text.strip()
 
+    @staticmethod
+    def _data_context(summaries: List[Dict[str, Any]], max_cols: int = MAX_CONTEXT_COLUMNS) -> str:
+        return "".join(
+            f"- 变量 `{s.get('variable_name')}` 可用列: "
+            f"{list((s.get('basic_stats', {}) or {}).get('column_stats', {}).keys())[:max_cols]}\n"
+            for s in summaries
+        )
+
     def generate_dashboard_code(
             self,
             query: str,
@@ -41,37 +192,13 @@ class CodeGenerator:
     ) -> str:
 
         # 1. 构建数据背景字符串 (Context)
-        context_str = ""
-        for s in summaries:
-            var_name = s.get('variable_name')
-            stats = s.get('basic_stats', {}) or {}
-            cols = list(stats.get('column_stats', {}).keys())
-            context_str += f"- 变量 `{var_name}` 可用列: {cols[:50]}\n"
+        context_str = self._data_context(summaries)
 
         # 2. [修改] 从 Scaffold 获取 System Prompt (包含 Recipes)
         system_prompt = self.scaffold.get_system_prompt(context_str)
 
         # 3. 构建用户需求
-        comp_desc = ""
-        if component_plans:
-            for comp in component_plans:
-                if isinstance(comp, dict):
-                    c_id, c_type, c_title = comp.get('id'), comp.get('type'), comp.get('title')
-                    c_conf = comp.get('chart_config', {})
-                else:
-                    c_id = getattr(comp, 'id', 'unknown')
-                    c_type = getattr(comp, 'type', 'unknown')
-                    c_title = getattr(comp, 'title', 'unknown')
-                    c_conf = getattr(comp, 'chart_config', {})
-
-                # 如果是 Chart 类型，把 chart_type 也传进去 (方便识别是用 Bar 还是 Pie)
-                chart_type_hint = ""
-                if c_type == 'chart' and c_conf:
-                    # chart_config 可能是 dict 或 object
-                    ctype = c_conf.get('chart_type') if isinstance(c_conf, dict) else getattr(c_conf, 'chart_type', '')
-                    chart_type_hint = f" (Preferred Chart Type: {ctype})"
-
-                comp_desc += f"- 组件ID: `{c_id}` ({c_type}){chart_type_hint}, 标题: {c_title}\n"
+        comp_desc = "".join(_format_component(comp) for comp in component_plans or ())
 
         user_prompt = f"""
         User Query: "{query}"
@@ -86,16 +213,86 @@ class CodeGenerator:
         Apply the Recipes (A/B/C/D) that best fit each component.
         """
 
+        cache_key = self.cache.make_key(
+            query=normalize_query(query),
+            schema=schema_fingerprint(summaries),
+            components=comp_desc,
+            hint=interaction_hint
+        )
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        # 组件规划决定了代码的结构，查询本身只在规划完全一致时才允许近似匹配
+        scope_key = self.cache.make_key(
+            schema=schema_fingerprint(summaries), components=comp_desc, hint=interaction_hint
+        )
+        cached = self.similar_cache.get(scope_key, query) if self.similar_cache else None
+        if cached is not None:
+            self.cache.set(cache_key, cached)
+            return cached
+
+        # [新增] 发送前检查 token 预算：超出时先压缩列清单，仍超出则直接报错，不浪费一次必然失败的调用
+        if not within_budget(system_prompt, user_prompt):
+            system_prompt = self.scaffold.get_system_prompt(self._data_context(summaries, MIN_CONTEXT_COLUMNS))
+            if not within_budget(system_prompt, user_prompt):
+                raise ValueError("Prompt exceeds the LLM input token budget even after trimming the column lists.")
+            logger.warning(f"Prompt over token budget, column lists trimmed to {MIN_CONTEXT_COLUMNS} per dataset")
+
         logger.info(f"Generating code with Scaffold for {len(component_plans)} components...")
+        code = self._generate_checked(system_prompt, user_prompt, summaries)
+        if code:
+            self.cache.set(cache_key, code)
+            if self.similar_cache:
+                self.similar_cache.set(scope_key, query, code)
+        return code
+
+    def _complete(self, system_prompt: str, user_prompt: str) -> str:
         raw_response = self.llm.chat([
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
-        ], json_mode=False)
-
+        ], json_mode=False, stop_when=_has_closed_code_block, temperature=GENERATION_TEMPERATURE)
         return self._clean_markdown(raw_response)
 
+    def _generate_checked(self, system_prompt: str, user_prompt: str, summaries: List[Dict[str, Any]]) -> str:
+        """
+        [新增] 带静态检查的生成：通过检查直接采用；未通过时把检查错误直接交给 fix_code，
+        在执行前完成修复 (最多一次生成 + 一次修复，不再追加串行的重新生成请求)。
+        """
+        code = self._complete(system_prompt, user_prompt)
+        error = lint_dashboard_code(code)
+        if error is None:
+            return code
+        logger.warning("生成代码未通过静态检查，执行前先行修复...")
+        return self.fix_code(code, error, summaries)
+
+    async def generate_dashboard_code_batch(
+            self,
+            requests: List[Dict[str, Any]],
+            max_concurrency: int = LLM_MAX_CONCURRENCY
+    ) -> List[str]:
+        """
+        [新增] 并发为多个相互独立的看板生成代码。
+        requests 中每一项为 generate_dashboard_code 的关键字参数，返回的代码与请求顺序一致。
+        """
+        return await gather_bounded(
+            [functools.partial(self.generate_dashboard_code, **req) for req in requests],
+            limit=max_concurrency
+        )
+
+    def remember_fix(self, original_code: str, fixed_code: str):
+        """自愈修复成功后，用修复后的代码覆盖缓存中执行失败的版本"""
+        if fixed_code and fixed_code != original_code:
+            self.cache.replace_value(original_code, fixed_code)
+            if self.similar_cache:
+                self.similar_cache.replace_value(original_code, fixed_code)
+
     def fix_code(self, original_code: str, error_trace: str, summaries: List[Dict[str, Any]]) -> str:
-        """自愈修复逻辑"""
+        """自愈修复逻辑：先尝试确定性修复，无法处理时再请 LLM 修复"""
+        fixed = _deterministic_fix(original_code, error_trace)
+        if fixed is not None:
+            logger.info("命中确定性修复规则，跳过 LLM 修复")
+            return fixed
+
         # 修复时也可以带上 scaffold 的规则，防止越修越错
         base_prompt = self.scaffold.get_system_prompt("")  # 空 context 仅获取规则
 
@@ -116,9 +313,4 @@ class CodeGenerator:
         """
 
         logger.warning("Attempting to fix code with Scaffold rules...")
-        raw_response = self.llm.chat([
-            {"role": "system", "content": base_prompt},
-            {"role": "user", "content": fix_prompt}
-        ], json_mode=False)
-
-        return self._clean_markdown(raw_response)
\ No newline at end of file
+        return self._complete(base_prompt, fix_prompt)
\ No newline at end of file
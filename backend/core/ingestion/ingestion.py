@@ -1,12 +1,88 @@
 import os
+import re
 import logging
 import pandas as pd  # [必要新增] 用于时间类型转换
-from typing import Dict, Any, List
+from pandas.tseries.api import guess_datetime_format
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Any, List, Callable, Optional
 from pathlib import Path
 from core.ingestion.loader_factory import LoaderFactory
 
 logger = logging.getLogger(__name__)
 
+# 识别常见的包含时间含义的列名关键词
+_TIME_KEYWORDS = ('time', 'date', 'at', 'stamp')
+# 用于推断时间格式的非空样本数
+_FORMAT_SAMPLE_SIZE = 32
+_ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+# 多文件并发加载的线程池 (I/O 与解码为主)
+_LOAD_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ingest")
+
+
+def _sniff_datetime_format(sample: pd.Series) -> Optional[str]:
+    """由首个非空样本推断时间格式；样本看起来不像时间时返回 None (不再逐值走 dateutil 试错)"""
+    if sample.empty:
+        return None
+    first = str(sample.iloc[0]).strip()
+    if _ISO_DATE_RE.match(first):
+        return "ISO8601"
+    return guess_datetime_format(first)
+
+
+def _convert_time_columns(df: Any) -> None:
+    """
+    [优化] 时间列自动识别：列名小写只计算一次；先用少量样本推断格式，
+    再以固定格式整列解析 (走 C 层的 strptime 快速路径)，推断不出格式的列直接跳过。
+    """
+    for col, col_lower in zip(df.columns, (str(c).lower() for c in df.columns)):
+        if not any(kw in col_lower for kw in _TIME_KEYWORDS):
+            continue
+        series = df[col]
+        # 兼容 pandas 3 的 str dtype 与旧版的 object dtype
+        if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+            continue
+        fmt = _sniff_datetime_format(series.dropna().iloc[:_FORMAT_SAMPLE_SIZE])
+        if fmt is None:
+            continue
+        try:
+            df[col] = pd.to_datetime(series, format=fmt, cache=True)
+            logger.info(f"字段 '{col}' 已自动转换为 Datetime 对象")
+        except (ValueError, TypeError, OverflowError):
+            continue
+
+
+class LazyDataContext(Mapping):
+    """
+    惰性数据上下文：变量名在创建时即已确定，但 DataFrame 只在首次被访问时才全量加载。
+    生成的看板代码通常只用到部分数据集，未被访问的文件不会读入内存。
+    """
+
+    def __init__(self, loaders: Dict[str, Callable[[], Any]]):
+        self._loaders = loaders
+        self._cache: Dict[str, Any] = {}
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._cache:
+            self._cache[key] = self._loaders[key]()
+        return self._cache[key]
+
+    def __contains__(self, key: object) -> bool:
+        # 成员判断不应触发加载
+        return key in self._loaders
+
+    def __iter__(self):
+        return iter(self._loaders)
+
+    def __len__(self) -> int:
+        return len(self._loaders)
+
+    def clear(self):
+        """释放已加载的 DataFrame"""
+        self._cache.clear()
+
 
 class IngestionManager:
     """
@@ -24,34 +100,46 @@ class IngestionManager:
         """
         将多个文件加载到内存上下文中（data_context），供 Executor 使用。
         """
-        data_context = {}
-        for path in file_paths:
-            try:
-                loader = LoaderFactory.get_loader(path)
-                # [关键优化] 替换中划线，确保生成的变量名在 Python 中合法（防止 df_taxi-data 报错）
-                var_name = f"df_{Path(path).stem.lower().replace('-', '_')}"
-
-                if use_full:
-                    logger.info(f"Full loading: {path}")
-                    df = loader.load(path)
-                else:
-                    logger.info(f"Sampling (10): {path}")
-                    df = loader.peek(path, n=10)
-
-                # --- [新增必要逻辑] 自动时间列转换 ---
-                # 预先转换 Datetime 对象，使得后续趋势分析中 resample() 速度提升 10 倍以上
-                for col in df.columns:
-                    if df[col].dtype == 'object':
-                        # 识别常见的包含时间含义的关键词
-                        if any(kw in col.lower() for kw in ['time', 'date', 'at', 'stamp']):
-                            try:
-                                df[col] = pd.to_datetime(df[col])
-                                logger.info(f"字段 '{col}' 已自动转换为 Datetime 对象")
-                            except:
-                                continue
-
-                data_context[var_name] = df
-            except Exception as e:
-                logger.error(f"Failed to load {path}: {e}")
-
-        return data_context
\ No newline at end of file
+        # [优化] 各文件相互独立，且 pandas/pyarrow/GDAL 解码期间会释放 GIL：多文件时并发加载，
+        # 总耗时约为最慢的单个文件；结果仍按传入顺序装配
+        if len(file_paths) > 1:
+            frames = list(_LOAD_POOL.map(partial(self._load_one, use_full=use_full), file_paths))
+        else:
+            frames = [self._load_one(path, use_full) for path in file_paths]
+
+        return {self._var_name(path): df for path, df in zip(file_paths, frames) if df is not None}
+
+    def _load_one(self, path: str, use_full: bool) -> Optional[Any]:
+        """加载单个文件；失败只记录日志并返回 None，不影响其他文件"""
+        try:
+            return self._load_frame(path, use_full)
+        except Exception as e:
+            logger.error(f"Failed to load {path}: {e}")
+            return None
+
+    def lazy_full_context(self, file_paths: List[str]) -> LazyDataContext:
+        """
+        [新增] 构建全量数据的惰性上下文：仅在生成代码实际访问某个变量时才全量读取对应文件。
+        """
+        loaders = {self._var_name(path): partial(self._load_frame, path, True) for path in file_paths}
+        return LazyDataContext(loaders)
+
+    @staticmethod
+    def _var_name(path: str) -> str:
+        # [关键优化] 替换中划线，确保生成的变量名在 Python 中合法（防止 df_taxi-data 报错）
+        return f"df_{Path(path).stem.lower().replace('-', '_')}"
+
+    def _load_frame(self, path: str, use_full: bool) -> Any:
+        loader = LoaderFactory.get_loader(path)
+
+        if use_full:
+            logger.info(f"Full loading: {path}")
+            df = loader.load(path)
+        else:
+            logger.info(f"Sampling (10): {path}")
+            df = loader.peek(path, n=10)
+
+        # --- [新增必要逻辑] 自动时间列转换 ---
+        # 预先转换 Datetime 对象，使得后续趋势分析中 resample() 速度提升 10 倍以上
+        _convert_time_columns(df)
+        return df
@@ -1,6 +1,18 @@
+import logging
 import pandas as pd
-import geopandas as gpd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pyogrio
 from abc import ABC, abstractmethod
+from typing import Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_CSV_READ_OPTIONS = pacsv.ReadOptions(use_threads=True, block_size=8 << 20)
+# 统计 CSV 行数时的读取块大小
+_COUNT_CHUNK_SIZE = 8 << 20
 
 
 class BaseLoader(ABC):
@@ -14,35 +26,92 @@ class BaseLoader(ABC):
         # 默认实现，子类可优化（如 Parquet 直接读元数据）
         return len(self.load(path))
 
+    def sample_and_count(self, path: str, n: int = 5) -> Tuple[Any, int]:
+        """[新增] 一次调用同时取得前 n 行预览与总行数；子类可合并为一次文件打开"""
+        return self.peek(path, n=n), self.count_rows(path)
+
 
 class CSVLoader(BaseLoader):
     def load(self, path: str):
-        return pd.read_csv(path)
+        # [优化] PyArrow 多线程解析 (大文件约为 pandas C 解析器的 3-5 倍吞吐)；
+        # 时间列按文本读入，与 pandas 的结果保持一致，由 IngestionManager 统一做时间转换
+        try:
+            with pacsv.open_csv(path, read_options=_CSV_READ_OPTIONS) as reader:
+                schema = reader.schema
+            text_cols = {f.name: pa.string() for f in schema if pa.types.is_temporal(f.type)}
+            table = pacsv.read_csv(
+                path,
+                read_options=_CSV_READ_OPTIONS,
+                convert_options=pacsv.ConvertOptions(column_types=text_cols, strings_can_be_null=True)
+            )
+            return table.to_pandas()
+        except pa.ArrowInvalid as e:
+            # 列类型前后不一致、行长度不齐等 PyArrow 严格模式无法处理的文件，退回 pandas 解析器
+            logger.warning(f"PyArrow CSV 解析失败，退回 pandas: {e}")
+            return pd.read_csv(path)
 
     def peek(self, path: str, n: int = 5):
         return pd.read_csv(path, nrows=n)
 
+    def count_rows(self, path: str) -> int:
+        # [优化] 按块统计换行符 (C 层 memchr)，不做任何解析；引号内的换行会被计入，仅用于画像中的行数概览
+        newlines, last = 0, b""
+        with open(path, "rb") as f:
+            while chunk := f.read(_COUNT_CHUNK_SIZE):
+                newlines += chunk.count(b"\n")
+                last = chunk
+        if not last:
+            return 0
+        # 减去表头；末行没有换行符时补计一行
+        return max(newlines - 1 + (not last.endswith(b"\n")), 0)
+
 
 class ParquetLoader(BaseLoader):
-    def load(self, path: str):
-        return pd.read_parquet(path)
+    def load(self, path: str, columns: Optional[List[str]] = None):
+        # [优化] memory_map 直接映射文件页：多个 worker 加载同一数据集时共享 OS page cache；
+        # columns 下推到列存读取，只解码调用方需要的列
+        table = pq.read_table(path, columns=columns, memory_map=True)
+        # split_blocks + self_destruct：按列转换并即时释放 Arrow 缓冲区，转换峰值内存约减半
+        return table.to_pandas(split_blocks=True, self_destruct=True)
 
     def peek(self, path: str, n: int = 5):
-        # Parquet 不支持直接 nrows，通常读取后再 head
-        return pd.read_parquet(path).head(n)
+        # [优化] 通过 pyarrow dataset 只扫描前 n 行，避免解码整个文件
+        return ds.dataset(path, format="parquet").head(n).to_pandas()
+
+    def count_rows(self, path: str) -> int:
+        # 行数直接读取 Parquet 元数据，不读取数据页
+        return ds.dataset(path, format="parquet").count_rows()
+
+    def sample_and_count(self, path: str, n: int = 5) -> Tuple[Any, int]:
+        # 只打开一次文件：行数取自 footer 元数据，预览只解码第一个批次
+        pf = pq.ParquetFile(path, memory_map=True)
+        total = pf.metadata.num_rows
+        batch = next(pf.iter_batches(batch_size=max(n, 1)), None)
+        preview = batch.to_pandas() if batch is not None else pf.schema_arrow.empty_table().to_pandas()
+        return preview.head(n), total
 
 
 class SHPLoader(BaseLoader):
     """
     Shapefile 加载器：时空数据的关键。
     它返回的是 GeoDataFrame，自带 geometry 属性。
+    [优化] 统一走 pyogrio：行数上限下推到 GDAL，全量读取使用 Arrow 批量通道 (比逐要素构造快数倍)。
+    同一实现也用于 GeoPackage / FlatGeobuf / GeoJSON 等 GDAL 可读的矢量格式。
     """
 
     def load(self, path: str):
-        return gpd.read_file(path)
+        try:
+            return pyogrio.read_dataframe(path, use_arrow=True)
+        except (RuntimeError, ImportError):
+            # GDAL 未编译 Arrow 支持时退回逐要素读取
+            return pyogrio.read_dataframe(path)
 
     def peek(self, path: str, n: int = 5):
-        return gpd.read_file(path, rows=n)
+        return pyogrio.read_dataframe(path, max_features=n)
+
+    def count_rows(self, path: str) -> int:
+        # 要素数量来自 GDAL 图层元数据，无需解析几何
+        return pyogrio.read_info(path)["features"]
 
 
 class LoaderFactory:
@@ -53,7 +122,7 @@ class LoaderFactory:
             return CSVLoader()
         elif ext == 'parquet':
             return ParquetLoader()
-        elif ext in ['shp', 'geojson', 'json']:
+        elif ext in ['shp', 'geojson', 'json', 'gpkg', 'fgb']:
             return SHPLoader()
         else:
             raise ValueError(f"Unsupported file format: {ext}")
\ No newline at end of file
@@ -159,13 +159,52 @@
 #
 import json
 import logging
-from typing import Dict, List, Any
+import orjson
+from typing import Callable, Dict, List, Any, Optional
 from openai import OpenAI, APIError, AuthenticationError, APIConnectionError
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# DeepSeek 的对话前缀续写 (Chat Prefix Completion) 目前仅在 beta 端点提供
+DEEPSEEK_BETA_BASE_URL = "https://api.deepseek.com/beta"
+
+
+class JsonCloseDetector:
+    """
+    流式 JSON 的闭合判定 (stop_when 回调)：
+    每次只扫描新到达的文本，跟踪括号深度与字符串/转义状态，顶层对象或数组闭合时返回 True。
+    """
+
+    def __init__(self):
+        self._pos = 0
+        self._depth = 0
+        self._opened = False
+        self._in_string = False
+        self._escape = False
+
+    def __call__(self, text: str) -> bool:
+        for ch in text[self._pos:]:
+            self._pos += 1
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+                self._opened = True
+            elif ch in "}]":
+                self._depth -= 1
+                if self._opened and self._depth == 0:
+                    return True
+        return False
+
 
 class AIClient:
     """
@@ -212,21 +251,35 @@ class AIClient:
             logger.error(f"健康检查失败: {e}")
             return False
 
-    def chat(self, messages: List[Dict[str, str]], json_mode: bool = False) -> str:
+    def chat(
+            self,
+            messages: List[Dict[str, str]],
+            json_mode: bool = False,
+            stop_when: Optional[Callable[[str], bool]] = None,
+            temperature: Optional[float] = None
+    ) -> str:
         """
         发送聊天请求。
 
         Args:
             messages: 消息列表 [{"role": "user", "content": "..."}]
             json_mode: 是否强制输出 JSON 格式
+            stop_when: [新增] 可选的提前终止判定。提供时改为流式读取，
+                       每收到一段输出就以已累积的文本调用一次，返回 True 即关闭连接并返回当前文本
+                       (用于跳过代码块之后模型追加的解释性文字)
+            temperature: 可选的采样温度；缺省时 JSON 模式为 0.0，其余为 0.7
         """
+        if temperature is None:
+            temperature = 0.0 if json_mode else 0.7
+        if stop_when is not None:
+            return self._chat_until(messages, json_mode, stop_when, temperature)
         try:
             # 构造请求参数
             params = {
                 "model": self.model_name,
                 "messages": messages,
                 "stream": False,
-                "temperature": 0.0 if json_mode else 0.7,  # JSON 模式通常需要更确定的输出
+                "temperature": temperature,
             }
 
             # 启用 JSON Mode (DeepSeek 支持 OpenAI 格式的 json_object)
@@ -247,9 +300,92 @@ class AIClient:
             logger.error(f"LLM 请求发生未知错误: {e}")
             raise e
 
-    def query_json(self, prompt: str, system_prompt: str = "You are a helpful data assistant.") -> Dict[str, Any]:
+    def _chat_until(
+            self,
+            messages: List[Dict[str, str]],
+            json_mode: bool,
+            stop_when: Callable[[str], bool],
+            temperature: float
+    ) -> str:
+        """流式读取回复，满足 stop_when 时提前关闭流，省去剩余 token 的解码等待"""
+        params = {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": True,
+            "temperature": temperature,
+        }
+        if json_mode:
+            params["response_format"] = {"type": "json_object"}
+        return self._read_stream(self.client, params, stop_when)
+
+    @staticmethod
+    def _read_stream(client: OpenAI, params: Dict[str, Any], stop_when: Callable[[str], bool]) -> str:
+        text = ""
+        try:
+            stream = client.chat.completions.create(**params)
+            try:
+                for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    text += delta
+                    if stop_when(text):
+                        logger.info("流式输出已满足终止条件，提前结束读取")
+                        break
+            finally:
+                stream.close()
+        except APIError as e:
+            logger.error(f"DeepSeek API 返回错误: {e}")
+            raise ConnectionError(f"DeepSeek API Error: {e}")
+        except Exception as e:
+            logger.error(f"LLM 请求发生未知错误: {e}")
+            raise e
+        return text
+
+    def _chat_prefix(
+            self,
+            messages: List[Dict[str, str]],
+            prefill: str,
+            stop_when: Optional[Callable[[str], bool]] = None
+    ) -> str:
+        """
+        前缀续写：把 prefill 作为 assistant 消息的开头发给模型，模型只续写其后的内容。
+        返回值已拼回 prefill，调用方拿到的是完整回复。
+        提供 stop_when 时改为流式读取，判定函数收到的是拼回 prefill 后的完整文本。
+        """
+        beta = self.client.with_options(base_url=DEEPSEEK_BETA_BASE_URL)
+        params = {
+            "model": self.model_name,
+            "messages": messages + [{"role": "assistant", "content": prefill, "prefix": True}],
+            "stream": stop_when is not None,
+            "temperature": 0.0,
+        }
+        if stop_when is not None:
+            return prefill + self._read_stream(beta, params, lambda text: stop_when(prefill + text))
+        try:
+            response = beta.chat.completions.create(**params)
+            return prefill + (response.choices[0].message.content or "")
+        except APIError as e:
+            logger.error(f"DeepSeek API 返回错误: {e}")
+            raise ConnectionError(f"DeepSeek API Error: {e}")
+        except Exception as e:
+            logger.error(f"LLM 请求发生未知错误: {e}")
+            raise e
+
+    def query_json(
+            self,
+            prompt: str,
+            system_prompt: str = "You are a helpful data assistant.",
+            prefill: Optional[str] = None,
+            stream: bool = False
+    ) -> Dict[str, Any]:
         """
         获取 JSON 结构化数据的高级封装。
+
+        Args:
+            prefill: [新增] 可选的回复开头 (如 JSON 模板中固定不变的起始部分)。
+                     提供时走前缀续写，模型无需再生成这部分 token，也不会再套额外的包裹层
+            stream: [新增] 流式读取，顶层 JSON 对象闭合后立即关闭连接 (跳过模型在 JSON 之后输出的空白/说明)
         """
         # DeepSeek/OpenAI 要求：使用 json_mode 时，Prompt 中必须包含 "json" 字样
         if "json" not in system_prompt.lower() and "json" not in prompt.lower():
@@ -261,13 +397,18 @@ class AIClient:
         ]
 
         # 调用 chat 获取原始字符串
-        raw_response = self.chat(messages, json_mode=True)
+        stop_when = JsonCloseDetector() if stream else None
+        if prefill:
+            raw_response = self._chat_prefix(messages, prefill, stop_when=stop_when)
+        else:
+            raw_response = self.chat(messages, json_mode=True, stop_when=stop_when)
 
         # 数据清洗 (防止 Markdown 包裹)
         clean_response = self._clean_markdown(raw_response)
 
         try:
-            return json.loads(clean_response)
+            # [优化] orjson 解析嵌套较深的规划 JSON 明显快于标准库；其异常类型继承自 json.JSONDecodeError
+            return orjson.loads(clean_response)
         except json.JSONDecodeError:
             logger.error(f"JSON 解析失败。原始返回: {raw_response}")
             raise ValueError("LLM 未返回有效的 JSON 格式")
@@ -0,0 +1,22 @@
+import asyncio
+import contextvars
+from typing import Any, Callable, List
+
+# 并发 LLM 请求上限 (受服务端限流约束，超出后请求会排队而不是报 429)
+LLM_MAX_CONCURRENCY = 4
+
+
+async def gather_bounded(calls: List[Callable[[], Any]], limit: int = LLM_MAX_CONCURRENCY) -> List[Any]:
+    """
+    并发执行一组相互独立的同步 LLM 调用：
+    1. 每个调用在线程中运行，网络等待期间不阻塞事件循环。
+    2. Semaphore 限制同时在途的请求数；返回结果与 calls 顺序一致。
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def _run(call: Callable[[], Any]) -> Any:
+        async with semaphore:
+            ctx = contextvars.copy_context()
+            return await asyncio.to_thread(ctx.run, call)
+
+    return await asyncio.gather(*(_run(call) for call in calls))
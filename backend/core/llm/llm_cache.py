@@ -0,0 +1,445 @@
+import functools
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Any, List, Optional, Tuple, Union
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# 每个缓存实例保留的条目上限
+LLM_CACHE_SIZE = 512
+# 系统提示词缓存上限 (同一进程内同时活跃的数据集结构通常很少)
+PROMPT_CACHE_SIZE = 64
+
+# 持久化 (L2) 缓存：SQLite 数据库路径、条目有效期与总大小上限
+# 相对 backend 目录解析，与进程的当前工作目录无关
+LLM_CACHE_DB_PATH = str(Path(__file__).resolve().parents[2] / ".cache" / "llm_cache.db")
+LLM_CACHE_TTL_SECONDS = 7 * 24 * 3600
+LLM_CACHE_MAX_BYTES = 500 * 1024 * 1024
+# 进程启动时从持久化层预热到内存的条目数
+LLM_CACHE_WARM_SIZE = 64
+# 每写入 N 条检查一次容量，避免每次写入都做全表统计
+_EVICT_CHECK_INTERVAL = 64
+# 命中计数先在内存中累积，攒够 N 次或下一次写入时再批量落库，读路径不产生写事务
+_HIT_FLUSH_INTERVAL = 32
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# 近似查询匹配：英文按单词、中文按相邻二字切分，去掉不影响意图的虚词后比较 Jaccard 相似度；
+# 数字与否定词决定查询含义 (年份、Top N、"不含周末")，必须完全一致才允许匹配
+QUERY_SIMILARITY_THRESHOLD = 0.85
+_ASCII_WORD_RE = re.compile(r"[a-z_]+")
+_CJK_RUN_RE = re.compile(r"[\u4e00-\u9fff]+")
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+_QUERY_STOPWORDS = frozenset({
+    "a", "an", "the", "of", "by", "per", "for", "in", "on", "to", "me", "show", "please", "and",
+})
+# 中文虚词在切分二字词前删除
+_CJK_FILLER = str.maketrans("", "", "的了请把给我各每个")
+_NEGATION_WORDS = frozenset({"not", "no", "non", "without", "except", "excluding", "exclude"})
+_NEGATION_CJK = ("不", "没", "无", "非", "除", "排除", "去掉", "剔除")
+# 排序方向、极值、聚合与比较词：只改其中一个词就是相反/不同的查询，必须完全一致
+_OPERATOR_WORDS = frozenset({
+    "asc", "ascending", "desc", "descending", "increasing", "decreasing", "top", "bottom", "first", "last",
+    "max", "maximum", "highest", "largest", "biggest", "most", "min", "minimum", "lowest", "smallest", "least",
+    "fewest", "earliest", "latest", "oldest", "newest", "sum", "total", "avg", "average", "mean", "median",
+    "count", "above", "below", "over", "under", "more", "less", "greater", "before", "after",
+})
+_OPERATOR_CJK = (
+    "升序", "降序", "正序", "倒序", "倒数", "从高到低", "从低到高", "从大到小", "从小到大", "由高到低", "由低到高",
+    "最高", "最低", "最大", "最小", "最多", "最少", "最早", "最晚", "最新", "最近",
+    "总和", "求和", "合计", "总计", "总数", "平均", "均值", "中位数", "计数", "数量", "个数",
+    "大于", "小于", "高于", "低于", "多于", "少于", "超过", "以上", "以下", "之前", "之后",
+)
+
+
+def normalize_query(query: Optional[str]) -> str:
+    """查询归一化：去除首尾空白、合并连续空白并统一小写，使仅有格式差异的重复提问命中同一条缓存"""
+    return _WHITESPACE_RE.sub(" ", query or "").strip().lower()
+
+
+def query_signature(query: Optional[str]) -> Tuple[frozenset, frozenset]:
+    """
+    查询的近似匹配签名：(意图词集合, 必须完全一致的关键词集合)。
+    意图词为英文单词与中文相邻二字；关键词为数字、否定词以及排序/极值/聚合/比较词。
+    """
+    text = normalize_query(query)
+    words = _ASCII_WORD_RE.findall(text)
+    guards = set(_NUMBER_RE.findall(text))
+    guards.update(w for w in words if w in _NEGATION_WORDS or w in _OPERATOR_WORDS)
+    guards.update(m for m in _NEGATION_CJK if m in text)
+    guards.update(m for m in _OPERATOR_CJK if m in text)
+
+    tokens = {w for w in words if w not in _QUERY_STOPWORDS}
+    for run in _CJK_RUN_RE.findall(text):
+        run = run.translate(_CJK_FILLER)
+        if len(run) == 1:
+            tokens.add(run)
+        tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+    return frozenset(tokens), frozenset(guards)
+
+
+def schema_fingerprint(summaries: Any) -> list:
+    """
+    数据集结构指纹：每个变量的列名集合。
+    作为缓存键的硬性组成部分，保证结构不同的数据集之间绝不复用生成结果。
+    """
+    fingerprint = []
+    for s in summaries or []:
+        stats = s.get("basic_stats", {}) or {}
+        cols = stats.get("column_stats") or s.get("semantic_analysis", {}).get("column_metadata") or {}
+        fingerprint.append([s.get("variable_name"), sorted(map(str, cols))])
+    return fingerprint
+
+
+def summaries_digest(summaries: Any) -> str:
+    """数据摘要的稳定摘要值：内容相同 (与键顺序无关) 的 summaries 得到同一个 key，用于复用由其渲染的提示词"""
+    raw = orjson.dumps(summaries, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+class SQLiteCacheTier:
+    """
+    LLM 缓存的持久化层 (SQLite WAL)：
+    1. 值以 zlib 压缩存储 (生成的代码/规划 JSON 压缩率很高)，进程重启或重新部署后依然命中。
+    2. 条目超过 ttl 视为过期；总大小超过上限时按命中次数 (LFU) 从低到高淘汰。
+    3. 多个缓存实例可共用同一个库，按 namespace 区分。
+    """
+
+    def __init__(
+            self,
+            db_path: str,
+            ttl_seconds: int = LLM_CACHE_TTL_SECONDS,
+            max_bytes: int = LLM_CACHE_MAX_BYTES
+    ):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+        self._pending_hits: Counter = Counter()
+
+    def _connection(self) -> sqlite3.Connection:
+        """首次使用时才建库建表（调用方需持有 self._lock），避免导入模块即产生文件 I/O"""
+        if self._conn is None:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    namespace TEXT NOT NULL,
+                    key       TEXT NOT NULL,
+                    is_text   INTEGER NOT NULL,
+                    blob      BLOB NOT NULL,
+                    created   REAL NOT NULL,
+                    hits      INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (namespace, key)
+                )
+                """
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _encode(value: Union[str, bytes]) -> tuple:
+        is_text = isinstance(value, str)
+        return int(is_text), zlib.compress(value.encode("utf-8") if is_text else value)
+
+    def get(self, namespace: str, key: str) -> Optional[Union[str, bytes]]:
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT is_text, blob FROM llm_cache WHERE namespace = ? AND key = ? AND created > ?",
+                (namespace, key, time.time() - self.ttl_seconds),
+            ).fetchone()
+            if row is None:
+                return None
+            self._pending_hits[(namespace, key)] += 1
+            if sum(self._pending_hits.values()) >= _HIT_FLUSH_INTERVAL:
+                self._flush_hits(conn)
+                conn.commit()
+        raw = zlib.decompress(row[1])
+        return raw.decode("utf-8") if row[0] else raw
+
+    def set(self, namespace: str, key: str, value: Union[str, bytes]):
+        is_text, blob = self._encode(value)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (namespace, key, is_text, blob, created, hits) VALUES (?, ?, ?, ?, ?, 0)",
+                (namespace, key, is_text, blob, time.time()),
+            )
+            self._flush_hits(conn)
+            conn.commit()
+            self._writes += 1
+            if self._writes % _EVICT_CHECK_INTERVAL == 0:
+                self._evict(conn)
+
+    def replace_keys(self, namespace: str, keys: List[str], value: Union[str, bytes]) -> int:
+        """按缓存键覆盖值 (走主键索引，不扫描整表)"""
+        if not keys:
+            return 0
+        is_text, blob = self._encode(value)
+        with self._lock:
+            conn = self._connection()
+            cur = conn.executemany(
+                "UPDATE llm_cache SET is_text = ?, blob = ? WHERE namespace = ? AND key = ?",
+                [(is_text, blob, namespace, key) for key in keys],
+            )
+            conn.commit()
+        return cur.rowcount
+
+    def _flush_hits(self, conn: sqlite3.Connection):
+        """把累积的命中计数批量写入 (调用方持有 self._lock 并负责 commit)"""
+        if self._pending_hits:
+            conn.executemany(
+                "UPDATE llm_cache SET hits = hits + ? WHERE namespace = ? AND key = ?",
+                [(n, ns, key) for (ns, key), n in self._pending_hits.items()],
+            )
+            self._pending_hits.clear()
+
+    def top(self, namespace: str, limit: int) -> list:
+        """命中次数最多的 limit 条未过期条目 [(key, value), ...]，用于进程启动时预热内存层"""
+        with self._lock:
+            conn = self._connection()
+            self._flush_hits(conn)
+            conn.commit()
+            rows = conn.execute(
+                "SELECT key, is_text, blob FROM llm_cache WHERE namespace = ? AND created > ? "
+                "ORDER BY hits DESC, created DESC LIMIT ?",
+                (namespace, time.time() - self.ttl_seconds, limit),
+            ).fetchall()
+        return [
+            (key, zlib.decompress(blob).decode("utf-8") if is_text else zlib.decompress(blob))
+            for key, is_text, blob in rows
+        ]
+
+    def discard(self, namespace: str, key: str):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM llm_cache WHERE namespace = ? AND key = ?", (namespace, key))
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection):
+        """清理过期条目；总大小仍超限时按 (命中次数, 写入时间) 升序淘汰"""
+        conn.execute("DELETE FROM llm_cache WHERE created <= ?", (time.time() - self.ttl_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(LENGTH(blob)), 0) FROM llm_cache").fetchone()[0]
+        if total > self.max_bytes:
+            excess = total - self.max_bytes
+            doomed, freed = [], 0
+            for rowid, size in conn.execute("SELECT rowid, LENGTH(blob) FROM llm_cache ORDER BY hits, created"):
+                doomed.append((rowid,))
+                freed += size
+                if freed >= excess:
+                    break
+            conn.executemany("DELETE FROM llm_cache WHERE rowid = ?", doomed)
+            logger.info(f"LLM 持久化缓存超出容量，淘汰 {len(doomed)} 条")
+        conn.commit()
+
+
+@functools.lru_cache(maxsize=None)
+def shared_disk_tier(db_path: str) -> SQLiteCacheTier:
+    """同一数据库路径只开一个连接，规划器与代码生成器共用"""
+    return SQLiteCacheTier(db_path)
+
+
+class LLMResponseCache:
+    """
+    LLM 响应缓存 (精确匹配)：
+    1. 键为请求要素 (归一化查询、数据结构指纹、组件规划等) 的 blake2b 摘要，值为 LLM 的输出。
+    2. 同一数据集上的重复/仅格式不同的请求直接返回，跳过数秒到数十秒的网络与解码耗时。
+    3. LRU 淘汰 + 线程锁，可在多个请求线程间共享。
+    4. [新增] 可选的持久化层 (disk)：内存未命中时回查磁盘并回填内存，写入时两层同时写。
+    """
+
+    def __init__(
+            self,
+            name: str,
+            maxsize: int = LLM_CACHE_SIZE,
+            log_hits: bool = True,
+            disk: Optional[SQLiteCacheTier] = None,
+            warm_size: int = 0
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.log_hits = log_hits
+        self.disk = disk
+        # 首次查询时从持久化层预热的条目数 (0 表示不预热)；推迟到首次查询，构造缓存本身不产生文件 I/O
+        self._pending_warm = warm_size if disk is not None else 0
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 命中率统计 (内存层与持久化层命中都计为命中)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(**parts: Any) -> str:
+        raw = orjson.dumps(parts, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+        return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        if self._pending_warm:
+            limit, self._pending_warm = self._pending_warm, 0
+            self.warm(limit)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        if value is None and self.disk is not None:
+            value = self._disk_call(self.disk.get, self.name, key)
+            if value is not None:
+                self._remember(key, value)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is not None and self.log_hits:
+            logger.info(f"⚡ [{self.name}] LLM 缓存命中 (累计命中率 {self.hit_rate:.0%})")
+        return value
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        """缓存观测指标：命中/未命中次数、命中率与内存层条目数"""
+        with self._lock:
+            size = len(self._entries)
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate, "size": size}
+
+    def set(self, key: str, value: Any):
+        if value is None:
+            return
+        self._remember(key, value)
+        if self.disk is not None:
+            self._disk_call(self.disk.set, self.name, key, value)
+
+    def _remember(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def warm(self, limit: int = LLM_CACHE_WARM_SIZE) -> int:
+        """[新增] 从持久化层载入最常命中的条目到内存层 (不计入命中统计)，返回载入条数"""
+        if self.disk is None:
+            return 0
+        entries = self._disk_call(self.disk.top, self.name, min(limit, self.maxsize)) or []
+        # 命中最多的最后写入，使其在 LRU 中最晚被淘汰
+        for key, value in reversed(entries):
+            self._remember(key, value)
+        if entries:
+            logger.info(f"[{self.name}] 已从持久化缓存预热 {len(entries)} 条")
+        return len(entries)
+
+    def _disk_call(self, fn, *args):
+        """持久化层出错 (磁盘满、库损坏等) 只降级为纯内存缓存，不影响主流程"""
+        try:
+            return fn(*args)
+        except (sqlite3.Error, OSError, zlib.error) as e:
+            logger.warning(f"[{self.name}] LLM 持久化缓存不可用: {e}")
+            return None
+
+    def replace_value(self, old: Any, new: Any) -> int:
+        """
+        把值等于 old 的条目替换为 new (例如用自愈修复后的代码覆盖执行失败的缓存代码)，返回替换条数。
+        按内存层中找到的键同步更新持久化层 (刚生成的结果必然仍在内存层中)。
+        """
+        with self._lock:
+            keys = [k for k, v in self._entries.items() if v == old]
+            for k in keys:
+                self._entries[k] = new
+        if self.disk is not None and keys:
+            self._disk_call(self.disk.replace_keys, self.name, keys, new)
+        return len(keys)
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.disk is not None:
+            self._disk_call(self.disk.discard, self.name, key)
+
+    def clear(self):
+        """只清空内存层；持久化层依靠 TTL 与容量淘汰"""
+        with self._lock:
+            self._entries.clear()
+
+
+class NearDuplicateCache:
+    """
+    [新增] 近似查询缓存 (精确缓存未命中后的第二层)：
+    1. 按作用域键分桶 (数据结构指纹 + 组件规划等必须逐字节一致的要素)，桶外的条目绝不参与匹配。
+    2. 桶内要求数字、否定词与排序/极值/聚合词完全一致，再按意图词集合的 Jaccard 相似度检索，达到阈值即复用，
+       覆盖 "trips by zone" / "trips per zone" 这类改写。
+    3. 仅内存，桶数按 LRU 淘汰、每桶只保留最近的若干条查询。
+    """
+
+    def __init__(
+            self,
+            name: str,
+            threshold: float = QUERY_SIMILARITY_THRESHOLD,
+            maxsize: int = LLM_CACHE_SIZE,
+            per_scope: int = 8
+    ):
+        self.name = name
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.per_scope = per_scope
+        self._scopes: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, scope_key: str, query: Optional[str]) -> Optional[Any]:
+        tokens, guards = query_signature(query)
+        if not tokens:
+            return None
+        best, best_score = None, self.threshold
+        with self._lock:
+            entries = self._scopes.get(scope_key)
+            if not entries:
+                return None
+            self._scopes.move_to_end(scope_key)
+            for cached_tokens, cached_guards, value in entries:
+                if cached_guards != guards:
+                    continue
+                score = len(tokens & cached_tokens) / len(tokens | cached_tokens)
+                if score >= best_score:
+                    best, best_score = value, score
+        if best is not None:
+            logger.info(f"⚡ [{self.name}] 近似查询缓存命中 (相似度 {best_score:.2f})")
+        return best
+
+    def set(self, scope_key: str, query: Optional[str], value: Any):
+        tokens, guards = query_signature(query)
+        if not tokens or value is None:
+            return
+        with self._lock:
+            entries = [e for e in self._scopes.pop(scope_key, []) if e[:2] != (tokens, guards)]
+            entries.append((tokens, guards, value))
+            self._scopes[scope_key] = entries[-self.per_scope:]
+            while len(self._scopes) > self.maxsize:
+                self._scopes.popitem(last=False)
+
+    def replace_value(self, old: Any, new: Any) -> int:
+        replaced = 0
+        with self._lock:
+            for entries in self._scopes.values():
+                for i, (tokens, guards, value) in enumerate(entries):
+                    if value == old:
+                        entries[i] = (tokens, guards, new)
+                        replaced += 1
+        return replaced
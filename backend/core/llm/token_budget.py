@@ -0,0 +1,24 @@
+import re
+
+# 模型上下文窗口 (deepseek-chat 为 64K) 中留给输入的 token 上限，以及为回复预留的部分
+MAX_INPUT_TOKENS = 64000
+RESPONSE_TOKEN_RESERVE = 8000
+
+# 中日韩字符基本上一字一 token，其余文本按约 4 字符一 token 估算
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Token 数的保守估算 (偏高)：不依赖具体模型的分词器，
+    只用于发送前判断 Prompt 是否明显超出上下文窗口。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def within_budget(*texts: str, reserve: int = RESPONSE_TOKEN_RESERVE) -> bool:
+    """多段 Prompt 合计是否在输入预算内"""
+    return sum(estimate_tokens(t) for t in texts) <= MAX_INPUT_TOKENS - reserve
@@ -2,7 +2,9 @@ import logging
 import json
 from typing import Dict, Any, List, Optional
 from core.llm.AI_client import AIClient
+from core.llm.llm_cache import LLM_CACHE_DB_PATH, LLMResponseCache, shared_disk_tier
 from core.schemas.dashboard import InteractionType
+from core.execution.spatial import bbox_filter
 
 logger = logging.getLogger(__name__)
 
@@ -14,8 +16,12 @@ class InteractionMapper:
     为 DashboardPlanner 提供具体的交互逻辑建议。
     """
 
-    def __init__(self, llm_client: AIClient):
+    def __init__(self, llm_client: AIClient, cache_db: Optional[str] = LLM_CACHE_DB_PATH):
         self.llm = llm_client
+        # [新增] 结果只取决于各数据集的语义画像：相同画像组合直接复用上次的识别结果 (cache_db 为 None 时仅内存)
+        self.cache = LLMResponseCache(
+            "InteractionMapper", disk=shared_disk_tier(cache_db) if cache_db else None
+        )
 
     def identify_interaction_anchors(self, summaries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
@@ -68,8 +74,15 @@ class InteractionMapper:
         ]
         """
 
+        cache_key = self.cache.make_key(system=system_prompt, user=user_prompt)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
             anchors = self.llm.query_json(prompt=user_prompt, system_prompt=system_prompt)
+            if isinstance(anchors, list) and anchors:
+                self.cache.set(cache_key, anchors)
             logger.info(f"✅ 识别到 {len(anchors)} 条潜在交互联动规则。")
             return anchors
         except Exception as e:
@@ -83,12 +96,14 @@ class InteractionMapper:
         if not anchors:
             return ""
 
-        hint = "\n=== 建议的交互联动规划 (Interaction Hints) ===\n"
+        parts = ["\n=== 建议的交互联动规划 (Interaction Hints) ===\n"]
         for a in anchors:
-            hint += f"- {a['description']}: "
-            hint += f"建议在规划时让 `{a['source_var']}` 的组件 Links 指向 `{a['target_var']}`，"
-            hint += f"使用键值 `{a['anchor_key']}`。\n"
-        return hint
+            parts.append(
+                f"- {a['description']}: "
+                f"建议在规划时让 `{a['source_var']}` 的组件 Links 指向 `{a['target_var']}`，"
+                f"使用键值 `{a['anchor_key']}`。\n"
+            )
+        return "".join(parts)
 
     def filter_data_by_interaction(self, df: Any, payload: Any) -> Any:
         """
@@ -97,10 +112,11 @@ class InteractionMapper:
         """
         # 如果是 BBox 框选
         if payload.bbox and len(payload.bbox) == 4:
-            min_lon, min_lat, max_lon, max_lat = payload.bbox
-            # 假设 df 是 GeoDataFrame
-            if hasattr(df, 'cx'):
-                return df.cx[min_lon:max_lon, min_lat:max_lat]
+            # GeoDataFrame 走空间索引，普通 DataFrame 按经纬度列过滤
+            try:
+                return bbox_filter(df, payload.bbox)
+            except KeyError:
+                return df
 
         # 如果是特定 ID 点击
         if payload.selected_ids:
@@ -2,6 +2,7 @@ import logging
 import json
 from typing import Dict, Any, List, Optional
 from core.llm.AI_client import AIClient
+from core.llm.llm_cache import LLM_CACHE_DB_PATH, LLMResponseCache, shared_disk_tier
 
 logger = logging.getLogger(__name__)
 
@@ -13,8 +14,12 @@ class RelationMapper:
     为 VizEditor 提供钻取路径的“导航信息”。
     """
 
-    def __init__(self, llm_client: AIClient):
+    def __init__(self, llm_client: AIClient, cache_db: Optional[str] = LLM_CACHE_DB_PATH):
         self.llm = llm_client
+        # [新增] 结果只取决于各数据集的语义画像：相同画像组合直接复用上次的识别结果 (cache_db 为 None 时仅内存)
+        self.cache = LLMResponseCache(
+            "RelationMapper", disk=shared_disk_tier(cache_db) if cache_db else None
+        )
 
     def map_relations(self, summaries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
@@ -62,8 +67,15 @@ class RelationMapper:
         ]
         """
 
+        cache_key = self.cache.make_key(system=system_prompt, user=user_prompt)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
             relations = self.llm.query_json(prompt=user_prompt, system_prompt=system_prompt)
+            if isinstance(relations, list) and relations:
+                self.cache.set(cache_key, relations)
             logger.info(f"✅ 识别到 {len(relations)} 条潜在关联路径。")
             return relations
         except Exception as e:
@@ -78,7 +90,9 @@ class RelationMapper:
         if not relevant:
             return ""
 
-        hint = "检测到数据集关联，可用于钻取分析：\n"
+        parts = ["检测到数据集关联，可用于钻取分析：\n"]
         for r in relevant:
-            hint += f"- 可通过 {r['type']} 与 `{r['target'] if r['source'] == source_var else r['source']}` 关联 (依据: {r['join_on']})\n"
-        return hint
\ No newline at end of file
+            parts.append(
+                f"- 可通过 {r['type']} 与 `{r['target'] if r['source'] == source_var else r['source']}` 关联 (依据: {r['join_on']})\n"
+            )
+        return "".join(parts)
\ No newline at end of file
@@ -1,12 +1,111 @@
+import os
 import json
+import hashlib
 import logging
-from typing import Dict, Any, List
+import tempfile
+from typing import Dict, Any, List, Optional
 from pathlib import Path
+import pandas as pd
 from core.llm.AI_client import AIClient
 from core.ingestion.loader_factory import LoaderFactory
+from core.llm.token_budget import estimate_tokens
 
 logger = logging.getLogger(__name__)
 
+# 语义分析结果缓存版本：修改 Prompt 或输出结构时递增，使旧缓存自动失效
+ANALYZER_VERSION = "v4"
+# 相对 backend 目录解析，与进程的当前工作目录无关
+SEMANTIC_CACHE_DIR = str(Path(__file__).resolve().parents[2] / ".cache" / "semantic")
+
+
+# 批量分析：每次请求合并的文件数上限，以及合并的字段特征 token 估算上限
+MAX_BATCH_FILES = 4
+BATCH_INPUT_TOKENS = 4000
+
+_SYSTEM_PROMPT = """
+        你是一位资深时空数据专家。请对任意数据集样例进行深度语义解析：
+
+        1. 概念抽象化：推断列对应的【通用中文业务概念名称】。
+        2. 【核心】时间维度识别：针对标记为 ST_TIME 的字段，识别：
+           - 精度：数据是秒级、分钟级、小时级还是天级？
+           - 角色：它是下单时间、采集时间还是事件发生时间？
+        3. 【核心】空间维度识别：识别经纬度(ST_LAT/LON)或地理对象(ST_GEO)。
+        4. 字段分类标签：
+           - ST_TIME: 时间戳
+           - ST_LAT/ST_LON/ST_GEO: 地理信息
+           - BIZ_METRIC: 数值指标
+           - BIZ_CAT: 分类维度
+        5. 基数评估：评估唯一值数量，辅助图表选型（<10适合饼图，10-30适合条形图）。
+        """
+
+# 单个文件的 JSON 输出结构 (单文件与批量请求共用)
+_OUTPUT_SCHEMA = """        {
+          "dataset_domain": "识别出的行业领域",
+          "description": "数据集内容详细描述",
+          "column_metadata": {
+            "原始列名": {
+              "concept_name": "中文概念名",
+              "semantic_tag": "上述定义的标签",
+              "cardinality": "唯一值数量预估",
+              "time_granularity": "SECOND | MINUTE | HOUR | DAY | MONTH (仅时间字段)",
+              "is_primary_dimension": true/false
+            }
+          },
+          "temporal_context": {
+            "primary_time_col": "主时间轴列名",
+            "time_span": "推断的时间范围描述 (如：2025年1月全月)",
+            "suggested_resampling": "建议的聚合频率 (如：'1H', '1D', '1W')",
+            "has_periodic_patterns": true/false (是否有明显的周期性特征)
+          },
+          "recommended_analysis": ["包含空间和时间维度的分析建议"],
+          "potential_join_keys": ["可用于关联的字段"]
+        }"""
+
+# 大文件只对首尾各 1MB 取样计算指纹，避免为查缓存而完整读取数 GB 的文件
+_FINGERPRINT_SAMPLE_BYTES = 1 << 20
+
+
+def _file_fingerprint(path: str) -> str:
+    """
+    [优化] 缓存用文件指纹：不超过 2MB 的文件直接计算完整内容哈希；
+    更大的文件使用 "大小 + 修改时间 + 首尾各 1MB" 的哈希，查缓存的 I/O 与文件大小无关。
+    """
+    st = os.stat(path)
+    if st.st_size <= 2 * _FINGERPRINT_SAMPLE_BYTES:
+        return _hash_file(path)
+    h = hashlib.sha256(f"{st.st_size}:{st.st_mtime_ns}".encode())
+    with open(path, "rb") as f:
+        h.update(f.read(_FINGERPRINT_SAMPLE_BYTES))
+        f.seek(-_FINGERPRINT_SAMPLE_BYTES, os.SEEK_END)
+        h.update(f.read(_FINGERPRINT_SAMPLE_BYTES))
+    return h.hexdigest()
+
+
+def _hash_file(path: str) -> str:
+    """按 1MB 分块计算文件内容的 SHA-256（hashlib 由 OpenSSL 提供硬件加速）"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _sample_values(values: List[Any], k: int = 5) -> List[str]:
+    """采样并去重 (保持出现顺序)，特别保留可能的时间字符串；不可哈希的值 (如嵌套结构) 不采样"""
+    try:
+        unique = dict.fromkeys(v for v in values if not _is_null(v))
+    except TypeError:
+        return []
+    return [str(v) for v in list(unique)[:k]]
+
+
+def _is_null(value: Any) -> bool:
+    try:
+        return bool(pd.isna(value))
+    except (TypeError, ValueError):
+        # 数组等容器类值：pd.isna 返回逐元素结果，视为非空
+        return False
+
 
 class SemanticAnalyzer:
     """
@@ -16,34 +115,57 @@ class SemanticAnalyzer:
     3. 分析维度基数，为时空看板规划提供依据。
     """
 
-    def __init__(self, llm_client: AIClient):
+    def __init__(self, llm_client: AIClient, cache_dir: Optional[str] = SEMANTIC_CACHE_DIR):
         self.llm = llm_client
+        # [新增] 按文件内容哈希缓存分析结果，重复上传同一数据集时跳过 LLM 调用；传 None 关闭缓存
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+
+    def _cache_path(self, file_path: str, content_hash: Optional[str] = None) -> Optional[Path]:
+        if self.cache_dir is None:
+            return None
+        try:
+            return self.cache_dir / f"{content_hash or _file_fingerprint(file_path)}.json"
+        except OSError:
+            return None
+
+    def _load_cached(self, cache_path: Optional[Path]) -> Optional[Dict[str, Any]]:
+        if cache_path is None or not cache_path.exists():
+            return None
+        try:
+            cached = json.loads(cache_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if cached.get("analyzer_version") != ANALYZER_VERSION:
+            return None
+        return cached.get("result")
+
+    def _store_cached(self, cache_path: Optional[Path], result: Dict[str, Any]):
+        if cache_path is None:
+            return
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # 先写临时文件再原子替换，避免并发读到半截 JSON
+            fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"analyzer_version": ANALYZER_VERSION, "result": result}, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"语义分析缓存写入失败: {e}")
 
     def _get_basic_fingerprint(self, file_path: str) -> Dict[str, Any]:
         """获取物理层面的指纹：包含对时间列的初步采样"""
         loader = LoaderFactory.get_loader(file_path)
-        df_preview = loader.peek(file_path, n=10)  # 增加到10行，方便 AI 观察时间规律
-        row_count = loader.count_rows(file_path)
-
-        col_stats = {}
-        for col in df_preview.columns:
-            try:
-                has_nulls = bool(df_preview[col].isnull().any())
-            except:
-                has_nulls = False
-
-            try:
-                # 采样并去重，特别保留可能的时间字符串
-                raw_samples = df_preview[col].dropna().unique()[:5].tolist()
-                samples = [str(x) for x in raw_samples]
-            except:
-                samples = []
-
-            col_stats[col] = {
-                "dtype": str(df_preview[col].dtype),
-                "samples": samples,
-                "has_nulls": has_nulls
-            }
+        # 增加到10行，方便 AI 观察时间规律；预览与行数一次取得，避免对同一文件打开/解码两遍
+        df_preview, row_count = loader.sample_and_count(file_path, n=10)
+
+        # [优化] 空值标记与 dtype 各一次整表计算；样本在转换出的小列表上去重，不再逐列调用 pandas
+        null_mask = df_preview.isna().any(axis=0).tolist()
+        dtypes = df_preview.dtypes.astype(str).tolist()
+        values = df_preview.to_dict(orient="list")
+        col_stats = {
+            col: {"dtype": dtype, "samples": _sample_values(values[col]), "has_nulls": bool(has_nulls)}
+            for col, dtype, has_nulls in zip(df_preview.columns, dtypes, null_mask)
+        }
 
         return {
             "rows": row_count,
@@ -51,86 +173,160 @@ class SemanticAnalyzer:
             "filename": Path(file_path).name
         }
 
-    def analyze(self, file_path: str) -> Dict[str, Any]:
-        """主入口：从数据中提取“时空双维度”业务元数据"""
-        logger.info(f"Analyzing universal spatio-temporal semantics for: {file_path}")
+    @staticmethod
+    def _variable_name(file_path: str) -> str:
+        return f"df_{Path(file_path).stem.lower().replace('-', '_')}"
 
-        # 1. 获取物理特征
-        fingerprint = self._get_basic_fingerprint(file_path)
+    def _from_cache(self, file_path: str, cached: Dict[str, Any]) -> Dict[str, Any]:
+        logger.info(f"⚡ 命中语义分析缓存: {file_path}")
+        # 内容相同但路径可能不同，路径相关字段以本次调用为准
+        cached["file_info"]["path"] = file_path
+        cached["file_info"]["name"] = Path(file_path).name
+        cached["variable_name"] = self._variable_name(file_path)
+        return cached
 
-        # 2. 构建包含时间感知逻辑的 System Prompt
-        system_prompt = """
-        你是一位资深时空数据专家。请对任意数据集样例进行深度语义解析：
+    def _build_result(self, file_path: str, fingerprint: Dict[str, Any], ai_result: Dict[str, Any]) -> Dict[str, Any]:
+        """整合指纹与 LLM 解析结果"""
+        # 日志记录识别到的主时间轴
+        p_time = ai_result.get("temporal_context", {}).get("primary_time_col")
+        if p_time:
+            logger.info(f"✅ 已识别主时间轴字段: {p_time}")
 
-        1. 概念抽象化：推断列对应的【通用中文业务概念名称】。
-        2. 【核心】时间维度识别：针对标记为 ST_TIME 的字段，识别：
-           - 精度：数据是秒级、分钟级、小时级还是天级？
-           - 角色：它是下单时间、采集时间还是事件发生时间？
-        3. 【核心】空间维度识别：识别经纬度(ST_LAT/LON)或地理对象(ST_GEO)。
-        4. 字段分类标签：
-           - ST_TIME: 时间戳
-           - ST_LAT/ST_LON/ST_GEO: 地理信息
-           - BIZ_METRIC: 数值指标
-           - BIZ_CAT: 分类维度
-        5. 基数评估：评估唯一值数量，辅助图表选型（<10适合饼图，10-30适合条形图）。
+        return {
+            "file_info": {
+                "path": file_path,
+                "name": fingerprint['filename'],
+                "domain": ai_result.get("dataset_domain", "unknown")
+            },
+            "basic_stats": {
+                "rows": fingerprint['rows'],
+                "column_count": len(fingerprint['columns'])
+            },
+            "semantic_analysis": ai_result,
+            "variable_name": self._variable_name(file_path)
+        }
+
+    def analyze(self, file_path: str, content_hash: Optional[str] = None) -> Dict[str, Any]:
+        """
+        主入口：从数据中提取“时空双维度”业务元数据。
+        content_hash 为上传阶段已计算的 SHA-256，传入时不再重复读取文件。
         """
+        logger.info(f"Analyzing universal spatio-temporal semantics for: {file_path}")
+
+        cache_path = self._cache_path(file_path, content_hash)
+        cached = self._load_cached(cache_path)
+        if cached is not None:
+            return self._from_cache(file_path, cached)
 
-        # 3. 定义包含 temporal_context 的 JSON 输出结构
+        # 1. 获取物理特征
+        fingerprint = self._get_basic_fingerprint(file_path)
+        return self._analyze_fingerprint(file_path, fingerprint, cache_path)
+
+    def _analyze_fingerprint(
+            self, file_path: str, fingerprint: Dict[str, Any], cache_path: Optional[Path]
+    ) -> Dict[str, Any]:
+        """单文件 LLM 解析 (指纹已就绪)"""
+        # 2. 定义包含 temporal_context 的 JSON 输出结构
         user_prompt = f"""
         数据文件: {fingerprint['filename']}
         数据行数: {fingerprint['rows']}
         字段特征预览: {json.dumps(fingerprint['columns'], ensure_ascii=False)}
 
         请输出 JSON 格式：
-        {{
-          "dataset_domain": "识别出的行业领域",
-          "description": "数据集内容详细描述",
-          "column_metadata": {{
-            "原始列名": {{
-              "concept_name": "中文概念名",
-              "semantic_tag": "上述定义的标签",
-              "cardinality": "唯一值数量预估",
-              "time_granularity": "SECOND | MINUTE | HOUR | DAY | MONTH (仅时间字段)",
-              "is_primary_dimension": true/false
-            }}
-          }},
-          "temporal_context": {{
-            "primary_time_col": "主时间轴列名",
-            "time_span": "推断的时间范围描述 (如：2025年1月全月)",
-            "suggested_resampling": "建议的聚合频率 (如：'1H', '1D', '1W')",
-            "has_periodic_patterns": true/false (是否有明显的周期性特征)
-          }},
-          "recommended_analysis": ["包含空间和时间维度的分析建议"],
-          "potential_join_keys": ["可用于关联的字段"]
-        }}
+{_OUTPUT_SCHEMA}
         """
 
         try:
             # 调用 AIClient 获取结构化输出
-            ai_result = self.llm.query_json(prompt=user_prompt, system_prompt=system_prompt)
-
-            # 整合最终结果
-            final_result = {
-                "file_info": {
-                    "path": file_path,
-                    "name": fingerprint['filename'],
-                    "domain": ai_result.get("dataset_domain", "unknown")
-                },
-                "basic_stats": {
-                    "rows": fingerprint['rows'],
-                    "column_count": len(fingerprint['columns'])
-                },
-                "semantic_analysis": ai_result,
-                "variable_name": f"df_{Path(file_path).stem.lower().replace('-', '_')}"
-            }
-
-            # 日志记录识别到的主时间轴
-            p_time = ai_result.get("temporal_context", {}).get("primary_time_col")
-            if p_time:
-                logger.info(f"✅ 已识别主时间轴字段: {p_time}")
-
+            ai_result = self.llm.query_json(prompt=user_prompt, system_prompt=_SYSTEM_PROMPT)
+            final_result = self._build_result(file_path, fingerprint, ai_result)
+            self._store_cached(cache_path, final_result)
             return final_result
 
         except Exception as e:
             logger.error(f"Spatio-temporal analysis failed: {e}")
-            return {"error": str(e)}
\ No newline at end of file
+            return {"error": str(e)}
+
+    def analyze_batch(
+            self,
+            file_paths: List[str],
+            content_hashes: Optional[List[Optional[str]]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        [新增] 批量语义分析：未命中缓存的文件按 token 预算分组，每组合并为一次 LLM 调用，
+        往返次数约降为 1/K。批量响应中缺失或格式不对的文件单独重试；返回结果与 file_paths 顺序一致。
+        """
+        hashes = content_hashes or [None] * len(file_paths)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(file_paths)
+        pending = []  # (序号, 路径, 缓存路径, 指纹)
+        for i, (path, content_hash) in enumerate(zip(file_paths, hashes)):
+            cache_path = self._cache_path(path, content_hash)
+            cached = self._load_cached(cache_path)
+            if cached is not None:
+                results[i] = self._from_cache(path, cached)
+                continue
+            pending.append((i, path, cache_path, self._get_basic_fingerprint(path)))
+
+        for group in self._batch_groups(pending):
+            if len(group) == 1:
+                i, path, cache_path, fingerprint = group[0]
+                results[i] = self._analyze_fingerprint(path, fingerprint, cache_path)
+                continue
+            for i, result in self._analyze_group(group).items():
+                results[i] = result
+        return results
+
+    @staticmethod
+    def _batch_groups(pending: List[tuple]) -> List[List[tuple]]:
+        """按估算的指纹 token 数与文件数上限切分批次"""
+        groups, current, tokens = [], [], 0
+        for item in pending:
+            cost = estimate_tokens(json.dumps(item[3]['columns'], ensure_ascii=False))
+            if current and (len(current) >= MAX_BATCH_FILES or tokens + cost > BATCH_INPUT_TOKENS):
+                groups.append(current)
+                current, tokens = [], 0
+            current.append(item)
+            tokens += cost
+        if current:
+            groups.append(current)
+        return groups
+
+    def _analyze_group(self, group: List[tuple]) -> Dict[int, Dict[str, Any]]:
+        logger.info(f"Analyzing {len(group)} files in one batched request")
+        files = [
+            {
+                "file_id": f"f{n}",
+                "filename": fingerprint['filename'],
+                "rows": fingerprint['rows'],
+                "columns": fingerprint['columns']
+            }
+            for n, (_, _, _, fingerprint) in enumerate(group)
+        ]
+        user_prompt = f"""
+        以下是 {len(files)} 个数据文件的物理特征 (file_id 为文件标识):
+        {json.dumps(files, ensure_ascii=False)}
+
+        请分别解析每个文件，输出一个 JSON 对象，键为 file_id，值为该文件的解析结果：
+        {{"f0": <结果>, "f1": <结果>, ...}}
+
+        每个文件的解析结果格式如下：
+{_OUTPUT_SCHEMA}
+        """
+        try:
+            batch_result = self.llm.query_json(prompt=user_prompt, system_prompt=_SYSTEM_PROMPT)
+        except Exception as e:
+            logger.warning(f"批量语义分析失败，改为逐个文件分析: {e}")
+            batch_result = {}
+        if not isinstance(batch_result, dict):
+            batch_result = {}
+
+        results = {}
+        for n, (i, path, cache_path, fingerprint) in enumerate(group):
+            ai_result = batch_result.get(f"f{n}")
+            if isinstance(ai_result, dict) and ai_result.get("column_metadata"):
+                results[i] = self._build_result(path, fingerprint, ai_result)
+                self._store_cached(cache_path, results[i])
+            else:
+                # 批量响应缺失该文件或格式不对：单独重试
+                results[i] = self._analyze_fingerprint(path, fingerprint, cache_path)
+        return results
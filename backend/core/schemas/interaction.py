@@ -59,4 +59,13 @@ class InteractionPayload(BaseModel):
     )
 
     # 当前上下文
-    current_dashboard_id: Optional[str] = Field(None, description="当前页面正在显示的看板ID")
\ No newline at end of file
+    current_dashboard_id: Optional[str] = Field(None, description="当前页面正在显示的看板ID")
+
+
+class InteractionBatchPayload(BaseModel):
+    """
+    [新增] 批量交互载荷：前端把短时间内连续触发的交互合并为一次请求，
+    后端按顺序执行，相邻的 UI 过滤动作会先合并为一次执行。
+    """
+    session_id: str = Field(..., description="用于维持对话上下文的会话ID")
+    events: List[InteractionPayload] = Field(..., min_length=1, description="按触发顺序排列的交互事件")
@@ -44,6 +44,35 @@ class SessionStateStore(BaseModel):
     snapshots: List[SessionStateSnapshot] = Field(default_factory=list)
     # 当前激活的快照 ID
     current_snapshot_id: Optional[str] = None
+    # 历史摘要索引 (轻量)：较早的完整快照可能已移出内存，历史列表以此为准
+    history: List[Dict[str, Any]] = Field(default_factory=list)
+
+    def add_snapshot(self, snapshot: SessionStateSnapshot) -> None:
+        """
+        追加快照 (写时复制)：
+        与上一快照内容完全一致的组件直接复用旧对象，长会话中未变化的数据负载只保存一份。
+        """
+        if self.snapshots:
+            prev_components = {c.id: c for c in self.snapshots[-1].layout_data.components}
+            components = snapshot.layout_data.components
+            for i, comp in enumerate(components):
+                prev = prev_components.get(comp.id)
+                if prev is not None and prev is not comp and prev == comp:
+                    components[i] = prev
+
+        self.snapshots.append(snapshot)
+        self.history.append({
+            "snapshot_id": snapshot.snapshot_id,
+            "query": snapshot.user_query,
+            "time": snapshot.timestamp.strftime("%H:%M:%S"),
+            "summary": snapshot.summary_text
+        })
+        self.current_snapshot_id = snapshot.snapshot_id
+
+    def trim(self, keep: int) -> None:
+        """内存中只保留最近 keep 个完整快照，更早的快照由持久化层按需加载"""
+        if len(self.snapshots) > keep:
+            del self.snapshots[:-keep]
 
     def get_snapshot(self, snapshot_id: str) -> Optional[SessionStateSnapshot]:
         """快速检索指定快照"""
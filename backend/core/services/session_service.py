@@ -1,5 +1,9 @@
+import itertools
 import logging
+import time
 import uuid
+from collections import OrderedDict
+from contextvars import ContextVar, Token
 from typing import Dict, Any, Optional, List
 from pathlib import Path
 from datetime import datetime
@@ -9,9 +13,26 @@ from core.ingestion.ingestion import IngestionManager
 from core.profiler.basic_stats import get_dataset_fingerprint
 from core.schemas.state import SessionStateSnapshot, SessionStateStore
 from core.schemas.dashboard import DashboardSchema
+from core.services.snapshot_repository import SnapshotRepository
 
 logger = logging.getLogger(__name__)
 
+# 当前请求绑定的会话：请求入口解析一次后写入，下游 get_session 直接复用，无需重复查表与过期检查
+_ctx_session: ContextVar[Optional[Dict[str, Any]]] = ContextVar("session", default=None)
+
+# 会话空闲超时（秒）：超过该时间未访问的会话会被自动回收，避免内存无限增长
+SESSION_TTL_SECONDS = 3600
+
+# 快照持久化：SQLite 数据库路径；内存中每个会话只保留最近 N 个完整快照
+SNAPSHOT_DB_PATH = str(Path(__file__).resolve().parents[2] / ".cache" / "snapshots.db")
+MAX_SNAPSHOTS_IN_MEMORY = 10
+
+# 每个会话保留的 Arrow 表格结果数量上限（超出后淘汰最早的）
+MAX_ARTIFACTS_PER_SESSION = 32
+
+# 数据版本号：会话的数据上下文每次被替换 (新建/切换全量) 时取一个新值，用作执行结果缓存键的一部分
+_data_generations = itertools.count(1)
+
 
 class SessionManager:
     """
@@ -20,14 +41,24 @@ class SessionManager:
     2. [关键升级] 管理看板状态快照序列，支持历史回溯。
     """
 
-    def __init__(self):
+    def __init__(self, ttl_seconds: int = SESSION_TTL_SECONDS, snapshot_db: Optional[str] = SNAPSHOT_DB_PATH):
         # 内存存储结构: { session_id: { "store": SessionStateStore, "data_context": {...}, ... } }
         self._sessions: Dict[str, Dict[str, Any]] = {}
         self.ingestion_manager = IngestionManager()
+        self.ttl_seconds = ttl_seconds
+        # snapshot_db 为 None 时快照仅保存在内存中 (不裁剪)
+        self.snapshot_repo = SnapshotRepository(snapshot_db) if snapshot_db else None
 
-    def create_session(self, session_id: str, file_paths: List[str]) -> Dict[str, Any]:
-        """创建新会话并初始化画像"""
+    def create_session(
+            self,
+            session_id: str,
+            file_paths: List[str],
+            file_hashes: Optional[Dict[str, str]] = None
+    ) -> Dict[str, Any]:
+        """创建新会话并初始化画像；file_hashes 为上传时计算的 {路径: SHA-256}，用于语义分析缓存"""
+        file_hashes = file_hashes or {}
         logger.info(f">>> 初始化高交互会话 {session_id}...")
+        self._evict_expired()
 
         # 1. 初始加载：采样模式
         data_context = self.ingestion_manager.load_all_to_context(file_paths, use_full=False)
@@ -41,15 +72,23 @@ class SessionManager:
 
                 summaries.append({
                     "variable_name": var_name,
-                    "file_info": {"path": str(matched_path), "rows": fingerprint["rows"]},
+                    "file_info": {
+                        "path": str(matched_path),
+                        "rows": fingerprint["rows"],
+                        "sha256": file_hashes.get(matched_path)
+                    },
                     "basic_stats": fingerprint,
                     "semantic_analysis": {"description": f"数据源: {Path(matched_path).name}", "semantic_tags": {}}
                 })
             except Exception as e:
                 logger.error(f"画像生成失败: {e}")
 
-        # 3. 初始化快照存储库
+        # 3. 初始化快照存储库 (同一 session_id 重建时恢复已持久化的历史记录)
         state_store = SessionStateStore(session_id=session_id)
+        if self.snapshot_repo:
+            state_store.history = self.snapshot_repo.list_history(session_id)
+            if state_store.history:
+                state_store.current_snapshot_id = state_store.history[-1]["snapshot_id"]
 
         session_state = {
             "session_id": session_id,
@@ -57,8 +96,13 @@ class SessionManager:
             "summaries": summaries,
             "file_paths": file_paths,
             "is_full_data": False,
+            "data_generation": next(_data_generations),
             "state_store": state_store,  # [关键新增] 快照存储
-            "last_workflow_state": None
+            "last_workflow_state": None,
+            "last_access": time.monotonic(),
+            "artifacts": OrderedDict(),  # {artifact_id: Arrow IPC bytes}
+            # [优化] /metadata 轮询接口直接返回的预计算投影
+            "_metadata_projection": self._project_metadata(summaries)
         }
 
         self._sessions[session_id] = session_state
@@ -76,6 +120,7 @@ class SessionManager:
     ) -> str:
         """
         保存当前看板状态为快照。
+        持久化涉及序列化、zlib 压缩与 SQLite 写入，异步调用方应通过 asyncio.to_thread 调用。
         """
         session = self.get_session(session_id)
         if not session: return ""
@@ -92,10 +137,14 @@ class SessionManager:
             summary_text=summary or f"分析: {query[:15]}..."
         )
 
-        # 存入序列
+        # 存入序列 (未变化的组件与上一快照共享)
         store: SessionStateStore = session["state_store"]
-        store.snapshots.append(new_snapshot)
-        store.current_snapshot_id = snapshot_id
+        parent_id = store.current_snapshot_id
+        store.add_snapshot(new_snapshot)
+
+        # 持久化成功后，较早的完整快照即可移出内存
+        if self.snapshot_repo and self.snapshot_repo.save(session_id, new_snapshot, parent_id):
+            store.trim(MAX_SNAPSHOTS_IN_MEMORY)
 
         logger.info(f"✅ 快照已存档: {snapshot_id} (Session: {session_id})")
         return snapshot_id
@@ -103,9 +152,13 @@ class SessionManager:
     def get_snapshot(self, session_id: str, snapshot_id: str) -> Optional[SessionStateSnapshot]:
         """获取特定历史快照"""
         session = self.get_session(session_id)
-        if session:
-            return session["state_store"].get_snapshot(snapshot_id)
-        return None
+        if not session:
+            return None
+
+        snapshot = session["state_store"].get_snapshot(snapshot_id)
+        if snapshot is None and self.snapshot_repo:
+            snapshot = self.snapshot_repo.load(session_id, snapshot_id)
+        return snapshot
 
     def get_history_list(self, session_id: str) -> List[Dict[str, Any]]:
         """
@@ -114,15 +167,26 @@ class SessionManager:
         session = self.get_session(session_id)
         if not session: return []
 
-        return [
-            {
-                "snapshot_id": s.snapshot_id,
-                "query": s.user_query,
-                "time": s.timestamp.strftime("%H:%M:%S"),
-                "summary": s.summary_text
-            }
-            for s in session["state_store"].snapshots
-        ]
+        return list(session["state_store"].history)
+
+    def store_artifact(self, session_id: str, data: bytes) -> str:
+        """保存一份 Arrow 表格结果，返回供前端下载的 artifact_id"""
+        session = self.get_session(session_id)
+        if not session:
+            return ""
+
+        artifact_id = f"art_{uuid.uuid4().hex[:12]}"
+        artifacts = session.setdefault("artifacts", OrderedDict())
+        artifacts[artifact_id] = data
+        while len(artifacts) > MAX_ARTIFACTS_PER_SESSION:
+            artifacts.popitem(last=False)
+        return artifact_id
+
+    def get_artifact(self, session_id: str, artifact_id: str) -> Optional[bytes]:
+        session = self.get_session(session_id)
+        if not session:
+            return None
+        return session.get("artifacts", {}).get(artifact_id)
 
     # --- 数据一致性维护 ---
 
@@ -133,20 +197,57 @@ class SessionManager:
 
         logger.info(f">>> 切换会话 {session_id} 至全量数据模式...")
         try:
-            full_context = self.ingestion_manager.load_all_to_context(session["file_paths"], use_full=True)
+            # 惰性全量上下文：只有生成代码访问到的数据集才会被真正读入
+            full_context = self.ingestion_manager.lazy_full_context(session["file_paths"])
             session["data_context"] = full_context
             session["is_full_data"] = True
+            session["data_generation"] = next(_data_generations)
         except Exception as e:
             logger.error(f"全量加载失败: {e}")
 
+    def bind_session(self, session: Dict[str, Any]) -> Token:
+        """将会话绑定到当前请求上下文（对嵌套的协程/调用链可见），返回用于解绑的 token"""
+        return _ctx_session.set(session)
+
+    def unbind_session(self, token: Token):
+        _ctx_session.reset(token)
+
     def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
-        return self._sessions.get(session_id)
+        bound = _ctx_session.get()
+        if bound is not None and bound["session_id"] == session_id:
+            # 绑定的会话同样要确认未被删除、未过期；否则走下方常规路径 (过期时顺带回收)
+            if self._sessions.get(session_id) is bound and not self._is_expired(bound):
+                return bound
+
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if self._is_expired(session):
+            self.delete_session(session_id, purge_history=False)
+            return None
+        session["last_access"] = time.monotonic()
+        return session
 
-    def delete_session(self, session_id: str):
+    def _is_expired(self, session: Dict[str, Any]) -> bool:
+        last_access = session.get("last_access")
+        return last_access is not None and time.monotonic() - last_access > self.ttl_seconds
+
+    def _evict_expired(self):
+        """回收所有超过空闲时间的会话，释放其占用的 DataFrame 内存"""
+        expired = [sid for sid, s in self._sessions.items() if self._is_expired(s)]
+        for sid in expired:
+            # 仅释放内存，已持久化的历史快照保留，重新上传同一会话时可恢复
+            self.delete_session(sid, purge_history=False)
+        if expired:
+            logger.info(f"♻️ 已回收 {len(expired)} 个空闲会话")
+
+    def delete_session(self, session_id: str, purge_history: bool = True):
         if session_id in self._sessions:
             self._sessions[session_id]["data_context"].clear()
             del self._sessions[session_id]
             logger.info(f"🗑️ 会话 {session_id} 已移除。")
+        if purge_history and self.snapshot_repo:
+            self.snapshot_repo.delete_session(session_id)
 
     def update_session_metadata(self, session_id: str, metadata: Dict[str, Any]):
         """
@@ -157,8 +258,30 @@ class SessionManager:
         if session:
             # 将最新的看板元数据同步到 session 的顶层状态中
             session["last_workflow_state"] = metadata
+            # 首轮分析会把语义画像写回 summaries，此处同步刷新元数据投影
+            session["_metadata_projection"] = self._project_metadata(session["summaries"])
             logger.info(f"💾 会话元数据已同步: {session_id}")
 
+    @staticmethod
+    def _project_metadata(summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """提取前端初始化所需的变量列表与时间特征 (时间轴、重采样建议等)"""
+        variables = []
+        temporal = []
+        for summary in summaries:
+            var_name = summary.get("variable_name")
+            variables.append(var_name)
+
+            temp_ctx = summary.get("semantic_analysis", {}).get("temporal_context", {})
+            if temp_ctx and temp_ctx.get("primary_time_col"):
+                temporal.append({
+                    "variable": var_name,
+                    "column": temp_ctx.get("primary_time_col"),
+                    "span": temp_ctx.get("time_span"),
+                    "suggested_resampling": temp_ctx.get("suggested_resampling")
+                })
+
+        return {"temporal": temporal, "variables": variables}
+
 
 # 单例
 session_service = SessionManager()
\ No newline at end of file
@@ -0,0 +1,109 @@
+import zlib
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from core.schemas.state import SessionStateSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotRepository:
+    """
+    快照持久化仓库 (SQLite WAL)：
+    1. 快照以 zlib 压缩后的 JSON 存储，worker 重启后历史记录依然可回溯。
+    2. 内存中只需保留最近若干个快照，长会话的内存占用不再随对话轮数增长。
+    3. WAL 模式下读写互不阻塞，历史列表查询不会被新快照写入卡住。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        """首次使用时才建库建表（调用方需持有 self._lock），避免导入模块即产生文件 I/O"""
+        if self._conn is None:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    snapshot_id TEXT PRIMARY KEY,
+                    session_id  TEXT NOT NULL,
+                    parent_id   TEXT,
+                    ts          TEXT NOT NULL,
+                    query       TEXT,
+                    summary     TEXT,
+                    blob        BLOB NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_snapshots_session ON snapshots (session_id)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def save(self, session_id: str, snapshot: SessionStateSnapshot, parent_id: Optional[str] = None) -> bool:
+        """写入单个快照，成功返回 True"""
+        try:
+            blob = zlib.compress(snapshot.model_dump_json().encode("utf-8"))
+        except Exception as e:
+            logger.warning(f"快照 {snapshot.snapshot_id} 序列化失败，仅保留在内存中: {e}")
+            return False
+
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO snapshots (snapshot_id, session_id, parent_id, ts, query, summary, blob) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    snapshot.snapshot_id,
+                    session_id,
+                    parent_id,
+                    snapshot.timestamp.isoformat(),
+                    snapshot.user_query,
+                    snapshot.summary_text,
+                    blob,
+                ),
+            )
+            conn.commit()
+        return True
+
+    def load(self, session_id: str, snapshot_id: str) -> Optional[SessionStateSnapshot]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT blob FROM snapshots WHERE session_id = ? AND snapshot_id = ?",
+                (session_id, snapshot_id),
+            ).fetchone()
+        if row is None:
+            return None
+        return SessionStateSnapshot.model_validate_json(zlib.decompress(row[0]))
+
+    def list_history(self, session_id: str) -> List[Dict[str, Any]]:
+        """按写入顺序返回历史摘要 (不解压快照内容)"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT snapshot_id, ts, query, summary FROM snapshots WHERE session_id = ? ORDER BY rowid",
+                (session_id,),
+            ).fetchall()
+        return [
+            {
+                "snapshot_id": snapshot_id,
+                "query": query,
+                "time": datetime.fromisoformat(ts).strftime("%H:%M:%S"),
+                "summary": summary
+            }
+            for snapshot_id, ts, query, summary in rows
+        ]
+
+    def delete_session(self, session_id: str):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM snapshots WHERE session_id = ?", (session_id,))
+            conn.commit()
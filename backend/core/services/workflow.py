@@ -1,7 +1,11 @@
+import asyncio
+import contextvars
+import functools
 import logging
 import traceback
 import json
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
+from pydantic import BaseModel
 
 # --- 核心模块导入 ---
 from core.llm.AI_client import AIClient
@@ -11,7 +15,9 @@ from core.profiler.interaction_mapper import InteractionMapper  # [新增]
 from core.generation.dashboard_planner import DashboardPlanner
 from core.generation.viz_generator import CodeGenerator
 from core.generation.viz_editor import VizEditor
-from core.execution.executor import CodeExecutor
+from core.execution.executor import (
+    CodeExecutor, DashboardExecutionResult, EXECUTION_POOL, optimize_plotly_payload
+)
 from core.execution.insight_extractor import InsightExtractor
 
 # --- 协议与 Schema 导入 ---
@@ -23,6 +29,18 @@ import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# Executor 输出的 JSON 原生顶层类型
+_JSON_NATIVE = (dict, list, str, int, float, bool, type(None))
+
+
+class WorkflowEvent(BaseModel):
+    """
+    工作流阶段事件 (用于 SSE 流式推送)：
+    plan_ready -> code_generated -> executed -> dashboard
+    """
+    type: str
+    payload: Any = None
+
 
 class AnalysisWorkflow:
     """
@@ -48,6 +66,59 @@ class AnalysisWorkflow:
             data_context: Dict[str, Any],
             session_service: Any  # 传入 session_service 以便存取快照
     ) -> DashboardSchema:
+        """一次性执行完整工作流，返回最终看板"""
+        async for event in self.execute_step_stream(payload, data_summaries, data_context, session_service):
+            if event.type == "dashboard":
+                return event.payload
+
+    async def execute_batch(
+            self,
+            events: List[InteractionPayload],
+            session_service: Any
+    ) -> Optional[DashboardSchema]:
+        """
+        [新增] 顺序执行一批交互，返回最后一次的看板。
+        相邻的 UI 过滤动作先合并为一次执行，只为最终的过滤状态生成代码与快照。
+        """
+        dashboard = None
+        for payload in self._coalesce_events(events):
+            # 每轮重新读取会话：上一轮可能已切换为全量数据上下文
+            state = session_service.get_session(payload.session_id)
+            dashboard = await self.execute_step(
+                payload=payload,
+                data_summaries=state["summaries"],
+                data_context=state["data_context"],
+                session_service=session_service
+            )
+        return dashboard
+
+    @staticmethod
+    def _coalesce_events(events: List[InteractionPayload]) -> List[InteractionPayload]:
+        """合并连续的 UI 动作：后一次的非空过滤条件覆盖前一次"""
+        merged: List[InteractionPayload] = []
+        for event in events:
+            prev = merged[-1] if merged else None
+            if (
+                    prev is not None
+                    and prev.trigger_type == InteractionTriggerType.UI_ACTION
+                    and event.trigger_type == InteractionTriggerType.UI_ACTION
+            ):
+                merged[-1] = prev.model_copy(update=event.model_dump(exclude_none=True))
+            else:
+                merged.append(event)
+        return merged
+
+    async def execute_step_stream(
+            self,
+            payload: InteractionPayload,
+            data_summaries: List[Dict[str, Any]],
+            data_context: Dict[str, Any],
+            session_service: Any
+    ) -> AsyncIterator[WorkflowEvent]:
+        """
+        [新增] 流式执行工作流：每完成一个阶段即产出事件，前端可提前展示布局与进度，
+        最后一个事件 (dashboard) 携带完整看板。
+        """
 
         # === 0. 逻辑分流：历史回溯 (Backtracking) ===
         # 如果是点击左侧历史记录，直接返回存档，不走 AI 逻辑
@@ -55,21 +126,30 @@ class AnalysisWorkflow:
             logger.info(f">>> [Backtrack] 正在还原历史快照: {payload.target_snapshot_id}")
             snapshot = session_service.get_snapshot(payload.session_id, payload.target_snapshot_id)
             if snapshot:
-                return snapshot.layout_data
+                yield WorkflowEvent(type="dashboard", payload=snapshot.layout_data)
+                return
             else:
                 logger.error("快照不存在，降级为普通分析")
 
         # === 1. 数据增强与交互映射 (Profiling) ===
         # [关键修改]：检查语义画像是否已存在，避免每轮对话重复分析
+        pending = []
         for summary in data_summaries:
             sem_analysis = summary.get("semantic_analysis", {})
             # 如果没有 column_metadata (V3版核心字段)，且有文件路径，则执行分析
             if not sem_analysis.get("column_metadata") and "file_info" in summary:
                 logger.info(f">>> [Analysis] 正在执行初次语义画像: {summary['variable_name']}")
-                analysis = self.analyzer.analyze(summary["file_info"].get("path"))
-                summary["semantic_analysis"] = analysis.get("semantic_analysis", {})
+                pending.append(summary)
             else:
                 logger.info(f">>> [Skip] 变量 {summary['variable_name']} 已有画像，跳过 AI 分析")
+        if pending:
+            # [优化] 多个待分析文件合并为尽量少的 LLM 请求
+            analyses = self.analyzer.analyze_batch(
+                [s["file_info"].get("path") for s in pending],
+                content_hashes=[s["file_info"].get("sha256") for s in pending]
+            )
+            for summary, analysis in zip(pending, analyses):
+                summary["semantic_analysis"] = analysis.get("semantic_analysis", {})
 
         # 预识别交互锚点 (为联动提供依据)
         interaction_anchors = self.interaction_mapper.identify_interaction_anchors(data_summaries)
@@ -93,7 +173,8 @@ class AnalysisWorkflow:
                 # === 模式 A: 语义钻取/联动修改 (VizEditor) ===
                 logger.info(f">>> [Edit Mode] 响应组件 {payload.active_component_id} 的交互")
                 # 1. 还原上次的布局结构
-                dashboard_plan = DashboardSchema(**last_state["last_layout"])
+                # 上一轮布局以 JSON 字节存档，由 pydantic-core 直接解析 + 校验，无需经过中间 dict
+                dashboard_plan = DashboardSchema.model_validate_json(last_state["last_layout"])
 
                 # 2. 提取当前组件的联动规则 (从 Schema 中获取)
                 active_comp = next((c for c in dashboard_plan.components if c.id == payload.active_component_id), None)
@@ -125,6 +206,9 @@ class AnalysisWorkflow:
             if payload.time_range:
                 dashboard_plan.global_time_range = payload.time_range
 
+            yield WorkflowEvent(type="plan_ready", payload=dashboard_plan)
+            yield WorkflowEvent(type="code_generated", payload={"code": current_code})
+
             # === 3. 代码执行与自愈 (Executor) ===
             # [关键修改]：只有在真正运行代码前，才确保加载全量数据，极大提升分析阶段响应速度
             logger.info(">>> [Full Load] 正在按需准备全量数据上下文...")
@@ -136,20 +220,25 @@ class AnalysisWorkflow:
             logger.info(">>> 执行看板代码逻辑...")
             comp_ids = [c.id for c in dashboard_plan.components]
 
-            exec_result = self.executor.execute_dashboard_logic(
-                code_str=current_code,
-                data_context=actual_data_context, # 使用全量数据
-                component_ids=comp_ids
-            )
+            # 结果缓存键：会话 + 数据版本 (全量切换或重新上传后版本变化，缓存自然失效)
+            exec_cache_key = (payload.session_id, full_session.get("data_generation"))
+            exec_result = await self._run_executor(
+                current_code, actual_data_context, comp_ids, cache_key=exec_cache_key
+            )  # 使用全量数据
 
             if not exec_result.success:
                 # 自动修复
                 logger.warning("执行失败，尝试自动修复...")
+                broken_code = current_code
                 current_code = self.generator.fix_code(current_code, exec_result.error, data_summaries)
-                exec_result = self.executor.execute_dashboard_logic(
-                    current_code, actual_data_context, comp_ids
+                exec_result = await self._run_executor(
+                    current_code, actual_data_context, comp_ids, cache_key=exec_cache_key
                 )
                 if not exec_result.success: raise Exception(f"代码引擎崩溃: {exec_result.error}")
+                # 后续相同请求直接拿到修复后的代码
+                (self.editor if is_edit_mode else self.generator).remember_fix(broken_code, current_code)
+
+            yield WorkflowEvent(type="executed", payload={"components": list(exec_result.results)})
 
             # === 4. 结果装配与洞察 (Extractor) ===
             # 生成业务洞察
@@ -163,14 +252,23 @@ class AnalysisWorkflow:
             for component in dashboard_plan.components:
                 if component.id in exec_result.results:
                     res = exec_result.results[component.id]
-                    component.data_payload = self._sanitize_data(res.data)
+                    # 执行器已将结果序列化为 JSON 原生结构，无需再次递归清洗
+                    data = res.data if isinstance(res.data, _JSON_NATIVE) else self._sanitize_data(res.data)
+                    component.data_payload = optimize_plotly_payload(data)
+                    if component.id in exec_result.artifacts:
+                        # 大表格以 Arrow 字节流存入会话，载荷中只保留占位与下载 ID
+                        component.data_payload["artifact_id"] = session_service.store_artifact(
+                            payload.session_id, exec_result.artifacts[component.id]
+                        )
 
                 if component.type == ComponentType.INSIGHT:
                     component.insight_config = self._sanitize_data(insight_card)
 
             # === 5. 状态固化与回溯存档 (Snapshot) ===
             # 将本次结果存入 Session 以便左侧列表回溯
-            snapshot_id = session_service.save_snapshot(
+            # [优化] 快照的 JSON 序列化、zlib 压缩与 SQLite 写入放到线程中执行，不阻塞事件循环
+            snapshot_id = await asyncio.to_thread(
+                session_service.save_snapshot,
                 session_id=payload.session_id,
                 query=payload.query or f"交互: {payload.active_component_id or '时间筛选'}",
                 code=current_code,
@@ -179,19 +277,39 @@ class AnalysisWorkflow:
             )
 
             # 更新当前会话状态，供下一轮交互参考
+            # [优化] 布局只在服务端会话中以 JSON 字节存档 (一次 Rust 编码)；不再把整份布局的 dict 副本
+            # 塞进 metadata 随 dashboard 事件重复下发给前端
             dashboard_plan.metadata = {
                 "last_code": current_code,
-                "last_layout": dashboard_plan.model_dump(),
                 "snapshot_id": snapshot_id
             }
-            session_service.update_session_metadata(payload.session_id, dashboard_plan.metadata)
+            session_service.update_session_metadata(
+                payload.session_id,
+                {**dashboard_plan.metadata, "last_layout": dashboard_plan.model_dump_json().encode()}
+            )
 
-            return dashboard_plan
+            yield WorkflowEvent(type="dashboard", payload=dashboard_plan)
 
         except Exception as e:
             logger.error(f"Workflow 致命错误: {traceback.format_exc()}")
             raise e
 
+    async def _run_executor(
+            self,
+            code: str,
+            data_context: Dict[str, Any],
+            component_ids: List[str],
+            cache_key: Optional[Any] = None
+    ) -> DashboardExecutionResult:
+        """在看板执行线程池中运行生成代码，避免 CPU 密集的计算阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()  # 保留当前请求绑定的会话等上下文
+        return await loop.run_in_executor(
+            EXECUTION_POOL, ctx.run,
+            functools.partial(self.executor.execute_dashboard_logic, cache_key=cache_key),
+            code, data_context, component_ids
+        )
+
     def _sanitize_data(self, obj: Any) -> Any:
         """深度数据清洗，确保 NumPy/Pandas 对象可 JSON 序列化"""
         if hasattr(obj, "to_dict"):
@@ -1,24 +1,67 @@
 import os
+import queue
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+from typing import Tuple
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from contextlib import asynccontextmanager
+from anyio import to_thread
 
 # --- 核心模块导入 ---
 from api import chat, data, session
+from api.responses import ORJSONResponse
 from core.llm.AI_client import AIClient
 from core.services.workflow import AnalysisWorkflow
 # [建议新增] 导入以确保启动时日志能记录 session 系统状态
 from core.services.session_service import session_service
 
 # --- 日志配置 ---
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# [优化] 服务运行期间根 logger 只挂 QueueHandler：日志格式化（含异常堆栈）与 stderr/文件写入
+# 均在 QueueListener 后台线程完成，异常高峰时不会阻塞事件循环。
+# 监听线程、日志目录与文件输出都在 lifespan 中创建并拆除，导入本模块不产生文件系统副作用；
+# 启动前 (导入阶段) 的日志直接同步输出到控制台。
+LOG_DIR = Path(__file__).resolve().parent / "logs"
+
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_console_handler = logging.StreamHandler()
+_console_handler.setFormatter(_log_formatter)
+# force=True：覆盖依赖模块导入时可能已调用的 basicConfig
+logging.basicConfig(level=logging.INFO, handlers=[_console_handler], force=True)
+
+
+def _start_log_listener() -> Tuple[QueueListener, RotatingFileHandler]:
+    """创建日志目录与文件输出，根 logger 改挂 QueueHandler，由新的后台监听线程负责写出"""
+    LOG_DIR.mkdir(exist_ok=True)
+    file_handler = RotatingFileHandler(LOG_DIR / "backend.log", maxBytes=10 * 1024 * 1024, backupCount=5, encoding="utf-8")
+    file_handler.setFormatter(_log_formatter)
+
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, _console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    root = logging.getLogger()
+    root.removeHandler(_console_handler)
+    root.addHandler(QueueHandler(log_queue))
+    return listener, file_handler
+
+
+def _stop_log_listener(listener: QueueListener, file_handler: RotatingFileHandler):
+    """根 logger 恢复直接输出到控制台，再刷新队列中剩余的日志并拆除监听线程与文件输出"""
+    root = logging.getLogger()
+    for handler in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+        root.removeHandler(handler)
+    root.addHandler(_console_handler)
+    listener.stop()
+    file_handler.close()
+
+
 logger = logging.getLogger(__name__)
 
+# anyio 线程池容量（默认 40）：同步接口与 to_thread 调用共用该池
+THREADPOOL_LIMIT = 64
+
 # --- 路径配置 ---
 BASE_DIR = Path(__file__).resolve().parent
 SANDBOX_PATH = BASE_DIR / "core" / "data_sandbox"
@@ -30,8 +73,13 @@ async def lifespan(app: FastAPI):
     """
     在应用启动时初始化资源，在关闭时清理
     """
+    log_listener, file_handler = _start_log_listener()
+
     logger.info(">>> [NL-STV V2.1] 正在启动高交互时空数据分析后端...")
 
+    # 0. 扩大 anyio 默认线程池，避免文件 I/O 与代码执行等阻塞任务互相饿死
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_LIMIT
+
     # 1. 确保数据沙箱目录存在
     if not SANDBOX_PATH.exists():
         SANDBOX_PATH.mkdir(parents=True, exist_ok=True)
@@ -54,15 +102,16 @@ async def lifespan(app: FastAPI):
         logger.info("✅ 高交互分析引擎 (AnalysisWorkflow V2) 挂载成功")
 
     except Exception as e:
-        logger.error(f"❌ 初始化核心工作流失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"❌ 初始化核心工作流失败: {e}")
+        _stop_log_listener(log_listener, file_handler)
         raise e
 
     yield
 
     # 3. 停止时的清理 (如有必要可清理内存 Session)
     logger.info(">>> 正在关闭 NL-STV 后端服务，执行内存清理...")
+    # 刷新队列中剩余的日志
+    _stop_log_listener(log_listener, file_handler)
 
 
 # --- 创建 FastAPI 实例 ---
@@ -70,7 +119,9 @@ app = FastAPI(
     title="NL-STV Platform API",
     description="LLM 驱动的高交互时空分析平台后端 - 支持快照回溯与多图联动",
     version="2.1.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # [优化] 全局使用 orjson 编码响应，降低大体积看板 JSON 对事件循环的占用
+    default_response_class=ORJSONResponse
 )
 
 # --- 配置跨域 (CORS) ---
@@ -83,6 +134,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- 响应压缩 ---
+# Plotly data_payload 以重复键名和浮点数组为主，gzip 通常可压缩 5~10 倍；
+# 小于 1KB 的轮询响应不压缩，SSE (text/event-stream) 由 Starlette 自动排除
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # --- 挂载 API 路由 ---
 app.include_router(chat.router, prefix="/api/v1/chat", tags=["智能对话与看板"])
 app.include_router(data.router, prefix="/api/v1/data", tags=["数据管理"])
@@ -117,4 +117,74 @@ class TestAIClient:
 
         # 断言应该抛出 ValueError
         with pytest.raises(ValueError, match="LLM 未返回有效的 JSON"):
-            client.query_json("Analyze this")
\ No newline at end of file
+            client.query_json("Analyze this")
+
+    def test_chat_stop_when_closes_stream_early(self, mock_openai):
+        """测试：提供 stop_when 时改为流式读取，满足条件后关闭流并丢弃剩余输出"""
+        mock_instance = mock_openai.return_value
+
+        def chunk(text):
+            return MagicMock(choices=[MagicMock(delta=MagicMock(content=text))])
+
+        stream = MagicMock()
+        stream.__iter__.return_value = iter([chunk("```python\nx = 1\n"), chunk("```"), chunk("\n解释文字")])
+        mock_instance.chat.completions.create.return_value = stream
+
+        client = AIClient(api_key="fake")
+        response = client.chat([{"role": "user", "content": "Hi"}], stop_when=lambda t: t.count("```") >= 2)
+
+        assert response == "```python\nx = 1\n```"
+        stream.close.assert_called_once()
+        _, kwargs = mock_instance.chat.completions.create.call_args
+        assert kwargs["stream"] is True
+
+    def test_query_json_prefill_uses_prefix_completion(self, mock_openai):
+        """测试：提供 prefill 时走 beta 端点的前缀续写，并把前缀拼回完整 JSON"""
+        mock_instance = mock_openai.return_value
+        beta = mock_instance.with_options.return_value
+        beta.chat.completions.create.return_value = MagicMock(
+            choices=[MagicMock(message=MagicMock(content='dash_1", "components": []}'))]
+        )
+
+        client = AIClient(api_key="fake")
+        result = client.query_json("Plan json", prefill='{"dashboard_id": "')
+
+        assert result == {"dashboard_id": "dash_1", "components": []}
+        assert mock_instance.with_options.call_args.kwargs["base_url"].endswith("/beta")
+        last = beta.chat.completions.create.call_args.kwargs["messages"][-1]
+        assert last == {"role": "assistant", "content": '{"dashboard_id": "', "prefix": True}
+        mock_instance.chat.completions.create.assert_not_called()
+
+    def test_query_json_stream_stops_at_closing_brace(self, mock_openai):
+        """测试：流式 JSON 在顶层对象闭合后立即关闭连接，字符串中的括号不影响判定"""
+        mock_instance = mock_openai.return_value
+
+        def chunk(text):
+            return MagicMock(choices=[MagicMock(delta=MagicMock(content=text))])
+
+        stream = MagicMock()
+        stream.__iter__.return_value = iter([chunk('{"a": "x}\\\\"'), chunk(', "b": [1, {"c": 2}]}'), chunk("\n\n\n" * 50)])
+        mock_instance.chat.completions.create.return_value = stream
+
+        client = AIClient(api_key="fake")
+        result = client.query_json("json please", stream=True)
+
+        assert result == {"a": "x}\\", "b": [1, {"c": 2}]}
+        stream.close.assert_called_once()
+        assert mock_instance.chat.completions.create.call_args.kwargs["stream"] is True
+
+    def test_query_json_prefill_stream_counts_prefill_depth(self, mock_openai):
+        """测试：前缀续写 + 流式读取时，闭合判定从 prefill 开始计数"""
+        beta = mock_openai.return_value.with_options.return_value
+        stream = MagicMock()
+        stream.__iter__.return_value = iter([
+            MagicMock(choices=[MagicMock(delta=MagicMock(content='d1", "c": {}}'))]),
+            MagicMock(choices=[MagicMock(delta=MagicMock(content="trailing text"))]),
+        ])
+        beta.chat.completions.create.return_value = stream
+
+        client = AIClient(api_key="fake")
+        result = client.query_json("Plan json", prefill='{"id": "', stream=True)
+
+        assert result == {"id": "d1", "c": {}}
+        stream.close.assert_called_once()
@@ -23,7 +23,8 @@ class TestDashboardPlanner:
 
     @pytest.fixture
     def planner(self, mock_ai_client):
-        return DashboardPlanner(llm_client=mock_ai_client)
+        # 关闭持久化缓存，避免测试之间通过磁盘共享规划结果
+        return DashboardPlanner(llm_client=mock_ai_client, cache_db=None)
 
     @pytest.fixture
     def mock_summaries(self) -> list[Dict[str, Any]]:
@@ -129,4 +130,295 @@ class TestDashboardPlanner:
 
         # 验证 Insight 组件的配置结构
         insight_comp = next(c for c in plan.components if c.type == ComponentType.INSIGHT)
-        assert insight_comp.insight_config.summary == "规划失败"
\ No newline at end of file
+        assert insight_comp.insight_config.summary == "规划失败"
+
+    def test_plan_dashboard_uses_llm_cache(self, planner, mock_ai_client, mock_summaries):
+        """测试：同一数据集上仅空白/大小写不同的重复提问命中规划缓存"""
+        mock_ai_client.query_json.return_value = {
+            "dashboard_id": "dash_cache",
+            "title": "缓存测试",
+            "components": [{"id": "map_1", "title": "地图", "type": "map", "layout": {"zone": "center_main"}}]
+        }
+
+        first = planner.plan_dashboard("Show  Trips", mock_summaries)
+        second = planner.plan_dashboard("show trips ", mock_summaries)
+
+        assert first.dashboard_id == second.dashboard_id == "dash_cache"
+        assert mock_ai_client.query_json.call_count == 1
+        assert planner.cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "size": 1}
+
+    async def test_plan_dashboards_batch_keeps_order(self, planner, mock_ai_client, mock_summaries):
+        """测试：批量规划并发执行，结果顺序与请求一致，失败的请求单独回退"""
+        def fake_query_json(prompt, system_prompt, prefill=None, stream=False):
+            if "broken" in prompt:
+                raise ValueError("LLM returned garbage")
+            dash_id = "dash_a" if "query a" in prompt else "dash_b"
+            return {
+                "dashboard_id": dash_id,
+                "title": dash_id,
+                "components": [{"id": "map_1", "title": "地图", "type": "map", "layout": {"zone": "center_main"}}]
+            }
+
+        mock_ai_client.query_json.side_effect = fake_query_json
+
+        plans = await planner.plan_dashboards_batch([
+            ("query a", mock_summaries), ("broken", mock_summaries), ("query b", mock_summaries)
+        ])
+
+        assert [p.dashboard_id for p in plans] == ["dash_a", "fallback", "dash_b"]
+
+    def test_plan_dashboard_drops_only_invalid_components(self, planner, mock_ai_client, mock_summaries):
+        """测试：缺失 layout 自动按类型补全，非法组件被单独剔除而不是整体回退"""
+        mock_ai_client.query_json.return_value = {
+            "dashboard_id": "dash_repair",
+            "title": "修复测试",
+            "components": [
+                {"id": "map_1", "type": "map"},
+                {"id": "bad_1", "type": "hologram", "layout": {"zone": "right_sidebar"}},
+                {"id": "insight_1", "type": "insight"}
+            ]
+        }
+
+        plan = planner.plan_dashboard("修复", mock_summaries)
+
+        assert plan.dashboard_id == "dash_repair"
+        assert [c.id for c in plan.components] == ["map_1", "insight_1"]
+        assert plan.components[0].layout.zone.value == "center_main"
+        assert plan.components[1].insight_config is not None
+
+    def test_system_prompt_lists_only_salient_columns(self, planner):
+        """测试：宽表只把高优先级字段写入 Prompt，并注明省略的字段数"""
+        col_meta = {f"noise_{i:03d}": {"semantic_tag": "OTHER", "cardinality": i} for i in range(100)}
+        col_meta["pickup_time"] = {"semantic_tag": "ST_TIME", "cardinality": "约 1,000"}
+        col_meta["fare"] = {"semantic_tag": "BIZ_METRIC", "cardinality": 500}
+        summaries = [{"variable_name": "df_wide", "semantic_analysis": {"column_metadata": col_meta}}]
+
+        prompt = planner._build_system_prompt(summaries)
+
+        assert "`pickup_time`" in prompt and "`fare`" in prompt
+        assert "noise_000" in prompt and "noise_099" not in prompt
+        assert "另有 62 个次要字段未列出" in prompt
+
+    def test_rule_based_plan_skips_llm(self, planner, mock_ai_client):
+        """测试：纯模板提问 + 语义标签无歧义时直接按规则规划，不调用 LLM；带具体实体的提问仍走 LLM"""
+        summaries = [{
+            "variable_name": "df_taxi",
+            "semantic_analysis": {
+                "column_metadata": {
+                    "pickup_datetime": {"semantic_tag": "ST_TIME"},
+                    "lat": {"semantic_tag": "ST_LAT"},
+                    "lon": {"semantic_tag": "ST_LON"},
+                    "fare": {"semantic_tag": "BIZ_METRIC"},
+                    "borough": {"semantic_tag": "BIZ_CAT", "cardinality": 5}
+                },
+                "temporal_context": {"suggested_resampling": "1D"}
+            }
+        }]
+
+        plan = planner.plan_dashboard("请展示趋势", summaries)
+        top = planner.plan_dashboard("top 5", summaries)
+
+        mock_ai_client.query_json.assert_not_called()
+        assert [c.id for c in plan.components] == ["main_map", "trend_chart", "global_insight"]
+        trend = plan.components[1].chart_config
+        assert trend.x_axis == "pickup_datetime" and trend.time_bucket == "1D"
+        assert top.components[1].title == "borough Top 5"
+
+        planner.plan_dashboard("展示 fare 的趋势", summaries)
+        mock_ai_client.query_json.assert_called_once()
+
+    def test_plan_cache_survives_restart(self, mock_ai_client, mock_summaries, tmp_path):
+        """测试：持久化缓存层在新的 Planner 实例 (模拟进程重启) 中依然命中"""
+        mock_ai_client.query_json.return_value = {
+            "dashboard_id": "dash_disk",
+            "title": "持久化",
+            "components": [{"id": "map_1", "title": "地图", "type": "map", "layout": {"zone": "center_main"}}]
+        }
+        db = str(tmp_path / "llm_cache.db")
+
+        DashboardPlanner(llm_client=mock_ai_client, cache_db=db).plan_dashboard("q", mock_summaries)
+        restarted = DashboardPlanner(llm_client=mock_ai_client, cache_db=db)
+        assert restarted.cache.stats()["size"] == 0  # 构造时不读库，首次查询时才预热
+        plan = restarted.plan_dashboard("q", mock_summaries)
+
+        assert plan.dashboard_id == "dash_disk"
+        assert mock_ai_client.query_json.call_count == 1
+        assert DashboardPlanner(llm_client=mock_ai_client, cache_db=db).cache.warm() == 1
+
+    def test_oversized_prompt_is_trimmed_before_llm_call(self, planner, monkeypatch):
+        """测试：系统提示词超出 token 预算时压缩字段数，而不是原样发给 LLM"""
+        import core.generation.dashboard_planner as dp
+
+        col_meta = {f"col_{i:03d}": {"semantic_tag": "BIZ_METRIC", "concept_name": "指标" * 50} for i in range(40)}
+        summaries = [{"variable_name": "df_wide", "semantic_analysis": {"column_metadata": col_meta}}]
+        full = planner._render_system_prompt(summaries)
+        monkeypatch.setattr(dp, "within_budget", lambda *texts: sum(map(len, texts)) < len(full) - 100)
+
+        prompt = planner._build_system_prompt(summaries)
+
+        assert len(prompt) < len(full)
+        assert "个次要字段未列出" in prompt
+
+    def test_transient_llm_error_retries_with_slim_prompt(self, planner, mock_ai_client, mock_summaries):
+        """测试：网络类瞬时故障只重试一次 LLM 调用，而不是直接回退兜底方案；未知异常直接抛出"""
+        mock_ai_client.query_json.side_effect = [
+            ConnectionError("DeepSeek API Error: timeout"),
+            {
+                "dashboard_id": "dash_retry",
+                "title": "重试",
+                "components": [{"id": "map_1", "title": "地图", "type": "map", "layout": {"zone": "center_main"}}]
+            },
+        ]
+
+        plan = planner.plan_dashboard("q", mock_summaries)
+
+        assert plan.dashboard_id == "dash_retry"
+        assert mock_ai_client.query_json.call_count == 2
+
+        mock_ai_client.query_json.side_effect = RuntimeError("bug")
+        with pytest.raises(RuntimeError):
+            planner.plan_dashboard("another query", mock_summaries)
+
+    def test_system_prompt_shares_static_prefix(self, planner, mock_summaries):
+        """测试：不同数据集的系统提示词共享逐字节一致的不变前缀，可变的元数据只出现在末尾"""
+        import core.generation.dashboard_planner as dp
+
+        other = [{"variable_name": "df_other", "semantic_analysis": {"column_metadata": {"v": {"semantic_tag": "BIZ_METRIC"}}}}]
+        a = planner._build_system_prompt(mock_summaries)
+        b = planner._build_system_prompt(other)
+
+        assert a.startswith(dp._PLANNER_PROMPT_PREFIX) and b.startswith(dp._PLANNER_PROMPT_PREFIX)
+        assert "df_other" in b[len(dp._PLANNER_PROMPT_PREFIX):]
+
+    def test_fallback_plan_is_prebuilt_and_independent(self, planner):
+        """测试：兜底方案来自预构建模板，每次返回的副本互不影响 (调用方会写入 metadata 等字段)"""
+        first = planner._generate_fallback_plan("q")
+        first.components[0].layout.x = 99
+        first.metadata = {"last_code": "x"}
+        second = planner._generate_fallback_plan("q")
+
+        assert second.dashboard_id == "fallback"
+        assert second.components[0].layout.x == 0
+        assert second.metadata != {"last_code": "x"}
+
+    def test_cached_plan_keeps_repairs_and_layout(self, planner, mock_ai_client, mock_summaries):
+        """测试：缓存命中直接还原补全、对齐后的最终规划，且每次返回新对象"""
+        mock_ai_client.query_json.return_value = {
+            "dashboard": {"title": "包裹层", "components": [{"id": "m", "title": "地图", "type": "map"}]}
+        }
+
+        first = planner.plan_dashboard("q", mock_summaries)
+        second = planner.plan_dashboard("q", mock_summaries)
+
+        assert mock_ai_client.query_json.call_count == 1
+        assert second.model_dump() == first.model_dump()
+        assert second.components[0].layout.w == 8
+        assert second is not first
+
+    def test_apply_layout_assigns_slots_in_order(self):
+        """测试：按区域顺序分配槽位坐标，槽位用尽的组件保持原坐标；未知模板按纯图表布局处理"""
+        from core.generation.templates import LayoutTemplates
+        from core.schemas.dashboard import LayoutConfig, LayoutZone
+
+        def comps(*zones):
+            return [DashboardComponent(id=f"c{i}", title="t", type=ComponentType.CHART, layout=LayoutConfig(zone=z))
+                    for i, z in enumerate(zones)]
+
+        side = comps(LayoutZone.RIGHT_SIDEBAR, LayoutZone.RIGHT_SIDEBAR, LayoutZone.RIGHT_SIDEBAR)
+        LayoutTemplates.apply_layout(side)
+        assert [(c.layout.x, c.layout.y) for c in side] == [(8, 0), (8, 4.5), (0, 0)]
+
+        grid = comps(LayoutZone.RIGHT_SIDEBAR, LayoutZone.CENTER_MAIN)
+        LayoutTemplates.apply_layout(grid, template_id="unknown")
+        assert (grid[0].layout.x, grid[0].layout.w) == (0, 6)
+        assert grid[1].layout.w == 12
+
+    def test_apply_layout_skips_already_aligned_components(self, monkeypatch):
+        """测试：坐标已与槽位一致的组件不再重复赋值，仍占用该槽位"""
+        from core.generation.templates import LayoutTemplates
+        from core.schemas.dashboard import LayoutConfig, LayoutZone
+
+        aligned = LayoutConfig(zone=LayoutZone.RIGHT_SIDEBAR, x=8, y=0, w=4, h=4.5)
+        fresh = LayoutConfig(zone=LayoutZone.RIGHT_SIDEBAR)
+        writes = []
+        monkeypatch.setattr(LayoutConfig, "__setattr__", lambda self, k, v: (writes.append(id(self)), object.__setattr__(self, k, v)))
+        comps = [DashboardComponent.model_construct(layout=aligned), DashboardComponent.model_construct(layout=fresh)]
+
+        LayoutTemplates.apply_layout(comps)
+
+        assert id(aligned) not in writes
+        assert (fresh.x, fresh.y) == (8, 4.5)
+
+    def test_query_mentioned_columns_are_added_to_user_prompt(self, planner, mock_ai_client):
+        """测试：宽表中查询提到但未进入系统提示词的字段补充到用户提示词，系统提示词保持不变"""
+        col_meta = {f"col_{i:03d}": {"semantic_tag": "BIZ_METRIC", "cardinality": 100 + i} for i in range(60)}
+        col_meta["tip_amount"] = {"semantic_tag": "OTHER", "concept_name": "小费金额"}
+        summaries = [{"variable_name": "df_wide", "semantic_analysis": {"column_metadata": col_meta}}]
+        mock_ai_client.query_json.return_value = {
+            "dashboard_id": "d", "title": "t",
+            "components": [{"id": "m", "title": "地图", "type": "map", "layout": {"zone": "center_main"}}]
+        }
+
+        planner.plan_dashboard("各区域小费金额 tip 对比", summaries)
+
+        kwargs = mock_ai_client.query_json.call_args.kwargs
+        assert "`tip_amount`" in kwargs["prompt"]
+        assert "`tip_amount`" not in kwargs["system_prompt"]
+
+    def test_concurrent_identical_requests_share_one_llm_call(self, planner, mock_ai_client, mock_summaries):
+        """测试：并发的相同规划请求只调用一次 LLM，且各自拿到独立的规划对象"""
+        import threading
+
+        entered, release = threading.Event(), threading.Event()
+
+        def slow_query_json(**kwargs):
+            entered.set()
+            release.wait(timeout=5)
+            return {
+                "dashboard_id": "dash_shared", "title": "合并",
+                "components": [{"id": "m", "title": "地图", "type": "map", "layout": {"zone": "center_main"}}]
+            }
+
+        mock_ai_client.query_json.side_effect = slow_query_json
+        results = []
+        workers = [threading.Thread(target=lambda: results.append(planner.plan_dashboard("q", mock_summaries)))
+                   for _ in range(3)]
+        workers[0].start()
+        entered.wait(timeout=5)
+        for w in workers[1:]:
+            w.start()
+        release.set()
+        for w in workers:
+            w.join(timeout=5)
+
+        assert mock_ai_client.query_json.call_count == 1
+        assert [p.dashboard_id for p in results] == ["dash_shared"] * 3
+        assert len({id(p) for p in results}) == 3
+
+    def test_apply_layout_marks_coordinates_as_set(self):
+        """测试：绕过 __setattr__ 写入坐标后，model_dump(exclude_unset=True) 仍包含对齐后的坐标"""
+        from core.generation.templates import LayoutTemplates
+        from core.schemas.dashboard import LayoutConfig, LayoutZone
+
+        comp = DashboardComponent(id="m", title="地图", type=ComponentType.MAP, layout=LayoutConfig(zone=LayoutZone.CENTER_MAIN))
+        LayoutTemplates.apply_layout([comp])
+
+        assert comp.layout.model_dump(exclude_unset=True) == {"zone": LayoutZone.CENTER_MAIN, "x": 0, "y": 0, "w": 8, "h": 9}
+
+
+def test_planner_import_does_not_load_scientific_stack():
+    """测试：导入规划器 / 代码生成器不会连带加载 geopandas、plotly、shapely (API 进程冷启动更快)"""
+    import subprocess
+    import sys
+    from pathlib import Path
+
+    code = (
+        "import sys\n"
+        "import core.generation.dashboard_planner, core.generation.viz_generator, core.generation.viz_editor\n"
+        "print(sorted(m for m in ('geopandas', 'plotly', 'shapely') if m in sys.modules))\n"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=Path(__file__).resolve().parents[1],
+        capture_output=True, text=True, check=True
+    ).stdout
+    assert out.strip() == "[]"
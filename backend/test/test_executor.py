@@ -4,7 +4,7 @@ import geopandas as gpd
 from shapely.geometry import Point
 
 # 适配引用路径
-from core.execution.executor import CodeExecutor
+from core.execution.executor import CodeExecutor, optimize_plotly_payload
 
 
 class TestCodeExecutor:
@@ -143,4 +143,130 @@ class TestCodeExecutor:
         """
 
         result = executor.execute_dashboard_logic(code, sample_context, ["test"])
-        assert result.success is True
\ No newline at end of file
+        assert result.success is True
+
+    def test_optimize_plotly_payload_webgl_and_downsample(self):
+        """测试：大散点切换为 scattergl，超大散点按步长抽稀并同步裁剪逐点属性"""
+        n = 30000
+        payload = {"data": [
+            {"type": "scatter", "x": list(range(n)), "y": list(range(n)), "marker": {"color": list(range(n))}},
+            {"type": "scatter", "x": list(range(6000)), "y": list(range(6000))},
+            {"type": "bar", "x": list(range(n)), "y": list(range(n))},
+        ]}
+
+        optimize_plotly_payload(payload)
+        big, medium, bar = payload["data"]
+
+        assert big["type"] == "scattergl"
+        assert len(big["x"]) == len(big["y"]) == len(big["marker"]["color"]) == 5000
+        assert big["x"][0] == 0 and big["x"][-1] == n - 1
+        assert medium["type"] == "scattergl" and len(medium["x"]) == 6000
+        assert bar["type"] == "bar" and len(bar["x"]) == n
+
+    def test_optimize_plotly_payload_keeps_hover_data_aligned(self, executor):
+        """测试：px.scatter(hover_data=...) 的二维 customdata、误差棒与 selectedpoints 随抽稀同步裁剪"""
+        import base64
+        import numpy as np
+        import plotly.express as px
+
+        n = 30000
+        df = pd.DataFrame({"x": np.arange(n, dtype=float), "y": np.arange(n) * 2.0, "id": np.arange(n), "err": np.arange(n) % 7})
+        fig = px.scatter(df, x="x", y="y", hover_data=["id"], error_y="err")
+        fig.update_traces(selectedpoints=[0, 1, n - 1])
+        trace = optimize_plotly_payload(executor._make_serializable(fig))["data"][0]
+
+        def decode(typed):
+            arr = np.frombuffer(base64.b64decode(typed["bdata"]), dtype=typed["dtype"])
+            return arr.reshape([int(d) for d in typed["shape"].split(",")]) if "shape" in typed else arr
+
+        x = decode(trace["x"])
+        custom = decode(trace["customdata"])
+        assert trace["type"] == "scattergl" and len(x) == 5000
+        assert custom.shape[0] == len(x)
+        assert (custom[:, 0] == x).all()
+        assert (decode(trace["error_y"]["array"]) == x.astype(np.int64) % 7).all()
+        assert trace["selectedpoints"] == [0, len(x) - 1]
+
+    def test_optimize_plotly_payload_skips_downsample_when_unsliceable(self):
+        """测试：存在无法解码的逐点属性时只切换 WebGL，不做抽稀"""
+        n = 30000
+        payload = {"data": [{"type": "scatter", "x": list(range(n)), "y": list(range(n)),
+                             "customdata": {"dtype": "bogus", "bdata": "AAAA", "shape": "1, 1"}}]}
+
+        trace = optimize_plotly_payload(payload)["data"][0]
+
+        assert trace["type"] == "scattergl"
+        assert len(trace["x"]) == n
+
+    def test_make_serializable_handles_numpy_and_time_keys(self, executor):
+        """测试：orjson 序列化处理 NumPy 标量/NaN、时间戳键与 DataFrame"""
+        s = pd.Series([1.0, float("nan")], index=pd.date_range("2025-01-01", periods=2))
+        out = executor._make_serializable({"s": s.to_dict(), "n": s.sum(), "df": s.to_frame("v")})
+
+        assert out["s"] == {"2025-01-01T00:00:00": 1.0, "2025-01-02T00:00:00": None}
+        assert out["n"] == 1.0 and type(out["n"]) is float
+        assert out["df"] == [{"v": 1.0}, {"v": None}]
+
+    def test_large_table_result_uses_arrow_artifact(self, executor):
+        """测试：大表格结果以 Arrow IPC 字节流返回，组件 data 只保留占位信息"""
+        import pyarrow as pa
+        from core.execution.executor import ARROW_MIN_ROWS
+
+        df = pd.DataFrame({"A": range(ARROW_MIN_ROWS), "B": ["x"] * ARROW_MIN_ROWS})
+        code = """
+        def get_dashboard_data(ctx):
+            return {"big": ctx["df"], "small": ctx["df"].head(3)}
+        """
+
+        result = executor.execute_dashboard_logic(code, {"df": df}, ["big", "small"])
+
+        assert result.success is True
+        assert result.results["big"].data == {"format": "arrow", "rows": ARROW_MIN_ROWS, "columns": ["A", "B"]}
+        assert isinstance(result.results["small"].data, list)
+        table = pa.ipc.open_stream(result.artifacts["big"]).read_all()
+        assert table.num_rows == ARROW_MIN_ROWS
+
+    def test_bbox_filter_geo_and_plain_frames(self):
+        """测试：bbox_filter 对 GeoDataFrame 走空间索引，对普通 DataFrame 自动识别经纬度列"""
+        from core.execution.spatial import bbox_filter
+
+        gdf = gpd.GeoDataFrame({"v": [1, 2, 3]}, geometry=[Point(0, 0), Point(5, 5), Point(1, 1)])
+        assert bbox_filter(gdf, [-1, -1, 2, 2])["v"].tolist() == [1, 3]
+
+        df = pd.DataFrame({"Longitude": [0.0, 5.0, 1.0], "Latitude": [0.0, 5.0, 1.0], "v": [1, 2, 3]})
+        assert bbox_filter(df, [-1, -1, 2, 2])["v"].tolist() == [1, 3]
+
+    def test_result_cache_returns_independent_copies(self, executor):
+        """测试：相同缓存键 + 相同代码命中结果缓存，且每次返回独立对象"""
+        code = """
+        def get_dashboard_data(ctx):
+            ctx["calls"].append(1)
+            return {"t": {"v": [1, 2]}}
+        """
+        ctx = {"calls": []}
+
+        first = executor.execute_dashboard_logic(code, ctx, ["t"], cache_key=("s1", 1))
+        first.results["t"].data["v"].append(3)
+        second = executor.execute_dashboard_logic(code, ctx, ["t"], cache_key=("s1", 1))
+        executor.execute_dashboard_logic(code, ctx, ["t"], cache_key=("s1", 2))
+
+        assert second.success is True
+        assert second.results["t"].data == {"v": [1, 2]}
+        assert len(ctx["calls"]) == 2
+
+    def test_bbox_filter_geo_paths_agree(self, monkeypatch):
+        """测试：GeoDataFrame 框选的三条路径 (全覆盖 / 空间索引 / 向量化扫描) 结果一致"""
+        from shapely.geometry import Polygon
+        from core.execution import spatial
+
+        geoms = [Point(0, 0), Point(5, 5), Polygon([(8, 8), (10, 8), (10, 10)]), None, Point(9, 1)]
+        gdf = gpd.GeoDataFrame({"v": [1, 2, 3, 4, 5]}, geometry=geoms)
+
+        assert spatial.bbox_filter(gdf, [-100, -100, 100, 100])["v"].tolist() == [1, 2, 3, 5]
+        scanned = spatial.bbox_filter(gdf, [4, 4, 9.5, 9.5])["v"].tolist()
+        assert not gdf.has_sindex
+
+        monkeypatch.setattr(spatial, "SINDEX_MIN_ROWS", 0)
+        monkeypatch.setattr(spatial, "SINDEX_MAX_SELECTIVITY", 1.0)
+        assert spatial.bbox_filter(gdf, [4, 4, 9.5, 9.5])["v"].tolist() == scanned == [2, 3]
+        assert gdf.has_sindex
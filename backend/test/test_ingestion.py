@@ -58,6 +58,23 @@ class TestIngestionManagerUnit:
         mock_loader.load.assert_called_once()
         mock_loader.peek.assert_not_called()
 
+    @patch("core.ingestion.ingestion.LoaderFactory")
+    def test_lazy_full_context(self, mock_factory, manager):
+        """测试：惰性全量上下文只在变量被访问时才调用 load，且只加载一次"""
+        mock_loader = MagicMock()
+        mock_loader.load.return_value = pd.DataFrame({"col1": [1, 2]})
+        mock_factory.get_loader.return_value = mock_loader
+
+        context = manager.lazy_full_context(["data_sandbox/a.csv", "data_sandbox/b-data.csv"])
+
+        assert set(context) == {"df_a", "df_b_data"}
+        assert "df_a" in context
+        mock_loader.load.assert_not_called()
+
+        context["df_a"]
+        context["df_a"]
+        mock_loader.load.assert_called_once_with("data_sandbox/a.csv")
+
     @patch("core.ingestion.ingestion.LoaderFactory")
     def test_error_handling(self, mock_factory, manager):
         """测试：单个文件加载失败不应导致程序崩溃"""
@@ -70,6 +87,21 @@ class TestIngestionManagerUnit:
         # 应该返回空字典，而不是抛出异常
         assert context == {}
 
+    @patch("core.ingestion.ingestion.LoaderFactory")
+    def test_multiple_files_loaded_concurrently_in_order(self, mock_factory, manager):
+        """测试：多文件并发加载，结果保持传入顺序，失败的文件被跳过"""
+        def peek(path, n):
+            if "bad" in path:
+                raise ValueError("corrupt")
+            return pd.DataFrame({"src": [path]})
+
+        mock_factory.get_loader.return_value.peek.side_effect = peek
+
+        context = manager.load_all_to_context(["z.csv", "bad.csv", "a.csv"])
+
+        assert list(context) == ["df_z", "df_a"]
+        assert context["df_a"]["src"].iloc[0] == "a.csv"
+
 
 # ==========================================
 # 第二部分：集成测试 (使用你截图中的真实文件)
@@ -144,4 +176,98 @@ class TestIngestionRealFiles:
         assert isinstance(df, pd.DataFrame)
         # 验证是否遵守了采样限制 (虽然 peek 具体实现取决于 Loader，但通常不会超过 50k)
         assert len(df) <= 50000
-        print(f"\n[Success] Loaded Parquet sample shape: {df.shape}")
\ No newline at end of file
+        print(f"\n[Success] Loaded Parquet sample shape: {df.shape}")
+
+
+class TestVectorLoaders:
+
+    @pytest.mark.parametrize("ext", ["shp", "gpkg", "fgb"])
+    def test_vector_loader_peek_load_count(self, tmp_path, ext):
+        """测试：矢量格式经 pyogrio 读取，peek 只取前 n 个要素，行数来自图层元数据"""
+        gpd = pytest.importorskip("geopandas")
+        from shapely.geometry import Point
+        from core.ingestion.loader_factory import LoaderFactory, SHPLoader
+
+        path = str(tmp_path / f"points.{ext}")
+        gpd.GeoDataFrame(
+            {"zone": [f"z{i}" for i in range(20)]}, geometry=[Point(i, i) for i in range(20)], crs=4326
+        ).to_file(path)
+
+        loader = LoaderFactory.get_loader(path)
+        assert isinstance(loader, SHPLoader)
+        assert len(loader.peek(path, n=3)) == 3
+        assert loader.count_rows(path) == 20
+        full = loader.load(path)
+        assert isinstance(full, gpd.GeoDataFrame)
+        assert sorted(full["zone"]) == sorted(f"z{i}" for i in range(20))
+
+
+class TestParquetLoader:
+
+    def test_parquet_peek_count_and_column_pushdown(self, tmp_path):
+        """测试：Parquet peek 只取前 n 行、行数来自元数据、load 支持列裁剪"""
+        from core.ingestion.loader_factory import ParquetLoader
+
+        path = str(tmp_path / "trips.parquet")
+        pd.DataFrame({"a": range(1000), "b": [str(i) for i in range(1000)]}).to_parquet(path, row_group_size=100)
+
+        loader = ParquetLoader()
+        assert list(loader.peek(path, n=5)["a"]) == [0, 1, 2, 3, 4]
+        assert loader.count_rows(path) == 1000
+        assert list(loader.load(path, columns=["b"]).columns) == ["b"]
+
+        preview, total = loader.sample_and_count(path, n=3)
+        assert list(preview["a"]) == [0, 1, 2]
+        assert total == 1000
+
+
+class TestCSVLoader:
+
+    def test_csv_arrow_load_matches_pandas(self, tmp_path):
+        """测试：PyArrow 解析结果与 pandas 一致 (时间列保持文本、空值识别一致)；行数统计不解析文件"""
+        from core.ingestion.loader_factory import CSVLoader
+
+        path = tmp_path / "trips.csv"
+        path.write_text(
+            "id,fare,zone,pickup_time\n"
+            "1,2.5,A,2025-01-01 08:00:00\n"
+            "2,,NA,2025-01-01 09:00:00\n"
+            "3,4.0,,2025-01-01 10:00:00"
+        )
+
+        loader = CSVLoader()
+        pd.testing.assert_frame_equal(loader.load(str(path)), pd.read_csv(path))
+        assert loader.count_rows(str(path)) == 3
+
+    def test_csv_falls_back_to_pandas_on_arrow_error(self, tmp_path):
+        """测试：后续行类型与首块推断不一致等 PyArrow 无法处理的文件退回 pandas"""
+        from core.ingestion.loader_factory import CSVLoader
+
+        path = tmp_path / "ragged.csv"
+        path.write_text("a,b\n1,2\n3\n")
+
+        assert list(CSVLoader().load(str(path))["a"]) == [1, 3]
+
+
+class TestTimeColumnDetection:
+
+    def test_time_columns_converted_with_sniffed_format(self):
+        """测试：含时间关键词的文本列按推断格式整列转换；格式不符或非时间内容保持原样"""
+        from core.ingestion.ingestion import _convert_time_columns
+
+        df = pd.DataFrame({
+            "pickup_time": ["2025-01-01 08:00:00", None, "2025-01-02 09:30:00"],
+            "drop_date": ["01/02/2025", "01/03/2025", "01/04/2025"],
+            "rate_code": ["A", "B", "C"],
+            "label": ["2025-01-01", "2025-01-02", "2025-01-03"],
+            "update_at": ["2025-01-01", "not a date", "2025-01-03"],
+        })
+
+        _convert_time_columns(df)
+
+        assert pd.api.types.is_datetime64_any_dtype(df["pickup_time"])
+        assert df["pickup_time"].isna().sum() == 1
+        assert df["drop_date"].iloc[0] == pd.Timestamp("2025-01-02")
+        assert not pd.api.types.is_datetime64_any_dtype(df["rate_code"])
+        assert not pd.api.types.is_datetime64_any_dtype(df["label"])
+        assert not pd.api.types.is_datetime64_any_dtype(df["update_at"])
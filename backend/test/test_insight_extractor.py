@@ -102,4 +102,17 @@ class TestInsightExtractor:
         # 兜底逻辑的 tags 包含 "系统提示"
         assert "系统提示" in result.tags
         # 错误详情里应该包含原始数据的 keys
-        assert "chart_1" in result.detail
\ No newline at end of file
+        assert "chart_1" in result.detail
+
+    def test_stats_truncated_in_prompt(self, extractor, mock_ai_client):
+        """测试：超大的统计摘要在写入 Prompt 前被截断"""
+        from core.execution.insight_extractor import MAX_STATS_CHARS
+
+        mock_ai_client.query_json.return_value = {"summary": "s", "detail": "d", "tags": []}
+        stats = {"table_1": {"data_raw": {"v": list(range(10000))}}}
+
+        extractor.generate_insights("q", stats, [])
+
+        user_prompt = mock_ai_client.query_json.call_args.kwargs["prompt"]
+        assert "...[truncated]" in user_prompt
+        assert len(user_prompt) < MAX_STATS_CHARS + 1000
@@ -15,7 +15,8 @@ class TestRelationMapper:
 
     @pytest.fixture
     def mapper(self, mock_ai_client):
-        return RelationMapper(llm_client=mock_ai_client)
+        # 关闭持久化缓存，避免测试之间通过磁盘共享识别结果
+        return RelationMapper(llm_client=mock_ai_client, cache_db=None)
 
     @pytest.fixture
     def sample_summaries(self) -> List[Dict[str, Any]]:
@@ -120,4 +121,14 @@ class TestRelationMapper:
 
         # 3. 测试无关变量
         hint_none = mapper.get_drilldown_hint("df_E", relations)
-        assert hint_none == ""
\ No newline at end of file
+        assert hint_none == ""
+
+    def test_map_relations_cached_for_same_profiles(self, mapper, sample_summaries, mock_ai_client):
+        """测试：相同的语义画像组合第二次直接命中缓存，不再调用 LLM"""
+        mock_ai_client.query_json.return_value = [{"source": "df_trips", "target": "df_zones", "type": "ID_LINK"}]
+
+        first = mapper.map_relations(sample_summaries)
+        second = mapper.map_relations(sample_summaries)
+
+        assert first == second
+        mock_ai_client.query_json.assert_called_once()
@@ -30,6 +30,10 @@ class TestSemanticAnalyzer:
 
             # 设置 factory.get_loader() 返回这个 mock_loader
             mock_factory.get_loader.return_value = mock_loader
+            # sample_and_count 沿用各用例对 peek / count_rows 的设定
+            mock_loader.sample_and_count.side_effect = (
+                lambda path, n=5: (mock_loader.peek(path, n=n), mock_loader.count_rows(path))
+            )
 
             yield mock_factory
 
@@ -129,4 +133,75 @@ class TestSemanticAnalyzer:
 
         # 验证
         assert "error" in result
-        assert "API Timeout" in result["error"]
\ No newline at end of file
+        assert "API Timeout" in result["error"]
+
+    def test_analyze_uses_content_cache(self, mock_loader_factory, mock_ai_client, tmp_path):
+        """测试：相同内容的文件第二次分析直接命中磁盘缓存，不再调用 LLM"""
+        mock_loader = mock_loader_factory.get_loader.return_value
+        mock_loader.peek.return_value = pd.DataFrame({"a": [1]})
+        mock_loader.count_rows.return_value = 1
+        mock_ai_client.query_json.return_value = {"dataset_domain": "test"}
+
+        analyzer = SemanticAnalyzer(llm_client=mock_ai_client, cache_dir=str(tmp_path / "cache"))
+        first = tmp_path / "first.csv"
+        second = tmp_path / "second-copy.csv"
+        first.write_text("a\n1\n")
+        second.write_text("a\n1\n")
+
+        analyzer.analyze(str(first))
+        result = analyzer.analyze(str(second))
+
+        assert mock_ai_client.query_json.call_count == 1
+        assert result["semantic_analysis"]["dataset_domain"] == "test"
+        assert result["variable_name"] == "df_second_copy"
+        assert result["file_info"]["path"] == str(second)
+
+    def test_large_file_fingerprint_samples_head_and_tail(self, tmp_path, monkeypatch):
+        """测试：小文件使用完整内容哈希；大文件只取首尾样本，尾部变化时指纹随之变化"""
+        from core.profiler import semantic_analyzer as sa
+
+        small = tmp_path / "small.csv"
+        small.write_text("a\n1\n")
+        assert sa._file_fingerprint(str(small)) == sa._hash_file(str(small))
+
+        monkeypatch.setattr(sa, "_FINGERPRINT_SAMPLE_BYTES", 4)
+        big = tmp_path / "big.csv"
+        big.write_bytes(b"header\n" + b"x" * 100 + b"tail-1\n")
+        before = sa._file_fingerprint(str(big))
+        monkeypatch.setattr(sa, "_hash_file", lambda path: pytest.fail("大文件不应完整读取"))
+        big.write_bytes(b"header\n" + b"x" * 100 + b"tail-2\n")
+        assert sa._file_fingerprint(str(big)) != before
+
+    def test_analyze_batch_single_call_with_fallback(self, mock_loader_factory, mock_ai_client, tmp_path):
+        """测试：多个未缓存文件合并为一次 LLM 调用；批量结果缺失的文件单独重试，结果按输入顺序返回"""
+        mock_loader = mock_loader_factory.get_loader.return_value
+        mock_loader.peek.return_value = pd.DataFrame({"a": [1]})
+        mock_loader.count_rows.return_value = 1
+        mock_ai_client.query_json.side_effect = [
+            {"f0": {"dataset_domain": "taxi", "column_metadata": {"a": {}}}, "f1": "bad"},
+            {"dataset_domain": "zones", "column_metadata": {"a": {}}},
+        ]
+
+        analyzer = SemanticAnalyzer(llm_client=mock_ai_client, cache_dir=None)
+        results = analyzer.analyze_batch(["trips.csv", "zones.csv"])
+
+        assert mock_ai_client.query_json.call_count == 2
+        assert "f0" in mock_ai_client.query_json.call_args_list[0].kwargs["prompt"]
+        assert [r["semantic_analysis"]["dataset_domain"] for r in results] == ["taxi", "zones"]
+        assert [r["variable_name"] for r in results] == ["df_trips", "df_zones"]
+
+    def test_fingerprint_column_stats_vectorised(self, analyzer, mock_loader_factory):
+        """测试：列统计 (dtype / 去重样本 / 空值标记) 与逐列计算的结果一致"""
+        mock_loader = mock_loader_factory.get_loader.return_value
+        mock_loader.count_rows.return_value = 4
+        mock_loader.peek.return_value = pd.DataFrame({
+            "zone": ["A", "B", "A", None],
+            "fare": [2.5, 2.5, 3.0, 4.0],
+            "tags": [[1], [2], [1], [3]],
+        })
+
+        cols = analyzer._get_basic_fingerprint("trips.csv")["columns"]
+
+        assert cols["zone"]["samples"] == ["A", "B"] and cols["zone"]["has_nulls"] is True
+        assert cols["fare"] == {"dtype": "float64", "samples": ["2.5", "3.0", "4.0"], "has_nulls": False}
+        assert cols["tags"]["samples"] == []
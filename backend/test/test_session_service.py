@@ -4,6 +4,7 @@ from unittest.mock import MagicMock, patch
 from typing import Dict, Any
 
 from core.services.session_service import SessionManager
+from core.schemas.dashboard import DashboardSchema
 
 
 class TestSessionManager:
@@ -34,7 +35,7 @@ class TestSessionManager:
             yield mock_func
 
     @pytest.fixture
-    def manager(self, mock_ingestion, mock_profiler):
+    def manager(self, mock_ingestion, mock_profiler, tmp_path):
         """
         【关键修改】
         这里将 mock_ingestion 和 mock_profiler 作为参数传入。
@@ -42,7 +43,7 @@ class TestSessionManager:
         然后再执行 SessionManager() 的实例化。
         这样 SessionManager 内部 new IngestionManager() 时，拿到的就是 Mock 对象了。
         """
-        return SessionManager()
+        return SessionManager(snapshot_db=str(tmp_path / "snapshots.db"))
 
     def test_create_session_flow(self, manager, mock_ingestion, mock_profiler):
         """核心测试：验证 create_session 是否串联了 Ingestion 和 Profiler"""
@@ -97,4 +98,95 @@ class TestSessionManager:
         manager._sessions["temp"] = {"data_context": {}}
 
         manager.delete_session("temp")
-        assert manager.get_session("temp") is None
\ No newline at end of file
+        assert manager.get_session("temp") is None
+
+    def test_idle_session_eviction(self, mock_ingestion, mock_profiler):
+        """测试：超过空闲时间的会话会被自动回收"""
+        manager = SessionManager(ttl_seconds=60, snapshot_db=None)
+        manager.create_session("idle_user", ["file_A"])
+        manager.create_session("active_user", ["file_B"])
+
+        # 模拟 idle_user 已空闲超过 TTL
+        manager._sessions["idle_user"]["last_access"] -= 120
+
+        assert manager.get_session("idle_user") is None
+        assert "idle_user" not in manager._sessions
+        assert manager.get_session("active_user") is not None
+
+
+    def test_snapshot_shares_unchanged_components(self, manager):
+        """测试：连续快照中未变化的组件复用同一对象 (写时复制)"""
+        sid = "user_snap"
+        manager.create_session(sid, [])
+
+        def make_layout(chart_payload):
+            return DashboardSchema(
+                dashboard_id="d1",
+                title="T",
+                components=[
+                    {"id": "map", "type": "map", "layout": {"zone": "center_main"}, "data_payload": {"data": [1, 2, 3]}},
+                    {"id": "chart", "type": "chart", "layout": {"zone": "right_sidebar"}, "data_payload": chart_payload},
+                ]
+            )
+
+        snap_1 = manager.save_snapshot(sid, "q1", "code", make_layout({"data": [1]}))
+        snap_2 = manager.save_snapshot(sid, "q2", "code", make_layout({"data": [2]}))
+
+        first = manager.get_snapshot(sid, snap_1).layout_data.components
+        second = manager.get_snapshot(sid, snap_2).layout_data.components
+        # 地图组件未变化 -> 共享；图表组件已变化 -> 独立保存
+        assert second[0] is first[0]
+        assert second[1] is not first[1]
+        assert second[1].data_payload == {"data": [2]}
+        assert manager.get_session(sid)["state_store"].current_snapshot_id == snap_2
+
+    def test_bound_session_short_circuits_lookup(self, manager):
+        """测试：绑定到请求上下文的会话被 get_session 直接复用，但仍遵守过期与删除"""
+        sid = "user_bound"
+        session = manager.create_session(sid, [])
+
+        token = manager.bind_session(session)
+        try:
+            assert manager.get_session(sid) is session
+            assert manager.get_session("other") is None
+
+            session["last_access"] -= manager.ttl_seconds + 1
+            assert manager.get_session(sid) is None
+            assert sid not in manager._sessions
+        finally:
+            manager.unbind_session(token)
+
+        # 请求处理中会话被删除：绑定的引用不再返回
+        session = manager.create_session(sid, [])
+        token = manager.bind_session(session)
+        try:
+            manager.delete_session(sid, purge_history=False)
+            assert manager.get_session(sid) is None
+        finally:
+            manager.unbind_session(token)
+
+    def test_snapshots_persist_beyond_memory_window(self, manager, mock_ingestion, mock_profiler, tmp_path):
+        """测试：超出内存窗口的快照可从 SQLite 加载，且会话重建后历史记录依然存在"""
+        from core.services import session_service as module
+
+        sid = "user_persist"
+        manager.create_session(sid, [])
+        layout = DashboardSchema(dashboard_id="d1", title="T", components=[])
+        snap_ids = [
+            manager.save_snapshot(sid, f"q{i}", "code", layout)
+            for i in range(module.MAX_SNAPSHOTS_IN_MEMORY + 2)
+        ]
+
+        store = manager.get_session(sid)["state_store"]
+        assert len(store.snapshots) == module.MAX_SNAPSHOTS_IN_MEMORY
+        assert [h["snapshot_id"] for h in manager.get_history_list(sid)] == snap_ids
+        assert manager.get_snapshot(sid, snap_ids[0]).user_query == "q0"
+
+        # 模拟 worker 重启：新的管理器实例读取同一数据库
+        restarted = SessionManager(snapshot_db=str(tmp_path / "snapshots.db"))
+        restarted.create_session(sid, [])
+        assert [h["snapshot_id"] for h in restarted.get_history_list(sid)] == snap_ids
+        assert restarted.get_session(sid)["state_store"].current_snapshot_id == snap_ids[-1]
+
+        restarted.delete_session(sid)
+        assert restarted.snapshot_repo.list_history(sid) == []
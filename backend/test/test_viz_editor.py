@@ -4,6 +4,7 @@ from typing import Any
 
 # 适配引用路径
 from core.generation.viz_editor import VizEditor
+from core.schemas.interaction import InteractionPayload
 
 
 # 简单的 Mock 类模拟 Payload 数据结构
@@ -22,7 +23,8 @@ class TestVizEditor:
 
     @pytest.fixture
     def editor(self, mock_ai_client):
-        return VizEditor(llm_client=mock_ai_client)
+        # 关闭持久化缓存，避免测试之间通过磁盘共享编辑结果
+        return VizEditor(llm_client=mock_ai_client, cache_db=None)
 
     @pytest.fixture
     def sample_code(self):
@@ -100,4 +102,49 @@ def get_dashboard_data(ctx):
 
         # 断言
         assert "```" not in clean_code
-        assert clean_code.startswith("def get_dashboard_data")
\ No newline at end of file
+        assert clean_code.startswith("def get_dashboard_data")
+
+    def test_semantic_tags_serialised_once_per_summary(self, editor):
+        """测试：同一 summaries 重复编辑时复用语义标签的 JSON 文本，标签字典更换后重新序列化"""
+        from unittest.mock import patch
+        import core.generation.viz_editor as ve
+
+        tags = {"lat": "ST_LAT", "lon": "ST_LON"}
+        summaries = [{"variable_name": "df_geo", "semantic_analysis": {"semantic_tags": tags}}]
+
+        with patch.object(ve.json, "dumps", wraps=ve.json.dumps) as dumps:
+            first = editor._get_editor_prompt("code", summaries)
+            second = editor._get_editor_prompt("code", summaries)
+            assert dumps.call_count == 1
+            summaries[0]["semantic_analysis"]["semantic_tags"] = {"lat": "ST_LAT"}
+            third = editor._get_editor_prompt("code", summaries)
+            assert dumps.call_count == 2
+
+        assert first == second
+        assert '"lon": "ST_LON"' in first and "ST_LON" not in third
+
+    def test_editor_prompt_prefix_stable_across_edits(self, editor, sample_summaries):
+        """测试：现有代码位于系统提示词末尾，多轮编辑之间规则 + 语义背景前缀逐字节一致"""
+        first = editor._get_editor_prompt("def get_dashboard_data(data_context):\n    return {}", sample_summaries)
+        second = editor._get_editor_prompt("def get_dashboard_data(data_context):\n    return {'a': 1}", sample_summaries)
+
+        prefix = first[:first.index("=== 现有代码 ===")]
+        assert second.startswith(prefix)
+        assert "=== 数据语义背景 ===" in prefix
+        assert editor._get_editor_prompt("x", list(reversed(sample_summaries))).startswith(prefix)
+
+    def test_identical_edit_served_from_cache(self, editor, mock_ai_client, sample_code, sample_summaries):
+        """测试：相同代码 + 相同交互的重复编辑直接命中缓存，不再调用 LLM；自愈修复后缓存被替换"""
+        mock_ai_client.chat.return_value = "```python\ndef get_dashboard_data(data_context):\n    return {}\n```"
+        payload = InteractionPayload(session_id="s", trigger_type="ui", active_component_id="map", bbox=[0, 0, 1, 1])
+
+        first = editor.edit_dashboard_code(sample_code, payload, sample_summaries)
+        second = editor.edit_dashboard_code(sample_code, payload, sample_summaries)
+
+        assert first == second
+        mock_ai_client.chat.assert_called_once()
+        assert mock_ai_client.chat.call_args.kwargs["temperature"] == 0.0
+
+        editor.remember_fix(first, "fixed")
+        assert editor.edit_dashboard_code(sample_code, payload, sample_summaries) == "fixed"
+        mock_ai_client.chat.assert_called_once()
@@ -0,0 +1,125 @@
+from unittest.mock import MagicMock
+
+# 适配引用路径
+from core.generation.viz_generator import CodeGenerator, _deterministic_fix
+
+
+def test_deterministic_fix_rewrites_data_context_attribute():
+    """测试：以属性方式访问 data_context 时直接改写为下标访问，不调用 LLM"""
+    llm = MagicMock()
+    generator = CodeGenerator(llm, cache_db=None)
+    code = """
+    def get_dashboard_data(data_context):
+        df = data_context.df_trips
+        return {"n": len(data_context.get("df_trips"))}
+    """
+
+    fixed = generator.fix_code(code, "AttributeError: 'dict' object has no attribute 'df_trips'", [])
+
+    assert "data_context['df_trips']" in fixed
+    assert "data_context.get('df_trips')" in fixed
+    llm.chat.assert_not_called()
+
+
+def test_deterministic_fix_imports_and_stray_text():
+    """测试：常用库 NameError 补 import；代码前的说明文字被丢弃；无法处理的错误返回 None"""
+    code = "def get_dashboard_data(data_context):\n    return {'a': np.zeros(1)}"
+
+    fixed = _deterministic_fix(code, "NameError: name 'np' is not defined")
+    assert fixed.startswith("import numpy as np\n")
+
+    chatty = "Here is the code:\n" + code
+    assert _deterministic_fix(chatty, "SyntaxError: invalid syntax (line 1)") == code
+    assert _deterministic_fix(code, "KeyError: 'Zone'") is None
+
+
+def test_paraphrased_query_reuses_code_for_same_plan():
+    """测试：组件规划一致时，措辞不同的查询复用已生成代码；规划不同或意图不同则重新生成"""
+    llm = MagicMock()
+    llm.chat.return_value = "```python\ndef get_dashboard_data(data_context):\n    return {}\n```"
+    generator = CodeGenerator(llm, cache_db=None)
+    plans = [{"id": "c1", "type": "chart", "title": "Trips", "chart_config": {"chart_type": "bar"}}]
+    summaries = [{"variable_name": "df", "basic_stats": {"column_stats": {"zone": {}}}}]
+
+    generator.generate_dashboard_code("Show trips by zone", summaries, plans)
+    calls = llm.chat.call_count
+    generator.generate_dashboard_code("trips per zone", summaries, plans)
+    assert llm.chat.call_count == calls
+
+    generator.generate_dashboard_code("fares per hour", summaries, plans)
+    assert llm.chat.call_count > calls
+    calls = llm.chat.call_count
+    generator.generate_dashboard_code("trips per zone", summaries, [dict(plans[0], title="Other")])
+    assert llm.chat.call_count > calls
+
+
+def test_near_duplicate_requires_same_numbers_and_negation():
+    """测试：年份、Top N、否定词不同的查询即使字面高度相似也不复用；生成固定使用温度 0"""
+    from core.llm.llm_cache import NearDuplicateCache
+
+    cache = NearDuplicateCache("test")
+    cache.set("scope", "分析2024年曼哈顿的订单趋势", "code_2024")
+    cache.set("scope", "前10个区域", "code_top10")
+    cache.set("scope", "周末的订单趋势", "code_weekend")
+
+    assert cache.get("scope", "分析2025年曼哈顿的订单趋势") is None
+    assert cache.get("scope", "前5个区域") is None
+    assert cache.get("scope", "不含周末的订单趋势") is None
+    assert cache.get("scope", "分析2024年曼哈顿订单趋势") == "code_2024"
+
+    llm = MagicMock()
+    llm.chat.return_value = "```python\ndef get_dashboard_data(data_context):\n    return {}\n```"
+    CodeGenerator(llm, cache_db=None).generate_dashboard_code("q", [], [])
+    assert all(c.kwargs["temperature"] == 0.0 for c in llm.chat.call_args_list)
+
+
+def test_near_duplicate_rejects_opposite_ordering_and_extremum_in_long_queries():
+    """测试：长查询只改动排序方向、极值或聚合词时 Jaccard 仍很高，但不得复用相反查询的代码"""
+    from core.llm.llm_cache import NearDuplicateCache
+
+    base = "show the total number of taxi trips for each pickup zone in manhattan during weekday rush hours sorted in {} order"
+    cache = NearDuplicateCache("test")
+    cache.set("scope", base.format("ascending"), "code_asc")
+    cache.set("scope", "统计二零二四年第三季度曼哈顿与布鲁克林各个上车区域在工作日早晚高峰时段的黄色出租车订单数量并按订单数从高到低排列", "code_desc")
+    cache.set("scope", "统计曼哈顿各个上车区域在工作日早晚高峰的出租车订单数量并标出最高的区域", "code_max")
+    cache.set("scope", "plot the maximum fare amount per pickup zone for yellow taxi trips in manhattan and brooklyn during weekday evenings last week", "code_fare_max")
+
+    assert cache.get("scope", base.format("descending")) is None
+    assert cache.get("scope", "统计二零二四年第三季度曼哈顿与布鲁克林各个上车区域在工作日早晚高峰时段的黄色出租车订单数量并按订单数从低到高排列") is None
+    assert cache.get("scope", "统计曼哈顿各个上车区域在工作日早晚高峰的出租车订单数量并标出最低的区域") is None
+    assert cache.get("scope", "plot the minimum fare amount per pickup zone for yellow taxi trips in manhattan and brooklyn during weekday evenings last week") is None
+    assert cache.get("scope", "plot the average fare amount per pickup zone for yellow taxi trips in manhattan and brooklyn during weekday evenings last week") is None
+    # 只有格式/虚词差异的改写仍然复用
+    assert cache.get("scope", base.format("ascending").replace("for each", "per")) == "code_asc"
+
+
+def test_lint_failure_goes_straight_to_fix_code():
+    """测试：生成代码通过静态检查时只调用一次 LLM；未通过时直接带着检查错误进入修复，不再重新生成"""
+    good = "```python\ndef get_dashboard_data(data_context):\n    return {}\n```"
+    llm = MagicMock()
+    llm.chat.return_value = good
+    CodeGenerator(llm, cache_db=None).generate_dashboard_code("q1", [], [])
+    assert llm.chat.call_count == 1
+
+    llm = MagicMock()
+    llm.chat.side_effect = ["```python\nprint('no function')\n```", good]
+    code = CodeGenerator(llm, cache_db=None).generate_dashboard_code("q2", [], [])
+    assert llm.chat.call_count == 2
+    assert "CODE EXECUTION FAILED" in llm.chat.call_args_list[1].args[0][-1]["content"]
+    assert "def get_dashboard_data" in code
+
+
+def test_remember_fix_persists_fixed_code_across_restart(tmp_path):
+    """测试：自愈修复后的代码按缓存键写回持久化层，重启后命中的是修复版本"""
+    db = str(tmp_path / "llm_cache.db")
+    broken = "def get_dashboard_data(data_context):\n    return {\"x\": 1 / 0}"
+    fixed = "def get_dashboard_data(data_context):\n    return {}"
+    llm = MagicMock()
+    llm.chat.return_value = f"```python\n{broken}\n```"
+    generator = CodeGenerator(llm, cache_db=db)
+    assert generator.generate_dashboard_code("q", [], []) == broken
+    generator.remember_fix(broken, fixed)
+
+    restarted = MagicMock()
+    assert CodeGenerator(restarted, cache_db=db).generate_dashboard_code("q", [], []) == fixed
+    restarted.chat.assert_not_called()
@@ -3,7 +3,7 @@ from unittest.mock import MagicMock
 from typing import Dict, Any
 
 from core.services.workflow import AnalysisWorkflow
-from core.schemas.dashboard import DashboardSchema, DashboardComponent, ComponentType
+from core.schemas.dashboard import DashboardSchema, DashboardComponent, ComponentType, InsightCard
 from core.schemas.interaction import InteractionPayload
 from core.execution.executor import DashboardExecutionResult, ComponentResult
 
@@ -56,6 +56,8 @@ class TestAnalysisWorkflow:
         # Mock 所有子模块
         wf.analyzer = MagicMock()
         wf.relation_mapper = MagicMock()  # [新增]
+        wf.interaction_mapper = MagicMock()
+        wf.interaction_mapper.get_planner_hints.return_value = ""
         wf.planner = MagicMock()
         wf.generator = MagicMock()
         wf.editor = MagicMock()
@@ -126,4 +128,76 @@ class TestAnalysisWorkflow:
         workflow.generator.fix_code.assert_called_once()
         # 最终的 metadata 应该保存的是 fixed_code
         call_args = workflow.generator.fix_code.call_args
-        assert call_args.kwargs['original_code'] == "bad_code"
\ No newline at end of file
+        assert call_args.kwargs['original_code'] == "bad_code"
+
+    async def test_stream_backtrack_yields_snapshot(self, workflow):
+        """测试：流式接口在历史回溯时只推送一个携带快照布局的 dashboard 事件"""
+        snapshot = MagicMock()
+        snapshot.layout_data = DashboardSchema(dashboard_id="snap", title="Snap", components=[])
+        session_service = MagicMock()
+        session_service.get_snapshot.return_value = snapshot
+
+        payload = InteractionPayload(session_id="sess_1", trigger_type="backtrack", target_snapshot_id="snap_1")
+        events = [e async for e in workflow.execute_step_stream(payload, [], {}, session_service)]
+
+        assert [e.type for e in events] == ["dashboard"]
+        assert events[0].payload is snapshot.layout_data
+        workflow.planner.plan_dashboard.assert_not_called()
+
+    async def test_coalesce_consecutive_ui_events(self, workflow):
+        """测试：连续 UI 动作合并为一次（后者覆盖前者），自然语言指令保持独立"""
+        events = [
+            InteractionPayload(session_id="sess_1", trigger_type="ui", bbox=[0, 0, 1, 1]),
+            InteractionPayload(session_id="sess_1", trigger_type="ui", time_range=["2025-01-01", "2025-01-02"]),
+            InteractionPayload(session_id="sess_1", trigger_type="ui", bbox=[1, 1, 2, 2]),
+            InteractionPayload(session_id="sess_1", query="Analyze"),
+        ]
+
+        merged = workflow._coalesce_events(events)
+
+        assert len(merged) == 2
+        assert merged[0].bbox == [1, 1, 2, 2]
+        assert merged[0].time_range == ["2025-01-01", "2025-01-02"]
+        assert merged[1].query == "Analyze"
+
+    async def test_layout_round_trips_as_json_bytes(self, workflow, basic_payload):
+        """测试：布局以 JSON 字节存入会话 (不随 metadata 下发)，下一轮编辑模式可从字节还原"""
+        plan = DashboardSchema(
+            dashboard_id="test_dash",
+            title="Test Dashboard",
+            components=[
+                DashboardComponent(
+                    id="chart_1", title="Chart", type=ComponentType.CHART,
+                    layout={"zone": "right_sidebar", "x": 0, "y": 0, "w": 6, "h": 6},
+                    chart_config={"chart_type": "bar", "series_name": "s"}
+                ),
+                DashboardComponent(
+                    id="insight_1", title="Insight", type=ComponentType.INSIGHT,
+                    layout={"zone": "bottom_insight", "x": 6, "y": 0, "w": 6, "h": 6}
+                )
+            ]
+        )
+        workflow.planner.plan_dashboard.return_value = plan
+        workflow.generator.generate_dashboard_code.return_value = "code_v1"
+        workflow.executor.execute_dashboard_logic.return_value = create_mock_exec_result(success=True)
+        workflow.insight_extractor.generate_insights.return_value = InsightCard(summary="S", detail="D")
+        session_service = MagicMock()
+        session_service.get_session.return_value = {"last_workflow_state": None, "data_context": {}}
+        session_service.save_snapshot.return_value = "snap_1"
+
+        dashboard = await workflow.execute_step(basic_payload, [{"variable_name": "A"}], {}, session_service)
+
+        stored = session_service.update_session_metadata.call_args.args[1]
+        assert isinstance(stored["last_layout"], bytes)
+        assert "last_layout" not in dashboard.metadata
+
+        # 第二轮：UI 交互走编辑模式，布局从存档字节还原，不再调用 Planner
+        session_service.get_session.return_value = {"last_workflow_state": stored, "data_context": {}}
+        workflow.editor.edit_dashboard_code.return_value = "code_v2"
+        ui_payload = InteractionPayload(session_id="sess_1", trigger_type="ui", active_component_id="chart_1")
+
+        edited = await workflow.execute_step(ui_payload, [{"variable_name": "A"}], {}, session_service)
+
+        workflow.planner.plan_dashboard.assert_called_once()
+        assert [c.id for c in edited.components] == ["chart_1", "insight_1"]
+        assert workflow.editor.edit_dashboard_code.call_args.kwargs["original_code"] == "code_v1"